@@ -0,0 +1,123 @@
+"""
+Compares how much memory loading large images allocates when they're given to
+Image as in-memory buffers instead of being wrapped in StringIO, and when
+local files are given as paths or memory maps.
+
+Run from the repository root::
+
+    python -m benchmarks.buffers
+
+Each case runs in a fresh process, and the growth of its peak RSS while the
+image is opened and decoded is reported (Linux only).
+"""
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+from PIL import Image as pil_image
+from resizer import Image
+
+SIZE = (6000, 4000)
+
+# Name, mode and format of the sources.
+SOURCES = [
+    ('gray-bmp', 'L', 'BMP'),
+    ('rgba-tiff', 'RGBA', 'TIFF'),
+    ('rgb-ppm', 'RGB', 'PPM'),
+    ('rgb-png', 'RGB', 'PNG'),
+]
+
+
+def make_sources(directory):
+    gradient = pil_image.linear_gradient('L').resize(SIZE)
+    paths = {}
+    for (name, mode, format) in SOURCES:
+        image = pil_image.merge('RGBA', (
+            gradient, gradient.rotate(90).resize(SIZE), gradient, gradient
+        )).convert(mode)
+        path = os.path.join(directory, '%s.%s' % (name, format.lower()))
+        image.save(path, format)
+        paths[name] = path
+    return paths
+
+
+def load_string_io(path):
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    # What callers had to do before: copy the buffer into a string.
+    return lambda: Image(StringIO(str(data)), copy=False)
+
+
+def load_buffer(path):
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    return lambda: Image(data, copy=False)
+
+
+def load_path(path):
+    return lambda: Image(path, copy=False)
+
+
+def load_mmap(path):
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return lambda: Image(data, copy=False)
+
+
+LOADERS = [
+    ('stringio', load_string_io),
+    ('buffer', load_buffer),
+    ('path', load_path),
+    ('mmap', load_mmap),
+]
+
+
+def get_memory(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def run_case(case):
+    # Runs in a fresh process for each case.
+    name, loader, path = case
+    load = dict(LOADERS)[loader](path)
+    # Resets the peak RSS to the current RSS.
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    before = get_memory('VmRSS')
+    start = time.time()
+    image = load()
+    image.load()
+    duration = time.time() - start
+    return name, loader, get_memory('VmHWM') - before, duration
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        paths = make_sources(directory)
+        cases = [
+            (name, loader, paths[name])
+            for (name, _, _) in SOURCES
+            for (loader, _) in LOADERS
+        ]
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            print '%-12s %-10s %10s %10s' % ('source', 'loader', 'peak', 'time')
+            for (name, loader, peak, duration) in pool.imap(run_case, cases):
+                print '%-12s %-10s %8.1fMB %8.1fms' % (
+                    name, loader, peak / 1024.0 / 1024, duration * 1000
+                )
+        finally:
+            pool.terminate()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares the wall time of Resizer.resize_image with and without cascading
+against the number of sizes being generated.
+
+Run from the repository root::
+
+    python -m benchmarks.cascade
+"""
+import time
+from PIL import Image as pil_image
+from resizer import Resizer, Image
+
+SOURCE_SIZE = (6000, 4000)
+MAX_SIZES = 8
+ROUNDS = 3
+
+
+def make_source():
+    # A gradient keeps the resampling filters busy unlike a flat colour.
+    gradient = pil_image.linear_gradient('L').resize(SOURCE_SIZE)
+    source = pil_image.merge('RGB', (gradient, gradient.rotate(90), gradient))
+    source.format = 'JPEG'
+    return Image(source, copy=False)
+
+
+def make_sizes(count):
+    sizes = {}
+    width = 2400
+    for i in xrange(count):
+        sizes['size%d' % i] = (width, width)
+        width = width * 2 / 3
+    return sizes
+
+
+def measure(resizer, source):
+    best = None
+    for _ in xrange(ROUNDS):
+        start = time.time()
+        resizer.resize_image(source)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    source = make_source()
+    print '%5s %10s %10s %8s' % ('sizes', 'plain', 'cascade', 'speedup')
+
+    for count in xrange(1, MAX_SIZES + 1):
+        sizes = make_sizes(count)
+        plain = measure(Resizer(sizes=sizes), source)
+        cascade = measure(Resizer(sizes=sizes, cascade=True), source)
+        print '%5d %9.3fs %9.3fs %7.2fx' % (
+            count, plain, cascade, plain / cascade
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures the per-call overhead of Resizer.resize_image on tiny images, where
+the time spent in Python dominates the time spent resampling pixels, along
+with the cost of reading the size of an Image.
+
+Run from the repository root::
+
+    python -m benchmarks.overhead
+"""
+import timeit
+from PIL import Image as pil_image
+from resizer import Resizer, Image
+
+SIZES = {
+    'large': (12, 12),
+    'medium': (8, 8, 'png'),
+    'small': (4, 4),
+    'original': [],
+}
+CALLS = 20000
+ROUNDS = 5
+
+
+def make_source():
+    source = pil_image.linear_gradient('L').resize((16, 16)).convert('RGB')
+    source.format = 'PNG'
+    return Image(source, copy=False)
+
+
+def measure(function, calls):
+    # Microseconds per call, the best of a few rounds.
+    return min(timeit.repeat(function, number=calls, repeat=ROUNDS)) / calls * 1e6
+
+
+def main():
+    source = make_source()
+    planner = Resizer(sizes=SIZES)
+    cases = [
+        ('Image.size', lambda: source.size, CALLS * 10),
+        ('Image.width', lambda: source.width, CALLS * 10),
+        ('Image.crop', lambda: source.crop((0, 0, 8, 8)), CALLS),
+        ('Resizer.plan', lambda: planner.plan(source), CALLS),
+    ]
+    for (name, kwargs) in [('resize_image', {}),
+                           ('resize_image/precise', {'precise': True}),
+                           ('resize_image/cascade', {'cascade': True})]:
+        resizer = Resizer(sizes=SIZES, **kwargs)
+        cases.append((name, lambda r=resizer: r.resize_image(source), CALLS))
+
+    print '%-24s %10s' % ('case', 'per call')
+    for (name, function, calls) in cases:
+        print '%-24s %8.2fus' % (name, measure(function, calls))
+
+
+if __name__ == '__main__':
+    main()
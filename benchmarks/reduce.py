@@ -0,0 +1,64 @@
+"""
+Compares the wall time of Resizer.resize_image with and without the integer
+reduce step against the target size, for each of the resampling filters.
+
+Run from the repository root::
+
+    python -m benchmarks.reduce
+"""
+import time
+from PIL import Image as pil_image
+from resizer import Resizer, Image
+
+SOURCE_SIZE = (6000, 4000)
+TARGETS = [100, 300, 1000, 2000]
+RESIZE_MODES = [
+    ('antialias', pil_image.ANTIALIAS),
+    ('bicubic', pil_image.BICUBIC),
+    ('bilinear', pil_image.BILINEAR),
+]
+ROUNDS = 3
+
+
+def make_source():
+    # A gradient keeps the resampling filters busy unlike a flat colour.
+    gradient = pil_image.linear_gradient('L').resize(SOURCE_SIZE)
+    source = pil_image.merge('RGB', (gradient, gradient.rotate(90), gradient))
+    source.format = 'JPEG'
+    return Image(source, copy=False)
+
+
+def measure(resizer, source):
+    best = None
+    for _ in xrange(ROUNDS):
+        start = time.time()
+        resizer.resize_image(source)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    source = make_source()
+    print '%-10s %6s %10s %10s %8s' % (
+        'mode', 'size', 'plain', 'reduce', 'speedup'
+    )
+
+    for (name, resize_mode) in RESIZE_MODES:
+        for target in TARGETS:
+            sizes = {'size': (target, target)}
+            plain = measure(
+                Resizer(sizes=sizes, resize_mode=resize_mode), source
+            )
+            reduced = measure(
+                Resizer(sizes=sizes, resize_mode=resize_mode, reduce=True),
+                source
+            )
+            print '%-10s %6d %9.3fs %9.3fs %7.2fx' % (
+                name, target, plain, reduced, plain / reduced
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Measures the throughput of Resizer.resize_many against the number of worker
+processes.
+
+Run from the repository root::
+
+    python -m benchmarks.resize_many
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from PIL import Image as pil_image
+from resizer import Resizer
+
+SOURCE_COUNT = 48
+SOURCE_SIZE = (2000, 1500)
+SIZES = {
+    'large': (1024, 1024),
+    'medium': (500, 500),
+    'small': (200, 200),
+    'thumbnail': (64, 64, 'png'),
+}
+
+
+def make_sources(directory):
+    gradient = pil_image.linear_gradient('L').resize(SOURCE_SIZE)
+    source = pil_image.merge('RGB', (gradient, gradient.rotate(90), gradient))
+    paths = []
+    for i in xrange(SOURCE_COUNT):
+        path = os.path.join(directory, '%d.jpg' % i)
+        source.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        paths = make_sources(directory)
+        resizer = Resizer(sizes=SIZES)
+        print '%7s %10s %12s' % ('workers', 'time', 'images/sec')
+
+        for workers in xrange(1, multiprocessing.cpu_count() + 1):
+            start = time.time()
+            for (_, images) in resizer.resize_many(
+                    paths, workers=workers, encode=True):
+                if isinstance(images, Exception):
+                    raise images
+            elapsed = time.time() - start
+            print '%7d %9.3fs %12.1f' % (
+                workers, elapsed, SOURCE_COUNT / elapsed
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Measures Resizer.resize_image on synthetic sources across combinations of
+precise, crop, adaption_mode and resize_mode, recording images/sec, p50 and
+p99 latency and peak RSS for each combination. The percentiles are nearest
+ranks, so with fewer than 100 runs per case (10 by default, 2 for the huge
+source) the p99 is the slowest run.
+
+Run from the repository root::
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json --threshold 0.15
+
+Each combination runs in a fresh Python process (started with subprocess, not
+forked) so that its peak RSS isn't inflated by the ones before it or by
+generating the sources. The peak RSS is read from VmHWM in /proc/self/status,
+since ru_maxrss carries over the parent's peak across fork and exec. With ``--baseline``, the results are compared against a
+previous run and the exit status is 1 if any of them got worse by more than the
+threshold (a fraction, so 0.15 means 15%).
+"""
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import PIL
+from PIL import Image as pil_image
+from resizer import Resizer
+
+SIZES = {
+    'large': (1024, 768),
+    'medium': (500, 500),
+    'small': (200, 150),
+    'thumbnail': (64, 64, 'png'),
+}
+
+# Name, size, mode and format of the sources.
+SOURCES = [
+    ('jpeg', (1600, 1200), 'RGB', 'JPEG'),
+    ('png', (1600, 1200), 'RGB', 'PNG'),
+    ('alpha', (1600, 1200), 'RGBA', 'PNG'),
+    ('palette', (1600, 1200), 'P', 'PNG'),
+    ('huge', (6000, 4000), 'RGB', 'JPEG'),
+    ('tiny', (48, 32), 'RGB', 'PNG'),
+]
+
+# Name and Resizer arguments of the configurations. Precise resizing without
+# cropping raises for most aspect ratios, so it's left out.
+MODES = [
+    ('fit', {'precise': False}),
+    ('crop', {'precise': True, 'crop': True}),
+]
+ADAPTION_MODES = ['downsize', 'ignore', 'resize']
+RESIZE_MODES = [
+    ('antialias', pil_image.ANTIALIAS),
+    ('bilinear', pil_image.BILINEAR),
+    ('nearest', pil_image.NEAREST),
+]
+
+# Timings that differ by less than this (in seconds) aren't regressions,
+# however large the relative difference, because they're mostly noise.
+MIN_DIFFERENCE = 0.001
+
+# Huge sources take seconds per image, so they're repeated less often.
+REPEAT = 10
+HUGE_REPEAT = 2
+
+
+def make_sources(directory):
+    paths = {}
+    for (name, size, mode, format) in SOURCES:
+        # A gradient keeps the resampling filters and encoders busy unlike a
+        # flat colour.
+        gradient = pil_image.linear_gradient('L').resize(size)
+        image = pil_image.merge(
+            'RGB', (gradient, gradient.rotate(90).resize(size), gradient)
+        )
+        if mode == 'RGBA':
+            image.putalpha(gradient.transpose(pil_image.FLIP_LEFT_RIGHT))
+        elif mode == 'P':
+            image = image.convert('P', palette=pil_image.ADAPTIVE)
+        path = os.path.join(directory, '%s.%s' % (name, format.lower()))
+        image.save(path, format)
+        paths[name] = path
+    return paths
+
+
+def get_cases(paths, repeat):
+    cases = []
+    for (source, _, _, _) in SOURCES:
+        for (mode, kwargs) in MODES:
+            for adaption_mode in ADAPTION_MODES:
+                for (resize_name, resize_mode) in RESIZE_MODES:
+                    name = '%s/%s-%s-%s' % (
+                        source, mode, adaption_mode, resize_name
+                    )
+                    options = dict(
+                        kwargs, adaption_mode=adaption_mode,
+                        resize_mode=resize_mode
+                    )
+                    count = HUGE_REPEAT if source == 'huge' else repeat
+                    cases.append((name, paths[source], options, count))
+    return cases
+
+
+def run_case(case):
+    # Runs the case in a new interpreter, which reports back on stdout.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.suite', '--case', json.dumps(case)],
+        cwd=root
+    )
+    return case[0], json.loads(output)
+
+
+def measure_case(name, path, options, count):
+    resizer = Resizer(sizes=SIZES, **options)
+    resizer.resize_image(path)
+
+    latencies = []
+    for _ in xrange(count):
+        start = time.time()
+        images = resizer.resize_image(path)
+        for image in images.itervalues():
+            image.load()
+        latencies.append(time.time() - start)
+
+    latencies.sort()
+    return {
+        'images_per_sec': count / sum(latencies),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'peak_rss': get_peak_rss(),
+    }
+
+
+def get_peak_rss():
+    # In kilobytes, like ru_maxrss.
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+
+
+def percentile(values, percent):
+    # Nearest rank of sorted values.
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def compare(results, baseline, threshold):
+    # Returns (name, metric, baseline, result) for each regression.
+    regressions = []
+    for (name, result) in sorted(results.iteritems()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ('images_per_sec', 'p50', 'p99', 'peak_rss'):
+            if is_regression(metric, base[metric], result[metric], threshold):
+                regressions.append(
+                    (name, metric, base[metric], result[metric])
+                )
+    return regressions
+
+
+def is_regression(metric, before, after, threshold):
+    if metric == 'images_per_sec':
+        # Compared as the time per image, where larger is worse.
+        before, after = 1 / before, 1 / after
+    if metric != 'peak_rss' and after - before < MIN_DIFFERENCE:
+        return False
+    return after > before * (1 + threshold)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--output', help='write the results to this JSON file')
+    parser.add_option('--baseline', help='compare against this JSON file')
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help='allowed regression as a fraction [%default]')
+    parser.add_option('--repeat', type='int', default=REPEAT,
+                      help='runs per case [%default]')
+    parser.add_option('--filter', default='',
+                      help='only run cases whose name contains this')
+    parser.add_option('--case', help=optparse.SUPPRESS_HELP)
+    options, _ = parser.parse_args()
+
+    if options.case:
+        print json.dumps(measure_case(*json.loads(options.case)))
+        return
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = make_sources(directory)
+        cases = [
+            case for case in get_cases(paths, options.repeat)
+            if options.filter in case[0]
+        ]
+        print '%-32s %10s %10s %10s %10s' % (
+            'case', 'images/sec', 'p50', 'p99', 'peak RSS'
+        )
+        results = {}
+        for case in cases:
+            name, result = run_case(case)
+            results[name] = result
+            print '%-32s %10.1f %9.1fms %9.1fms %8.1fMB' % (
+                name, result['images_per_sec'], result['p50'] * 1000,
+                result['p99'] * 1000, result['peak_rss'] / 1024.0
+            )
+    finally:
+        shutil.rmtree(directory)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'pillow': getattr(PIL, '__version__', None),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, options.threshold)
+        for (name, metric, before, after) in regressions:
+            print 'REGRESSION %s %s: %.4g -> %.4g' % (
+                name, metric, before, after
+            )
+        if regressions:
+            sys.exit(1)
+        print 'No regressions beyond %d%%.' % (options.threshold * 100)
+
+
+if __name__ == '__main__':
+    main()
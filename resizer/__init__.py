@@ -1,7 +1,24 @@
-from .resizer import Resizer
-from .image import Image
+from .resizer import Resizer, Operation, LazyImages
+from .image import Image, LimitExceeded
+from .fetch import Fetcher
+from .cache import OutputCache, SourceCache
+from .trace import add_tracer, remove_tracer
+from .metrics import Metrics
+from .geometry import Operations
+from .batch import BatchError
 
 __all__ = (
     Resizer,
-    Image
+    Operation,
+    Operations,
+    LazyImages,
+    BatchError,
+    Image,
+    LimitExceeded,
+    Fetcher,
+    OutputCache,
+    SourceCache,
+    Metrics,
+    add_tracer,
+    remove_tracer
 )
@@ -0,0 +1,141 @@
+import multiprocessing
+import sys
+import traceback
+import cPickle as pickle
+from collections import deque
+from Queue import Queue
+
+
+class BatchError(Exception):
+    # Not every exception can be pickled, so the worker processes pass back
+    # the type, message and traceback of the error instead.
+    def __init__(self, type, message, traceback=None):
+        Exception.__init__(self, type, message, traceback)
+        self.type = type
+        self.message = message
+        self.traceback = traceback
+
+    def __str__(self):
+        return '%s: %s' % (self.type, self.message)
+
+
+class _Failed(object):
+    # In place of the result of a source that couldn't be submitted.
+    def __init__(self, index, error):
+        self.index = index
+        self.error = error
+
+    def get(self):
+        return self.index, self.error
+
+
+def resize_many(resizer, sources, workers=None, ordered=True,
+                max_pending=None, encode=False):
+    workers = workers or multiprocessing.cpu_count()
+    max_pending = max_pending or workers * 2
+    # The sources and results are pickled here and in the workers, so that
+    # one that can't be pickled is an error of its source instead of
+    # breaking the pool, which would wait for it forever.
+    resizer = _dumps(resizer)
+    pool = multiprocessing.Pool(workers)
+
+    try:
+        if ordered:
+            results = _resize_ordered(
+                pool, resizer, sources, max_pending, encode
+            )
+        else:
+            results = _resize_unordered(
+                pool, resizer, sources, max_pending, encode
+            )
+        for result in results:
+            yield result
+    finally:
+        # Also stops the work in progress if the caller stops iterating early.
+        pool.terminate()
+        pool.join()
+
+
+def _resize_ordered(pool, resizer, sources, max_pending, encode):
+    pending = deque()
+
+    for (index, source) in enumerate(sources):
+        result = _submit(pool, resizer, index, source, encode)
+        pending.append((source, result))
+        if len(pending) >= max_pending:
+            source, result = pending.popleft()
+            yield source, _load(result.get()[1])
+
+    while pending:
+        source, result = pending.popleft()
+        yield source, _load(result.get()[1])
+
+
+def _resize_unordered(pool, resizer, sources, max_pending, encode):
+    done = Queue()
+    pending = {}
+
+    for (index, source) in enumerate(sources):
+        pending[index] = source
+        _submit(pool, resizer, index, source, encode, done.put)
+        if len(pending) >= max_pending:
+            index, images = done.get()
+            yield pending.pop(index), _load(images)
+
+    while pending:
+        index, images = done.get()
+        yield pending.pop(index), _load(images)
+
+
+def _submit(pool, resizer, index, source, encode, callback=None):
+    try:
+        source = _dumps(source)
+    except Exception:
+        result = _Failed(index, _get_error())
+        if callback is not None:
+            callback(result.get())
+        return result
+    return pool.apply_async(
+        _resize, (resizer, index, source, encode), callback=callback
+    )
+
+
+def _resize(resizer, index, source, encode):
+    # Runs in the worker processes. Errors are returned instead of raised so
+    # that one broken source doesn't abort the whole batch.
+    try:
+        resizer = pickle.loads(resizer)
+        images = resizer.resize_image(pickle.loads(source))
+        if encode:
+            images = dict(
+                (name, image.encode()) for (name, image) in images.iteritems()
+            )
+        return index, _dumps(images)
+    except Exception:
+        return index, _get_error()
+
+
+def _load(images):
+    if isinstance(images, BatchError):
+        return images
+    try:
+        return pickle.loads(images)
+    except Exception:
+        return _get_error()
+
+
+def _dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _get_error():
+    type, error, tb = sys.exc_info()
+    try:
+        message = str(error)
+    except Exception:
+        message = repr(error)
+    return BatchError(
+        type.__name__, message, ''.join(traceback.format_exception(
+            type, error, tb
+        ))
+    )
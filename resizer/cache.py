@@ -0,0 +1,406 @@
+from __future__ import with_statement
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from .image import (
+    Image, BUFFER_TYPES, _check_bytes, _check_frame_count, _check_pixels,
+    _get_buffer_length, _fetch_url
+)
+
+MANIFEST = 'manifest.json'
+
+
+class OutputCache(object):
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def resize_image(self, resizer, source):
+        data = _read_source(
+            source, resizer.fetcher, resizer.max_bytes, resizer.max_pixels
+        )
+        key = self._get_key(resizer, data)
+        # The data that was read already is used instead of the source,
+        # without copying it.
+        if not isinstance(data, BUFFER_TYPES):
+            data = buffer(data)
+
+        if resizer.max_pixels is not None or resizer.max_frames is not None:
+            # The entry may have been stored by a resizer without the limits,
+            # so they're checked against the header of the source.
+            Image(data, max_pixels=resizer.max_pixels,
+                  max_frames=resizer.max_frames)
+
+        images = self._load(key, sorted(resizer.sizes))
+        if images is not None:
+            self._count('hits')
+            return images
+
+        self._count('misses')
+        images = resizer._resize_image(data)
+        self._store(key, images, sorted(resizer.sizes))
+        return images
+
+    def clear(self):
+        for path in self._get_entries():
+            self._remove(path)
+        with self._lock:
+            self._size = 0
+
+    def _get_key(self, resizer, data):
+        config = (
+            sorted(
+                (name, tuple(attrs or ()))
+                for (name, attrs) in resizer.sizes.iteritems()
+            ),
+            resizer.crop,
+            resizer.precise,
+            resizer.adaption_mode,
+            resizer.resize_mode,
+            resizer.default_format,
+            resizer.cascade,
+            resizer.cascade_tolerance,
+            resizer.draft,
+            resizer.reduce,
+            resizer.reduce_gap,
+        )
+        key = hashlib.sha1(data)
+        key.update(repr(config))
+        return key.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self, key, names):
+        # The manifest refers to the sizes by their index in names, so the
+        # images are returned under the resizer's own names (JSON would turn
+        # them into unicode). The key covers the names, so they're the same
+        # as when the entry was stored.
+        path = self._get_path(key)
+        try:
+            with open(os.path.join(path, MANIFEST)) as f:
+                manifest = json.load(f)
+            images = {}
+            for (index, filename, ext) in manifest:
+                image = Image(os.path.join(path, filename))
+                image.ext = ext
+                images[names[index]] = image
+            # The modification time of an entry is its last use.
+            os.utime(path, None)
+        except (IOError, OSError):
+            # Not cached, or evicted while loading it.
+            return None
+        return images
+
+    def _store(self, key, images, names):
+        path = self._get_path(key)
+        if os.path.exists(path):
+            return
+
+        parent = os.path.dirname(path)
+        _makedirs(parent)
+
+        # The entry is written to a temporary directory and renamed into place
+        # so that other threads and processes never see an incomplete entry.
+        temp = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+        try:
+            size = 0
+            manifest = []
+            for (i, (name, image)) in enumerate(sorted(images.iteritems())):
+                filename = '%d.%s' % (i, image.ext)
+                data = image.encode()
+                with open(os.path.join(temp, filename), 'wb') as f:
+                    f.write(data)
+                size += len(data)
+                manifest.append((names.index(name), filename, image.ext))
+
+            with open(os.path.join(temp, MANIFEST), 'w') as f:
+                json.dump(manifest, f)
+
+            try:
+                os.rename(temp, path)
+            except OSError, e:
+                # Someone else stored the same entry first.
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+                return
+        finally:
+            if os.path.exists(temp):
+                shutil.rmtree(temp, ignore_errors=True)
+
+        self._grow(size)
+
+    def _grow(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = self._get_size()
+            else:
+                self._size += size
+            if self._size <= self.max_size:
+                return
+        self._evict()
+
+    def _evict(self):
+        # Other processes may have added and removed entries, so the size is
+        # recalculated before evicting the least recently used entries.
+        entries = []
+        for path in self._get_entries():
+            try:
+                entries.append((os.path.getmtime(path), path,
+                                _get_directory_size(path)))
+            except OSError:
+                pass
+        entries.sort()
+
+        size = sum(entry[2] for entry in entries)
+        for (_, path, entry_size) in entries:
+            if size <= self.max_size:
+                break
+            self._remove(path)
+            self._count('evictions')
+            size -= entry_size
+
+        with self._lock:
+            self._size = size
+
+    def _remove(self, path):
+        # Renaming first makes the removal atomic for readers.
+        temp = os.path.join(
+            os.path.dirname(path), '.del-%s-%s' % (os.getpid(), time.time())
+        )
+        try:
+            os.rename(path, temp)
+        except OSError:
+            return
+        shutil.rmtree(temp, ignore_errors=True)
+
+    def _get_entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for prefix in os.listdir(self.directory):
+            parent = os.path.join(self.directory, prefix)
+            if not os.path.isdir(parent):
+                continue
+            for name in os.listdir(parent):
+                if not name.startswith('.'):
+                    entries.append(os.path.join(parent, name))
+        return entries
+
+    def _get_size(self):
+        size = 0
+        for path in self._get_entries():
+            try:
+                size += _get_directory_size(path)
+            except OSError:
+                pass
+        return size
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class SourceCache(object):
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def get(self, source, fetcher=None, max_bytes=None, max_pixels=None,
+            max_frames=None):
+        key, version = self._get_version(source)
+
+        image = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                    entry.version != version or entry.expired()):
+                self._discard(key)
+                self.invalidations += 1
+                entry = None
+            if entry is not None and (
+                    max_frames is not None and entry.frames is None):
+                # Its frames weren't counted, and the shared image can't be
+                # seeked through now, so it's decoded again.
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._clock += 1
+                entry.used = self._clock
+                image = entry.image
+
+        if image is not None:
+            # The image may have been cached for a resizer with other limits.
+            if max_pixels is not None:
+                _check_pixels(image.size, max_pixels)
+            if max_frames is not None:
+                _check_frame_count(entry.frames, max_frames)
+            return image
+
+        # Decoding happens outside of the lock so that other sources can be
+        # used meanwhile.
+        image = Image(source, fetcher=fetcher, max_bytes=max_bytes,
+                      max_pixels=max_pixels)
+        if max_frames is None:
+            frames = image._get_frames(None)
+        else:
+            frames = image._check_frames(max_frames)
+        image.load()
+        size = _get_decoded_size(image)
+        if size > self.max_bytes:
+            return image
+
+        expires = None
+        if _is_url(source):
+            expires = time.time() + self.ttl
+
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._clock += 1
+            self._entries[key] = _SourceCacheEntry(
+                image, version, size, frames, expires, self._clock
+            )
+            self.size += size
+            while self.size > self.max_bytes:
+                self._evict()
+
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _get_version(self, source):
+        # Paths are checked for changes, URLs expire after the TTL.
+        if _is_url(source):
+            return source, None
+        path = os.path.abspath(source)
+        stat = os.stat(path)
+        return path, (stat.st_mtime, stat.st_size)
+
+    def _evict(self):
+        key = min(self._entries, key=lambda key: self._entries[key].used)
+        self._discard(key)
+        self.evictions += 1
+
+    def _discard(self, key):
+        self.size -= self._entries.pop(key).size
+
+    def __getstate__(self):
+        # Decoded images are process-local, so a copy starts out empty.
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_entries'] = {}
+        state['size'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class _SourceCacheEntry(object):
+    # The frames are counted when the image is decoded, since the image is
+    # shared once it's cached. None if they weren't counted.
+    def __init__(self, image, version, size, frames, expires, used):
+        self.image = image
+        self.version = version
+        self.size = size
+        self.frames = frames
+        self.expires = expires
+        self.used = used
+
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+
+def is_cacheable(source):
+    # Images that are already loaded can't be hashed without decoding them.
+    return (
+        isinstance(source, basestring) or isinstance(source, BUFFER_TYPES) or
+        hasattr(source, 'read')
+    )
+
+
+def _is_url(source):
+    return source.startswith('https://') or source.startswith('http://')
+
+
+def _get_decoded_size(image):
+    # PIL stores pixels in 1, 2 or 4 bytes depending on the mode.
+    if image.mode in ('1', 'L', 'P'):
+        pixel_size = 1
+    elif image.mode.startswith('I;16'):
+        pixel_size = 2
+    else:
+        pixel_size = 4
+    return image.width * image.height * pixel_size
+
+
+def _read_source(source, fetcher, max_bytes=None, max_pixels=None):
+    if isinstance(source, basestring):
+        if _is_url(source):
+            # Downloaded like Image does, which rejects images with too many
+            # pixels as soon as their header has arrived.
+            return _fetch_url(source, None, max_bytes, max_pixels, fetcher)
+        with open(source, 'rb') as f:
+            return _read(f, max_bytes)
+    if isinstance(source, BUFFER_TYPES):
+        # Hashed and resized in place.
+        _check_bytes(_get_buffer_length(source), max_bytes)
+        return source
+    return _read(source, max_bytes)
+
+
+def _read(stream, max_bytes):
+    if max_bytes is None:
+        return stream.read()
+    # One more byte than allowed tells whether there's too much.
+    data = stream.read(max_bytes + 1)
+    _check_bytes(len(data), max_bytes)
+    return data
+
+
+def _get_directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+    )
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,327 @@
+from __future__ import with_statement
+import cProfile
+import errno
+import glob
+import json
+import multiprocessing
+import optparse
+import os
+import pstats
+import sys
+import time
+from collections import namedtuple
+from PIL import Image as pil_image
+from .resizer import Resizer
+
+USAGE = '%prog -s SIZES -o TEMPLATE [options] SOURCE...'
+
+DESCRIPTION = (
+    'Resizes the images matching the SOURCE globs, or found in the SOURCE '
+    'directories, to the sizes in the SIZES file, a JSON object of sizes like '
+    'Resizer.sizes. The images are written to the paths given by TEMPLATE, '
+    'in which {name} and {ext} are the name and format of the size, {source} '
+    'and {filename} the file name of the source without and with its '
+    'extension and {dir} its directory, e.g. '
+    '"out/{dir}/{source}-{name}.{ext}". Templates that would write two images '
+    'to the same path are rejected.'
+)
+
+# How many functions the --profile report lists.
+PROFILE_LINES = 30
+
+# What happened to a source. The profile is the stats of cProfile, if
+# profiling.
+Result = namedtuple('Result', 'path outcome files bytes error profile')
+
+# The job of the worker processes, set by _init_worker.
+_job = None
+
+
+class Job(object):
+    def __init__(self, resizer, template, force=False, profile=False):
+        self.resizer = resizer
+        self.template = template
+        self.force = force
+        self.profile = profile
+
+    def __call__(self, path):
+        profile = None
+        if self.profile:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        # Errors are reported instead of raised so that one broken source
+        # doesn't abort the rest.
+        error = None
+        try:
+            outcome, files, written = self._process(path)
+        except Exception, e:
+            outcome, files, written = 'failed', 0, 0
+            error = '%s: %s' % (type(e).__name__, e)
+
+        stats = None
+        if profile is not None:
+            profile.disable()
+            profile.create_stats()
+            stats = profile.stats
+        return Result(path, outcome, files, written, error, stats)
+
+    def _process(self, path):
+        # Opening the source only reads its header, which is enough to plan
+        # and to know the formats of the targets.
+        image, owned = self.resizer._open_source(path)
+        plan = self.resizer._plan(image)
+        targets = dict(
+            (name, self._get_target(path, name, operation.format))
+            for (name, operation) in plan.iteritems()
+            if operation.outcome != 'ignored'
+        )
+        duplicate = _find_duplicate(sorted(targets.iteritems()))
+        if duplicate is not None:
+            raise ValueError(
+                'Sizes %r and %r would be written to the same path.' %
+                duplicate
+            )
+        if not self.force and _is_up_to_date(path, targets.values()):
+            return 'skipped', 0, 0
+
+        for target in targets.itervalues():
+            _make_directory(os.path.dirname(target))
+        images = self.resizer._execute(image, plan, owned)
+        # The sources are spread over the processes already.
+        written = self.resizer.save_all(images, targets, threads=1)
+        return 'resized', len(written), sum(written.itervalues())
+
+    def _get_target(self, path, name, ext):
+        directory, filename = os.path.split(path)
+        return self.template.format(
+            name=name, ext=ext, source=os.path.splitext(filename)[0],
+            filename=filename, dir=directory or os.curdir
+        )
+
+
+class _Profile(object):
+    # What pstats loads the stats of a profile from.
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def main(argv=None):
+    parser = _get_parser()
+    options, inputs = parser.parse_args(argv)
+    if options.sizes is None:
+        parser.error('the sizes (-s) are required')
+    if options.output is None:
+        parser.error('the output template (-o) is required')
+    if not inputs:
+        parser.error('no sources given')
+    if options.jobs < 1:
+        parser.error('the number of jobs must be positive')
+
+    try:
+        sizes = load_sizes(options.sizes)
+        resizer = Resizer(
+            sizes=sizes, crop=options.crop, precise=options.precise,
+            adaption_mode=options.adaption_mode, cascade=options.cascade,
+            draft=options.draft
+        )
+    except (IOError, ValueError), e:
+        parser.error('invalid sizes: %s' % e)
+
+    sources = find_sources(inputs)
+    job = Job(resizer, options.output, options.force, options.profile)
+    try:
+        duplicate = _find_duplicate(
+            ((path, name), job._get_target(path, name, '{ext}'))
+            for path in sources for name in sorted(sizes)
+        )
+    except (KeyError, IndexError, ValueError), e:
+        parser.error('invalid output template: %s' % e)
+    if duplicate is not None:
+        parser.error(
+            '%s (%s) and %s (%s) would be written to the same path' %
+            (duplicate[0] + duplicate[1])
+        )
+
+    counts = {'resized': 0, 'skipped': 0, 'failed': 0}
+    files = written = 0
+    profiles = []
+    start = time.time()
+
+    for (index, result) in enumerate(_run(job, sources, options.jobs)):
+        counts[result.outcome] += 1
+        files += result.files
+        written += result.bytes
+        if result.profile is not None:
+            profiles.append(result.profile)
+        if result.error is not None:
+            print >> sys.stderr, '[%d/%d] failed %s: %s' % (
+                index + 1, len(sources), result.path, result.error
+            )
+        elif not options.quiet:
+            print '[%d/%d] %s %s' % (
+                index + 1, len(sources), result.outcome, result.path
+            )
+
+    elapsed = time.time() - start
+    print '%d sources: %d resized, %d skipped, %d failed' % (
+        len(sources), counts['resized'], counts['skipped'], counts['failed']
+    )
+    print '%d images written (%.1f MB) in %.2fs, %.1f sources/s' % (
+        files, written / 1e6, elapsed, len(sources) / max(elapsed, 1e-6)
+    )
+
+    if profiles:
+        _print_profile(profiles)
+
+    return 1 if counts['failed'] else 0
+
+
+def load_sizes(path):
+    with open(path) as f:
+        sizes = json.load(f)
+    if not isinstance(sizes, dict):
+        raise ValueError('%s must contain an object of sizes.' % path)
+    return sizes
+
+
+def find_sources(inputs):
+    # Globs and paths of files are taken as they are, directories are
+    # searched for images PIL can open.
+    sources = []
+    seen = set()
+    for input in inputs:
+        if glob.has_magic(input):
+            paths = sorted(glob.glob(input))
+        else:
+            paths = [input]
+        for path in paths:
+            if os.path.isdir(path):
+                found = _walk(path)
+            else:
+                found = [path]
+            for source in found:
+                if source not in seen:
+                    seen.add(source)
+                    sources.append(source)
+    return sources
+
+
+def _find_duplicate(targets):
+    # Returns the first two keys of the (key, target) pairs with the same
+    # target. The formats of the sizes aren't known before opening the
+    # sources, so they're left as "{ext}" when checking the template.
+    seen = {}
+    for (key, target) in targets:
+        if target in seen:
+            return seen[target], key
+        seen[target] = key
+    return None
+
+
+def _walk(directory):
+    extensions = _get_extensions()
+    for (root, directories, filenames) in os.walk(directory):
+        directories.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                yield os.path.join(root, filename)
+
+
+def _get_extensions():
+    pil_image.init()
+    return set(
+        extension for (extension, format) in pil_image.EXTENSION.iteritems()
+        if format in pil_image.OPEN
+    )
+
+
+def _run(job, sources, jobs):
+    if jobs == 1 or len(sources) < 2:
+        for source in sources:
+            yield job(source)
+        return
+
+    pool = multiprocessing.Pool(jobs, _init_worker, (job,))
+    try:
+        for result in pool.imap_unordered(_run_job, sources):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _init_worker(job):
+    global _job
+    _job = job
+
+
+def _run_job(path):
+    return _job(path)
+
+
+def _is_up_to_date(source, targets):
+    # Like make, the targets are up to date unless the source is newer.
+    modified = os.path.getmtime(source)
+    for target in targets:
+        try:
+            if os.path.getmtime(target) < modified:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _make_directory(directory):
+    # The other processes may be creating the same directories.
+    if not directory:
+        return
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _print_profile(profiles):
+    stats = pstats.Stats(_Profile(profiles[0]))
+    for profile in profiles[1:]:
+        stats.add(_Profile(profile))
+    print
+    stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+
+
+def _get_parser():
+    parser = optparse.OptionParser(usage=USAGE, description=DESCRIPTION)
+    parser.add_option('-s', '--sizes', metavar='FILE',
+                      help='JSON file of the sizes')
+    parser.add_option('-o', '--output', metavar='TEMPLATE',
+                      help='template of the paths of the resized images')
+    parser.add_option('-j', '--jobs', type='int', metavar='N',
+                      default=multiprocessing.cpu_count(),
+                      help='number of worker processes [%default]')
+    parser.add_option('-f', '--force', action='store_true', default=False,
+                      help='resize sources even if their images are newer')
+    parser.add_option('-q', '--quiet', action='store_true', default=False,
+                      help="don't list the sources as they're done")
+    parser.add_option('--profile', action='store_true', default=False,
+                      help='print a cProfile report of resizing the sources')
+    parser.add_option('--precise', action='store_true', default=False,
+                      help='resize to the exact sizes')
+    parser.add_option('--no-crop', dest='crop', action='store_false',
+                      default=True, help="don't crop precise sizes")
+    parser.add_option('--adaption-mode', default='downsize',
+                      choices=['ignore', 'throw', 'downsize', 'resize'],
+                      help='for sources smaller than a size [%default]')
+    parser.add_option('--cascade', action='store_true', default=False,
+                      help='resize the smaller sizes from the larger ones')
+    parser.add_option('--draft', action='store_true', default=False,
+                      help='decode JPEGs at reduced resolution when possible')
+    return parser
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+from __future__ import with_statement
+import multiprocessing
+from .pool import get_thread_pool
+from . import trace
+
+
+def encode_all(resizer, images, threads=None):
+    def encode(name):
+        return name, _encode(name, images[name])
+
+    return dict(_map(resizer, encode, images, threads))
+
+
+def save_all(resizer, images, destination, threads=None):
+    def save(name):
+        image = images[name]
+        data = _encode(name, image)
+        target = _get_target(destination, name, image)
+        if isinstance(target, basestring):
+            with open(target, 'wb') as f:
+                f.write(data)
+        else:
+            target.write(data)
+        return name, len(data)
+
+    return dict(_map(resizer, save, images, threads))
+
+
+def _map(resizer, function, images, threads):
+    # The images are looked up in the threads, so lazy images are rendered
+    # there as well.
+    names = list(images)
+    threads = threads or resizer.threads or multiprocessing.cpu_count()
+    if threads == 1 or len(names) < 2:
+        return map(function, names)
+    # PIL releases the GIL while encoding, so the threads run in parallel.
+    return get_thread_pool(threads, 'encode').map(function, names)
+
+
+def _encode(name, image):
+    # Traced here instead of in Image.encode, which doesn't know the name.
+    start = trace.tracers and trace.start()
+    data = image._encode({})
+    if start:
+        trace.emit('encode', start, name=name, format=image.ext,
+                   size=image.size, bytes=len(data))
+    return data
+
+
+def _get_target(destination, name, image):
+    # Either a template for the paths or a dict of paths or file objects.
+    if isinstance(destination, basestring):
+        return destination.format(name=name, ext=image.ext)
+    return destination[name]
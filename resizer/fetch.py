@@ -0,0 +1,263 @@
+from __future__ import with_statement
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+RETRY_STATUSES = (502, 503, 504)
+
+
+def open_url(url, timeout=None):
+    connect_timeout, read_timeout = _parse_timeout(timeout)
+
+    def request(url):
+        connection, path = _connect(url, connect_timeout, read_timeout)
+        # With "Connection: close" the response takes over the socket and
+        # closes it when it's closed itself.
+        connection.request('GET', path, headers={'Connection': 'close'})
+        return connection.getresponse()
+
+    return _follow_redirects(request, url)
+
+
+class Fetcher(object):
+    def __init__(self, max_connections=4, retries=2, backoff=0.1,
+                 timeout=None):
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def open_url(self, url, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        connect_timeout, read_timeout = _parse_timeout(timeout)
+
+        def request(url):
+            return self._request_with_retries(
+                url, connect_timeout, read_timeout
+            )
+
+        return _follow_redirects(request, url)
+
+    def close(self):
+        with self._lock:
+            hosts = self._hosts.values()
+        for host in hosts:
+            host.close()
+
+    def _request_with_retries(self, url, connect_timeout, read_timeout):
+        attempt = 0
+
+        while True:
+            try:
+                response = self._request(url, connect_timeout, read_timeout)
+            except (socket.error, httplib.HTTPException):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if (response.status not in RETRY_STATUSES or
+                        attempt >= self.retries):
+                    return response
+                _discard(response)
+
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def _request(self, url, connect_timeout, read_timeout):
+        parts = urlparse.urlsplit(url)
+        host = self._get_host(parts.scheme, parts.netloc)
+        path = _get_path(parts, _get_proxy(parts))
+        host.acquire()
+
+        try:
+            connection = host.take_idle()
+            if connection is not None:
+                try:
+                    return self._send(host, connection, path, read_timeout)
+                except (socket.error, httplib.HTTPException):
+                    # The server has probably closed the idle connection, so
+                    # try again with a new one.
+                    connection.close()
+
+            connection, path = _connect(url, connect_timeout, read_timeout)
+            return self._send(host, connection, path, read_timeout)
+        except:
+            host.release(None)
+            raise
+
+    def _send(self, host, connection, path, read_timeout):
+        try:
+            connection.sock.settimeout(read_timeout)
+            connection.request('GET', path)
+            return _PooledResponse(host, connection, connection.getresponse())
+        except:
+            connection.close()
+            raise
+
+    def _get_host(self, scheme, netloc):
+        with self._lock:
+            host = self._hosts.get((scheme, netloc))
+            if host is None:
+                host = self._hosts[(scheme, netloc)] = _Host(
+                    self.max_connections
+                )
+            return host
+
+    def __getstate__(self):
+        # The connections can't be shared with other processes.
+        state = self.__dict__.copy()
+        del state['_hosts']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+
+class _Host(object):
+    def __init__(self, max_connections):
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        self._semaphore.acquire()
+
+    def release(self, connection):
+        if connection is not None:
+            with self._lock:
+                self._idle.append(connection)
+        self._semaphore.release()
+
+    def take_idle(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class _PooledResponse(object):
+    # Returns the connection to the pool once the response is closed, if the
+    # whole response has been read and the server keeps the connection alive.
+    def __init__(self, host, connection, response):
+        self._host = host
+        self._connection = connection
+        self._response = response
+
+    def close(self):
+        if self._host is None:
+            return
+
+        host, self._host = self._host, None
+        if self._response.isclosed() and not self._response.will_close:
+            host.release(self._connection)
+        else:
+            self._response.close()
+            self._connection.close()
+            host.release(None)
+
+    def drain(self):
+        # Reading the rest of a small response allows reusing the connection.
+        self._response.read()
+        self.close()
+
+    def __getattr__(self, attr):
+        return getattr(self._response, attr)
+
+
+def _follow_redirects(request, url):
+    for _ in xrange(MAX_REDIRECTS + 1):
+        response = request(url)
+
+        if response.status in REDIRECT_STATUSES:
+            location = response.getheader('location')
+            _discard(response)
+            if not location:
+                raise urllib2.HTTPError(
+                    url, response.status, 'Redirect without a location',
+                    response.msg, None
+                )
+            url = urlparse.urljoin(url, location)
+            continue
+
+        if response.status != 200:
+            _discard(response)
+            raise urllib2.HTTPError(
+                url, response.status, response.reason, response.msg, None
+            )
+
+        return response
+
+    raise IOError('Too many redirects: %s' % url)
+
+
+def _discard(response):
+    if isinstance(response, _PooledResponse):
+        response.drain()
+    else:
+        response.close()
+
+
+def _connect(url, connect_timeout, read_timeout):
+    parts = urlparse.urlsplit(url)
+    proxy = _get_proxy(parts)
+    if parts.scheme == 'https':
+        connection = httplib.HTTPSConnection(
+            proxy or parts.netloc, timeout=connect_timeout
+        )
+        if proxy is not None:
+            connection.set_tunnel(parts.netloc)
+    else:
+        connection = httplib.HTTPConnection(
+            proxy or parts.netloc, timeout=connect_timeout
+        )
+
+    connection.connect()
+    connection.sock.settimeout(read_timeout)
+    return connection, _get_path(parts, proxy)
+
+
+def _get_proxy(parts):
+    # Like urllib2, the proxies are taken from the environment (http_proxy,
+    # https_proxy and no_proxy). Returns the host and port of the proxy.
+    proxy = urllib.getproxies().get(parts.scheme)
+    if not proxy or urllib.proxy_bypass(parts.netloc):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    return urlparse.urlsplit(proxy).netloc.rpartition('@')[2]
+
+
+def _get_path(parts, proxy=None):
+    # HTTPS is tunneled through proxies, plain HTTP requests the whole URL.
+    if proxy is not None and parts.scheme != 'https':
+        return urlparse.urlunsplit(parts[:4] + ('',))
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return path
+
+
+def _parse_timeout(timeout):
+    # Either a single timeout for connecting and reading or a tuple of
+    # (connect timeout, read timeout) like the requests library takes.
+    if timeout is None:
+        return socket._GLOBAL_DEFAULT_TIMEOUT, socket.getdefaulttimeout()
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
@@ -0,0 +1,160 @@
+from .image import Size
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# What each outcome is stored as in Operations.outcome.
+OUTCOMES = (None, 'ignored', 'downsized', 'resized', 'thrown')
+NONE, IGNORED, DOWNSIZED, RESIZED, THROWN = range(len(OUTCOMES))
+
+
+class Operations(object):
+    # Operation for a size and many sources as arrays, one row per source.
+    def __init__(self, count, format=None, options=None):
+        self.size = numpy.zeros((count, 2), dtype=numpy.int64)
+        self.crop = numpy.zeros((count, 4), dtype=numpy.int64)
+        self.intermediate = numpy.zeros((count, 2), dtype=numpy.int64)
+        self.outcome = numpy.zeros(count, dtype=numpy.int8)
+        self.format = format
+        self.options = options
+
+    def __len__(self):
+        return len(self.outcome)
+
+    def __getitem__(self, index):
+        from .resizer import Operation
+
+        outcome = OUTCOMES[self.outcome[index]]
+        if outcome == 'thrown':
+            raise ValueError('Planning this size raises for the source.')
+        return Operation(
+            size=_get_size(self.size[index]),
+            format=self.format,
+            crop=_get_box(self.crop[index]),
+            intermediate=_get_size(self.intermediate[index]),
+            outcome=outcome,
+            options=self.options,
+        )
+
+
+def plan_many(resizer, widths, heights, ext=None):
+    if numpy is None:
+        raise ValueError('NumPy is required to plan many sizes at once.')
+
+    widths = numpy.asarray(widths, dtype=numpy.int64)
+    heights = numpy.asarray(heights, dtype=numpy.int64)
+    if widths.ndim != 1 or widths.shape != heights.shape:
+        raise ValueError('Widths and heights must be 1-d and of equal length.')
+    if (widths <= 0).any() or (heights <= 0).any():
+        raise ValueError('Widths and heights must be positive.')
+
+    plan = {}
+    ext = ext or resizer.default_format
+    for (name, size, format, options) in resizer._get_specs():
+        if format is None:
+            format = ext
+        format = format or resizer.default_format
+        operations = plan[name] = Operations(len(widths), format, options)
+        if size is not None:
+            rows = numpy.arange(len(widths))
+            _plan_size(resizer, operations, rows, widths, heights, size)
+    return plan
+
+
+def _plan_size(resizer, operations, rows, widths, heights, size):
+    smaller = (widths < size.width) | (heights < size.height)
+    if smaller.any():
+        _plan_adaption(
+            resizer, operations, rows[smaller], widths[smaller],
+            heights[smaller], size
+        )
+
+    larger = ~smaller
+    rows, widths, heights = rows[larger], widths[larger], heights[larger]
+    if resizer.precise:
+        _plan_precise(resizer, operations, rows, widths, heights, size)
+    else:
+        _plan_common(operations, rows, widths, heights, size)
+
+
+def _plan_common(operations, rows, widths, heights, size):
+    operations.size[rows] = numpy.column_stack(
+        _get_projected_size(widths, heights, size.width, size.height)
+    )
+
+
+def _plan_precise(resizer, operations, rows, widths, heights, size):
+    projected_widths, projected_heights = _get_projected_size(
+        widths, heights, size.width, size.height
+    )
+    exact = (
+        (projected_widths == size.width) & (projected_heights == size.height)
+    )
+    operations.size[rows[exact]] = size
+
+    rows, widths, heights = rows[~exact], widths[~exact], heights[~exact]
+    if not resizer.crop:
+        operations.outcome[rows] = THROWN
+        return
+
+    crop_widths, crop_heights = _get_projected_size(
+        size.width, size.height, widths, heights
+    )
+    operations.crop[rows, 2] = crop_widths
+    operations.crop[rows, 3] = crop_heights
+    _plan_common(operations, rows, crop_widths, crop_heights, size)
+
+
+def _plan_adaption(resizer, operations, rows, widths, heights, size):
+    if resizer.adaption_mode == 'ignore':
+        operations.outcome[rows] = IGNORED
+    elif resizer.adaption_mode == 'throw':
+        operations.outcome[rows] = THROWN
+    elif resizer.adaption_mode == 'downsize':
+        _plan_common(operations, rows, widths, heights, size)
+        operations.outcome[rows] = DOWNSIZED
+    elif resizer.adaption_mode == 'resize':
+        widths, heights = _get_projected_size(
+            widths, heights, size.width, size.height, smallest=False
+        )
+        _plan_size(resizer, operations, rows, widths, heights, size)
+        # Like Resizer, the outermost intermediate size is the one kept and
+        # raising takes precedence.
+        operations.intermediate[rows] = numpy.column_stack((widths, heights))
+        thrown = operations.outcome[rows] == THROWN
+        operations.outcome[rows[~thrown]] = RESIZED
+    else:
+        raise ValueError('Unknown adaption mode.')
+
+
+def _get_projected_size(small_width, small_height, large_width, large_height,
+                        smallest=True):
+    # The same floating point operations as Resizer._get_projected_size.
+    width_ratio = numpy.true_divide(large_width, small_width)
+    height_ratio = numpy.true_divide(large_height, small_height)
+    if smallest:
+        ratio = numpy.minimum(width_ratio, height_ratio)
+    else:
+        ratio = numpy.maximum(width_ratio, height_ratio)
+    return _round(small_width * ratio), _round(small_height * ratio)
+
+
+def _round(values):
+    # Python 2 rounds halves away from zero, numpy.round to even. Subtracting
+    # the floor is exact, so comparing the remainder rounds like round().
+    floor = numpy.floor(values)
+    return floor.astype(numpy.int64) + (values - floor >= 0.5)
+
+
+def _get_size(row):
+    if not row.any():
+        return None
+    return Size(int(row[0]), int(row[1]))
+
+
+def _get_box(row):
+    if not row.any():
+        return None
+    return tuple(int(value) for value in row)
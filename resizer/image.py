@@ -1,6 +1,18 @@
-import urllib2
+from __future__ import with_statement
+import mmap
+import os
+from cStringIO import StringIO as BufferReader
 from StringIO import StringIO
 from PIL import Image as pil_image
+from . import fetch, trace
+
+# The size of the chunks images are downloaded in and how much of an image
+# may be downloaded before its header must have been recognized.
+CHUNK_SIZE = 16 * 1024
+HEADER_LIMIT = 1024 * 1024
+
+# Sources that are read in place rather than copied. str is a path or URL.
+BUFFER_TYPES = (bytearray, buffer, memoryview, mmap.mmap)
 
 try:
     from collections import namedtuple
@@ -40,26 +52,76 @@ except ImportError:
             return str(self)
 
 
+class LimitExceeded(ValueError):
+    def __init__(self, message, limit, value):
+        ValueError.__init__(self, message)
+        self.limit = limit
+        self.value = value
+
+    def __reduce__(self):
+        # The arguments are needed to unpickle (e.g. in resize_many), but only
+        # the message is passed on so that it's what str() gives.
+        return type(self), (self.args[0], self.limit, self.value)
+
+
 class Image(object):
-    def __init__(self, source, copy=True):
-        if isinstance(source, str) or isinstance(source, unicode):
+    # Images are created for every size of every source, so they're kept
+    # small and the frequently used attributes avoid __getattr__.
+    __slots__ = (
+        '_pil_image', '_pil_size', '_size', 'ext', 'options',
+        # The encoded source (a path or a buffer) and its format, for as long
+        # as the pixels are those of the source, see _can_stream.
+        '_origin', '_origin_format', '_origin_im',
+        # Whether the pixels are shared with another image, see _share.
+        '_shared',
+    )
+
+    def __init__(self, source, copy=True, timeout=None, max_bytes=None,
+                 max_pixels=None, fetcher=None, max_frames=None):
+        self._clear()
+        if isinstance(source, pil_image.Image):
+            self._load_from_pil_image(source, copy)
+        elif isinstance(source, str) or isinstance(source, unicode):
             if source.startswith('https://') or source.startswith('http://'):
-                self._load_from_url(source)
+                self._load_from_url(
+                    source, timeout, max_bytes, max_pixels, fetcher
+                )
             else:
-                self._load_from_file_path(source)
-        elif isinstance(source, pil_image.Image):
-            self._load_from_pil_image(source, copy)
+                self._load_from_file_path(source, max_bytes)
+        elif isinstance(source, BUFFER_TYPES):
+            self._load_from_buffer(source, max_bytes)
         elif isinstance(source, Image):
             self._load_from_image(source, copy)
         else:
-            self._load_from_file_object(source)
+            self._load_from_file_object(source, max_bytes)
+
+        # Only the header has been read so far, unless the source was decoded
+        # already.
+        self._check_limits(max_pixels, max_frames)
 
         format = self._pil_image.format
         self.ext = format.lower() if format else None
 
+    def _clear(self):
+        self._pil_size = self._size = None
+        self.ext = self.options = None
+        self._origin = self._origin_format = self._origin_im = None
+        self._shared = False
+
+    @classmethod
+    def open_async(cls, source, callback=None, **kwargs):
+        from .tasks import open_async
+        return open_async(source, callback, **kwargs)
+
     @property
     def size(self):
-        return Size(*self._pil_image.size)
+        # PIL replaces the size tuple whenever the size changes (e.g. when
+        # drafting), so it's only wrapped again then.
+        size = self._pil_image.size
+        if size is not self._pil_size:
+            self._size = Size(*size)
+            self._pil_size = size
+        return self._size
 
     @property
     def width(self):
@@ -78,14 +140,337 @@ class Image(object):
         else:
             self._pil_image = source
 
-    def _load_from_file_path(self, source):
+    def _load_from_file_path(self, source, max_bytes):
+        if max_bytes is not None:
+            _check_bytes(os.path.getsize(source), max_bytes)
+        # PIL maps uncompressed files it opens by path instead of reading them.
         self._pil_image = pil_image.open(source)
+        self._set_origin(source)
 
-    def _load_from_url(self, source):
-        self._load_from_file_object(StringIO(urllib2.urlopen(source).read()))
+    def _load_from_buffer(self, source, max_bytes):
+        _check_bytes(_get_buffer_length(source), max_bytes)
+        # Unlike StringIO, cStringIO reads straight from the buffer.
+        self._pil_image = pil_image.open(BufferReader(source))
+        self._set_origin(source)
+        if _map_pixels(self._pil_image, source):
+            self._origin_im = self._pil_image.im
+
+    def _set_origin(self, origin):
+        self._origin = origin
+        self._origin_format = self._pil_image.format
+
+    def _share(self, owned=True):
+        # A copy that shares the pixels of the image, marked read-only so that
+        # PIL copies them before it's modified, like it does for memory-mapped
+        # images. The image itself has to stay as it is, so the pixels of
+        # images that belong to the caller are copied instead.
+        image = Image.__new__(Image)
+        image._clear()
+        pil = self._pil_image
+        if pil.im is None and self._origin is not None:
+            # Not decoded yet, opening the source again is cheaper.
+            if isinstance(self._origin, basestring):
+                image._load_from_file_path(self._origin, None)
+            else:
+                image._load_from_buffer(self._origin, None)
+        elif not owned:
+            image._pil_image = pil.copy()
+        else:
+            pil.load()
+            if self._origin is not None and self._origin_im is None:
+                # Decoded from the source and not modified since.
+                self._origin_im = pil.im
+            image._pil_image = pil._new(pil.im)
+            image._pil_image.readonly = 1
+            image._shared = True
+            if self._origin is not None and pil.im is self._origin_im:
+                image._origin = self._origin
+                image._origin_format = self._origin_format
+                image._origin_im = image._pil_image.im
+        image.ext = self.ext
+        image.options = self.options
+        return image
 
-    def _load_from_file_object(self, source):
+    def load(self):
+        # The pixel access object writes to the pixels directly, bypassing
+        # the copy-on-write of read-only images, so an image sharing its
+        # pixels gets a copy of its own first.
+        pil = self._pil_image
+        if self._shared and pil.readonly:
+            pil._copy()
+        return pil.load()
+
+    def _can_stream(self):
+        # Whether the pixels are still those of the source: either not decoded
+        # yet or decoded and never modified, since PIL replaces the pixels of
+        # read-only images before modifying them.
+        if self._origin is None:
+            return False
+        im = self._pil_image.im
+        return im is None or (
+            im is self._origin_im and self._pil_image.readonly
+        )
+
+    def _load_from_url(self, source, timeout, max_bytes, max_pixels,
+                       fetcher):
+        data = _fetch_url(source, timeout, max_bytes, max_pixels, fetcher)
+        self._load_from_buffer(buffer(data), None)
+
+    def _check_limits(self, max_pixels, max_frames):
+        if max_pixels is not None:
+            _check_pixels(self._pil_image.size, max_pixels)
+        if max_frames is not None:
+            self._check_frames(max_frames)
+
+    def _check_frames(self, max_frames):
+        frames = self._get_frames(max_frames + 1)
+        _check_frame_count(frames, max_frames)
+        return frames
+
+    def _get_frames(self, limit):
+        # Counting the frames of GIFs seeks through them, so it's only done up
+        # to a limit (and not at all without one).
+        if self._pil_image.format == 'GIF':
+            if limit is None:
+                return None
+            return _count_frames(self._pil_image, limit)
+        return getattr(self._pil_image, 'n_frames', 1)
+
+    def _load_from_file_object(self, source, max_bytes):
+        if max_bytes is not None:
+            length = _get_remaining_length(source)
+            if length is not None:
+                _check_bytes(length, max_bytes)
         self._pil_image = pil_image.open(source)
 
+    def encode(self, **options):
+        start = trace.tracers and trace.start()
+        data = self._encode(options)
+        if start:
+            trace.emit('encode', start, format=self.ext, size=self.size,
+                       bytes=len(data))
+        return data
+
+    def _encode(self, options):
+        # Options given here take precedence over those of the size.
+        options = dict(self.options or {}, **options)
+        if not self.ext:
+            raise ValueError('Image has no format to encode in.')
+        if not options and self._can_stream_as(_get_pil_format(self.ext)):
+            # Encoding the same pixels in the same format again would only
+            # lose quality.
+            return _read_origin(self._origin)
+        data = StringIO()
+        self._pil_image.save(data, _get_pil_format(self.ext), **options)
+        return data.getvalue()
+
+    def save(self, fp, format=None, **params):
+        # Like PIL, the format defaults to that of the file name's extension.
+        pil_format = format
+        filename = fp
+        if not isinstance(fp, basestring):
+            filename = getattr(fp, 'name', None)
+        if pil_format is None and isinstance(filename, basestring):
+            pil_format = _get_pil_format(os.path.splitext(filename)[1][1:])
+        if (not params and pil_format and
+                self._can_stream_as(pil_format.upper())):
+            data = _read_origin(self._origin)
+            if isinstance(fp, basestring):
+                with open(fp, 'wb') as f:
+                    f.write(data)
+            else:
+                fp.write(data)
+            return
+        self._pil_image.save(fp, format, **params)
+
+    def _can_stream_as(self, format):
+        return self._can_stream() and format == self._origin_format
+
+    # Frequently used methods of the PIL image, defined here so that they
+    # don't go through __getattr__.
+    @property
+    def resize(self):
+        return self._pil_image.resize
+
+    @property
+    def crop(self):
+        return self._pil_image.crop
+
+    def __getstate__(self):
+        # Buffers can't be pickled and the pixels are pickled anyway.
+        return {
+            '_pil_image': self._pil_image,
+            'ext': self.ext,
+            'options': self.options,
+        }
+
+    def __setstate__(self, state):
+        self._clear()
+        for (attr, value) in state.iteritems():
+            setattr(self, attr, value)
+
     def __getattr__(self, attr):
+        if attr in Image.__slots__:
+            # Not set (e.g. while unpickling), don't look it up on the PIL
+            # image.
+            raise AttributeError(attr)
         return getattr(self._pil_image, attr)
+
+
+def _check_bytes(length, max_bytes):
+    if max_bytes is not None and length > max_bytes:
+        raise LimitExceeded(
+            'Image is larger than the limit of %d bytes.' % max_bytes,
+            'max_bytes', length
+        )
+
+
+def _fetch_url(url, timeout=None, max_bytes=None, max_pixels=None,
+              fetcher=None):
+    start = trace.tracers and trace.start()
+    if fetcher is None:
+        response = fetch.open_url(url, timeout)
+    else:
+        response = fetcher.open_url(url, timeout)
+    try:
+        length = response.getheader('content-length')
+        if length and length.isdigit():
+            _check_bytes(int(length), max_bytes)
+        data = _read_stream(response, max_bytes, max_pixels)
+    finally:
+        response.close()
+    if start:
+        trace.emit('fetch', start, url=url, bytes=len(data))
+    return data
+
+
+def _read_stream(stream, max_bytes, max_pixels):
+    # The header is inspected as soon as it has arrived so that images that
+    # are too large can be rejected without downloading them.
+    chunks = []
+    length = 0
+    header = None
+
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+
+        chunks.append(chunk)
+        length += len(chunk)
+        _check_bytes(length, max_bytes)
+
+        if header is None:
+            header = _probe_header(''.join(chunks))
+            if header is not None:
+                _check_pixels(header.size, max_pixels)
+            elif length > HEADER_LIMIT:
+                # PIL couldn't open it anyway, so there's no point in
+                # downloading the rest.
+                raise IOError('cannot identify image file')
+
+    return ''.join(chunks)
+
+
+def _probe_header(data):
+    # Opening an image only parses its header, so this succeeds as soon as the
+    # whole header is available.
+    try:
+        return pil_image.open(StringIO(data))
+    except IOError:
+        return None
+
+
+def _count_frames(image, limit):
+    # The frames of GIFs can only be counted by decoding them one by one (each
+    # having passed the pixel limit already), so this stops at the limit.
+    current = image.tell()
+    frames = 1
+    try:
+        while frames < limit:
+            image.seek(frames)
+            frames += 1
+    except EOFError:
+        pass
+    image.seek(current)
+    return frames
+
+
+def _check_frame_count(frames, max_frames):
+    if frames > max_frames:
+        raise LimitExceeded(
+            'Image has more frames than the limit of %d.' % max_frames,
+            'max_frames', frames
+        )
+
+
+def _check_pixels(size, max_pixels):
+    if max_pixels is not None and size[0] * size[1] > max_pixels:
+        raise LimitExceeded(
+            'Image has more pixels than the limit of %d.' % max_pixels,
+            'max_pixels', size[0] * size[1]
+        )
+
+
+def _read_origin(origin):
+    if isinstance(origin, basestring):
+        with open(origin, 'rb') as f:
+            return f.read()
+    if isinstance(origin, memoryview):
+        return origin.tobytes()
+    if isinstance(origin, mmap.mmap):
+        return origin[:]
+    return str(origin)
+
+
+def _get_buffer_length(source):
+    if isinstance(source, memoryview):
+        return len(source) * source.itemsize
+    return len(source)
+
+
+def _map_pixels(image, source):
+    # Uncompressed pixels stored the way PIL keeps them in memory are used in
+    # place instead of being decoded into a copy, like PIL does for the files
+    # it opens by path, which makes mapped files as cheap as paths.
+    if len(image.tile) != 1:
+        return False
+    decoder, extents, offset, args = image.tile[0]
+    if (decoder != 'raw' or extents != (0, 0) + image.size or
+            len(args) < 3 or args[0] != image.mode or
+            image.mode not in getattr(pil_image, '_MAPMODES', ())):
+        return False
+    if isinstance(source, memoryview):
+        pixels = source[offset:]
+    else:
+        pixels = buffer(source, offset)
+    try:
+        mapped = pil_image.frombuffer(
+            image.mode, image.size, pixels, decoder, *args
+        )
+    except ValueError:
+        # Truncated, loading the image the usual way raises a better error.
+        return False
+    image.im = mapped.im
+    image.readonly = 1
+    image.tile = []
+    if image.palette:
+        image.palette.dirty = 1
+    return True
+
+
+def _get_remaining_length(source):
+    # Only works for files that can seek.
+    try:
+        position = source.tell()
+        source.seek(0, 2)
+        length = source.tell() - position
+        source.seek(position)
+    except (AttributeError, IOError):
+        return None
+    return length
+
+
+def _get_pil_format(ext):
+    pil_image.init()
+    return pil_image.EXTENSION.get('.' + ext.lower(), ext.upper())
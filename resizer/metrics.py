@@ -0,0 +1,174 @@
+from __future__ import with_statement
+import threading
+
+# The upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+           5.0, 10.0)
+
+# The type and help text of each of the metrics.
+METRICS = {
+    'resizer_fetch_seconds': (
+        'histogram', 'Time spent downloading images from URLs.'
+    ),
+    'resizer_fetch_bytes_total': (
+        'counter', 'Bytes downloaded from URLs.'
+    ),
+    'resizer_decode_seconds': (
+        'histogram', 'Time spent decoding source images.'
+    ),
+    'resizer_crop_seconds': (
+        'histogram', 'Time spent cropping regions out of source images.'
+    ),
+    'resizer_resize_seconds': (
+        'histogram', 'Time spent resampling images.'
+    ),
+    'resizer_images_total': (
+        'counter', 'Images produced for each of the sizes.'
+    ),
+    'resizer_encode_seconds': (
+        'histogram', 'Time spent encoding images.'
+    ),
+    'resizer_encode_bytes_total': (
+        'counter', 'Bytes produced by encoding images.'
+    ),
+    'resizer_adaptions_total': (
+        'counter', 'Sizes larger than the source image, by adaption outcome.'
+    ),
+    'resizer_precise_total': (
+        'counter', 'Precisely planned sizes, by whether they were cropped.'
+    ),
+}
+
+
+class Metrics(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        # Used as a tracer, see add_tracer.
+        handler = getattr(self, '_handle_' + span.stage, None)
+        if handler is not None:
+            handler(span.duration, span.attrs)
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, list(values))
+                for (key, values) in self._histograms.iteritems()
+            )
+
+        samples = {}
+        for ((metric, labels), value) in counters:
+            samples.setdefault(metric, []).append(
+                _format_sample(metric, labels, value)
+            )
+        for ((metric, labels), values) in histograms:
+            lines = samples.setdefault(metric, [])
+            # The buckets are cumulative.
+            count = 0
+            for (bound, bucket) in zip(self.buckets, values):
+                count += bucket
+                lines.append(_format_sample(
+                    metric + '_bucket', labels + (('le', repr(bound)),), count
+                ))
+            lines.append(_format_sample(
+                metric + '_bucket', labels + (('le', '+Inf'),), values[-1]
+            ))
+            lines.append(_format_sample(metric + '_sum', labels, values[-2]))
+            lines.append(_format_sample(metric + '_count', labels, values[-1]))
+
+        output = []
+        for metric in sorted(samples):
+            type, help = METRICS[metric]
+            output.append('# HELP %s %s' % (metric, help))
+            output.append('# TYPE %s %s' % (metric, type))
+            output.extend(samples[metric])
+        return ''.join(line + '\n' for line in output)
+
+    def _handle_fetch(self, duration, attrs):
+        self._observe('resizer_fetch_seconds', (), duration)
+        self._increment('resizer_fetch_bytes_total', (), attrs['bytes'])
+
+    def _handle_decode(self, duration, attrs):
+        labels = (('format', attrs['format'] or ''),)
+        self._observe('resizer_decode_seconds', labels, duration)
+
+    def _handle_crop(self, duration, attrs):
+        labels = (('size', attrs['name'] or ''),)
+        self._observe('resizer_crop_seconds', labels, duration)
+
+    def _handle_resize(self, duration, attrs):
+        labels = (('size', attrs['name'] or ''),)
+        self._observe('resizer_resize_seconds', labels, duration)
+
+    def _handle_render(self, duration, attrs):
+        self._increment('resizer_images_total', (
+            ('size', attrs['name'] or ''),
+        ))
+
+    def _handle_encode(self, duration, attrs):
+        labels = (('format', attrs['format']),)
+        self._observe('resizer_encode_seconds', labels, duration)
+        self._increment('resizer_encode_bytes_total', labels, attrs['bytes'])
+
+    def _handle_plan(self, duration, attrs):
+        outcome = attrs['outcome']
+        if outcome is not None:
+            self._increment('resizer_adaptions_total', (
+                ('size', attrs['name']), ('outcome', outcome)
+            ))
+        if attrs['precise'] and not attrs['raised'] and outcome != 'ignored':
+            self._increment('resizer_precise_total', (
+                ('size', attrs['name']),
+                ('result', 'crop' if attrs['crop'] else 'direct')
+            ))
+
+    def _increment(self, metric, labels, value=1):
+        key = (metric, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, metric, labels, value):
+        # The buckets are counted separately (the last one being +Inf) and
+        # followed by the sum and the total count.
+        index = len(self.buckets)
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        key = (metric, labels)
+        with self._lock:
+            values = self._histograms.get(key)
+            if values is None:
+                values = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def _format_sample(metric, labels, value):
+    if labels:
+        metric += '{%s}' % ','.join(
+            '%s="%s"' % (name, _escape(value)) for (name, value) in labels
+        )
+    return '%s %s' % (metric, repr(float(value)))
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
@@ -0,0 +1,21 @@
+from __future__ import with_statement
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+
+def get_thread_pool(threads, name='render'):
+    # Pools are shared by everything using the same number of threads for the
+    # same purpose. Different purposes get different pools so that a task
+    # never waits for a pool it's running in. The process id is part of the
+    # key because the threads of a pool don't survive forking (e.g. into the
+    # worker processes of resize_many).
+    key = (os.getpid(), name, threads)
+    with _thread_pools_lock:
+        pool = _thread_pools.get(key)
+        if pool is None:
+            pool = _thread_pools[key] = ThreadPool(threads)
+        return pool
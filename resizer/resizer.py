@@ -1,115 +1,665 @@
+from __future__ import with_statement
+import copy
+import math
+import numbers
+import threading
+from collections import Mapping, namedtuple
+from PIL import Image as pil_image
 from PIL.Image import ANTIALIAS
 from .image import Image, Size
+from .cache import is_cacheable
+from .pool import get_thread_pool
+from . import batch, encode, geometry, tasks, trace
+
+
+# A size as compiled by Resizer. The format is None for the source's format
+# and '' for the default format.
+SizeSpec = namedtuple('SizeSpec', 'name size format options')
+
+
+class Operation(object):
+    def __init__(self, size=None, format=None, crop=None, intermediate=None,
+                 outcome=None, options=None):
+        self.size = size
+        self.format = format
+        self.crop = crop
+        self.intermediate = intermediate
+        self.outcome = outcome
+        self.options = options
+
+    @property
+    def region(self):
+        return self.intermediate, self.crop
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Operation) and
+            self.size == other.size and
+            self.format == other.format and
+            self.crop == other.crop and
+            self.intermediate == other.intermediate and
+            self.outcome == other.outcome and
+            self.options == other.options
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return (
+            'Operation(size=%r, format=%r, crop=%r, intermediate=%r, '
+            'outcome=%r, options=%r)' % (self.size, self.format, self.crop,
+                                         self.intermediate, self.outcome,
+                                         self.options)
+        )
+
+
+class LazyImages(Mapping):
+    def __init__(self, resizer, source, header, operations, owned=False):
+        self._resizer = resizer
+        self._source = source
+        self._header = header
+        self._owned = owned
+        self._operations = dict(
+            (name, operation) for (_, name, operation) in operations
+        )
+        self._images = {}
+        self._regions = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        operation = self._operations[name]
+        with self._lock:
+            image = self._images.get(name)
+            if image is None:
+                image = self._images[name] = self._resizer._execute_operation(
+                    self._source, self._header, self._regions, operation, name,
+                    self._owned
+                )
+            return image
+
+    def __iter__(self):
+        return iter(self._operations)
+
+    def __len__(self):
+        return len(self._operations)
+
+    def __contains__(self, name):
+        # Mapping would look the image up, rendering it.
+        return name in self._operations
+
+    def rendered(self):
+        return self._images.keys()
+
+    def __reduce__(self):
+        # Pickling renders all of the images, because the source stays behind.
+        return dict, (self.items(),)
+
+    def __repr__(self):
+        return '<LazyImages %r>' % sorted(self._operations)
 
 
 class Resizer(object):
     def __init__(self, sizes=None, crop=True, precise=False,
                  default_format='png', adaption_mode='downsize',
-                 resize_mode=ANTIALIAS):
+                 resize_mode=ANTIALIAS, cascade=False, cascade_tolerance=2.0,
+                 draft=False, threads=None, fetcher=None, concurrency=None,
+                 cache=None, source_cache=None, lazy=False, max_bytes=None,
+                 max_pixels=None, max_frames=None, reduce=False,
+                 reduce_gap=2.0):
         self.sizes = sizes
         self.crop = crop
         self.precise = precise
         self.default_format = default_format
         self.adaption_mode = adaption_mode
         self.resize_mode = resize_mode
+        self.cascade = cascade
+        self.cascade_tolerance = cascade_tolerance
+        self.draft = draft
+        self.threads = threads
+        self.fetcher = fetcher
+        self.concurrency = concurrency
+        self.cache = cache
+        self.source_cache = source_cache
+        self.lazy = lazy
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.max_frames = max_frames
+        self.reduce = reduce
+        self.reduce_gap = reduce_gap
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    @sizes.setter
+    def sizes(self, sizes):
+        # Compiled here so that invalid sizes raise right away and planning
+        # only does the arithmetic.
+        self._specs = self._compile_sizes(sizes)
+        self._sizes = sizes
+        self._compiled_sizes = copy.deepcopy(sizes)
+
+    def _get_specs(self):
+        # The dict may have been changed in place since it was assigned.
+        if self._sizes != self._compiled_sizes:
+            self.sizes = self._sizes
+        return self._specs
+
+    def _compile_sizes(self, sizes):
+        if sizes is None:
+            return None
+        specs = []
+        for (name, attrs) in sizes.iteritems():
+            if attrs is not None and not isinstance(attrs, (list, tuple)):
+                raise ValueError('Invalid size %r: %r' % (name, attrs))
+            attrs, options = self._split_options(attrs)
+            try:
+                size, format = self._parse_attrs(attrs)
+            except ValueError, e:
+                raise ValueError('Invalid size %r: %s' % (name, e))
+            specs.append(SizeSpec(name, size, format, options))
+        # Largest first, the order the sizes are rendered in.
+        specs.sort(key=self._get_spec_order, reverse=True)
+        return tuple(specs)
+
+    def _get_spec_order(self, spec):
+        if spec.size is None:
+            return None, spec.name
+        return spec.size.width * spec.size.height, spec.name
 
     def resize_image(self, image):
         if self.sizes is None:
             raise ValueError('Sizes may not be None.')
 
+        if self.cache is not None and is_cacheable(image):
+            return self.cache.resize_image(self, image)
+
+        return self._resize_image(image)
+
+    def _resize_image(self, image):
+        image, owned = self._open_source(image)
+        return self._execute(image, self._plan(image), owned)
+
+    def iter_resize(self, image):
+        if self.sizes is None:
+            raise ValueError('Sizes may not be None.')
+
+        # Planning happens right away so that invalid images and sizes raise
+        # here instead of on the first iteration.
+        image, owned = self._open_source(image)
+        return self._iter_execute(image, self._plan(image), owned)
+
+    def _open_source(self, image):
+        if self.source_cache is not None and isinstance(image, basestring):
+            # The cached image is shared, so it's used at full resolution, and
+            # the cache checks its limits.
+            image = self.source_cache.get(
+                image, self.fetcher, self.max_bytes, self.max_pixels,
+                self.max_frames
+            )
+            return image, False
+
+        # Only images opened here may be drafted or share their pixels, the
+        # others belong to the caller.
+        owned = not isinstance(image, (Image, pil_image.Image))
+
+        if isinstance(image, Image):
+            image._check_limits(self.max_pixels, self.max_frames)
+        else:
+            image = self._open_image(image)
+
+        return image, owned
+
+    def _open_image(self, image):
+        # Don't copy, because we're not going to modify the image and we only
+        # hold onto it for a little while. Opening an image only reads its
+        # header, so the limits are checked before the pixels are decoded.
+        return Image(
+            image, copy=False, fetcher=self.fetcher, max_bytes=self.max_bytes,
+            max_pixels=self.max_pixels, max_frames=self.max_frames
+        )
+
+    def resize_image_async(self, image, callback=None):
+        return tasks.resize_image_async(self, image, callback)
+
+    def resize_many(self, sources, workers=None, ordered=True,
+                    max_pending=None, encode=False):
+        return batch.resize_many(
+            self, sources, workers, ordered, max_pending, encode
+        )
+
+    def encode_all(self, images, threads=None):
+        return encode.encode_all(self, images, threads)
+
+    def save_all(self, images, destination, threads=None):
+        return encode.save_all(self, images, destination, threads)
+
+    def plan(self, image):
+        # Only planning for resizing is traced, so that the metrics count
+        # images that are resized.
+        return self._plan(image, traced=False)
+
+    def _plan(self, image, traced=True):
+        if self.sizes is None:
+            raise ValueError('Sizes may not be None.')
+
         if not isinstance(image, Image):
-            # Don't copy, because we're not going to modify the image and we
-            # only hold onto it for a little while.
-            image = Image(image, copy=False)
+            image = self._open_image(image)
+
+        plan = {}
+        specs = self._get_specs()
+        if not specs:
+            return plan
+        size = image.size
+        ext = image.ext or self.default_format
+
+        for (name, spec_size, format, options) in specs:
+            if format is None:
+                format = ext
+            start = traced and trace.tracers and trace.start()
+            try:
+                plan[name] = self._plan_size(
+                    size, spec_size, format or self.default_format
+                )
+            except ValueError:
+                if start:
+                    # Only sizes larger than the source are adaptions, the
+                    # others raise for their aspect ratio.
+                    outcome = None
+                    if (spec_size is not None and
+                            self._is_smaller(size, spec_size)):
+                        outcome = 'thrown'
+                    trace.emit('plan', start, name=name, outcome=outcome,
+                               precise=self.precise, crop=False, raised=True)
+                raise
+            plan[name].options = options
+            if start:
+                trace.emit('plan', start, name=name,
+                           outcome=plan[name].outcome, precise=self.precise,
+                           crop=plan[name].crop is not None, raised=False)
+
+        return plan
+
+    def plan_many(self, widths, heights, ext=None):
+        if self.sizes is None:
+            raise ValueError('Sizes may not be None.')
+        return geometry.plan_many(self, widths, heights, ext)
+
+    def _execute(self, source, plan, owned):
+        operations = self._get_operations(plan)
+
+        header = None
+        if self.draft and owned:
+            header = self._draft(source, [op for (_, _, op) in operations])
+
+        if self.lazy:
+            return LazyImages(self, source, header, operations, owned)
+
+        if self.threads and len(operations) > 1:
+            return self._execute_threaded(source, header, operations, owned)
 
         images = {}
+        regions = {}
 
-        for (name, attrs) in self.sizes.iteritems():
-            img = self._handle_size(image, *self._parse_attrs(image, attrs))
-            if img:
-                images[name] = img
+        self._decode(source, operations)
+
+        for (_, name, operation) in operations:
+            images[name] = self._execute_operation(
+                source, header, regions, operation, name, owned
+            )
 
         return images
 
-    def _parse_attrs(self, source, attrs):
+    def _iter_execute(self, source, plan, owned):
+        operations = self._get_operations(plan)
+
+        header = None
+        if self.draft and owned:
+            header = self._draft(source, [op for (_, _, op) in operations])
+
+        # How many of the remaining sizes are made from each region, so that
+        # a region can be dropped as soon as the last one is done.
+        remaining = {}
+        for (_, _, operation) in operations:
+            if operation.size is not None:
+                remaining[operation.region] = (
+                    remaining.get(operation.region, 0) + 1
+                )
+
+        regions = {}
+
+        self._decode(source, operations)
+
+        for (index, (_, name, operation)) in enumerate(operations):
+            image = self._execute_operation(
+                source, header, regions, operation, name, owned
+            )
+
+            if operation.size is not None:
+                remaining[operation.region] -= 1
+                if not remaining[operation.region]:
+                    del regions[operation.region]
+                elif self.cascade:
+                    self._prune_intermediates(
+                        regions[operation.region],
+                        [op.size for (_, _, op) in operations[index + 1:]
+                         if op.size is not None and
+                         op.region == operation.region]
+                    )
+
+            yield name, image
+            # Don't hold onto the image while the next one is rendered.
+            del image
+
+    def _execute_threaded(self, source, header, operations, owned):
+        # Decode the source and create the regions up front so that the
+        # threads only ever read from them.
+        self._decode(source, operations)
+        regions = {}
+        for (_, name, operation) in operations:
+            if operation.size is not None and operation.region not in regions:
+                regions[operation.region] = [
+                    self._get_region(source, header, operation, name)
+                ]
+
+        # When cascading, the sizes of a region depend on each other and have
+        # to be rendered in order, otherwise every size is independent.
+        chains = []
+        chains_by_region = {}
+        for (_, name, operation) in operations:
+            if self.cascade and operation.size is not None:
+                chain = chains_by_region.get(operation.region)
+                if chain is None:
+                    chain = chains_by_region[operation.region] = []
+                    chains.append(chain)
+            else:
+                chain = []
+                chains.append(chain)
+            chain.append((name, operation))
+
+        def execute_chain(chain):
+            return [
+                (name, self._execute_operation(
+                    source, header, regions, operation, name, owned
+                ))
+                for (name, operation) in chain
+            ]
+
+        images = {}
+        pool = get_thread_pool(self.threads)
+        for results in pool.map(execute_chain, chains):
+            images.update(results)
+        return images
+
+    def _decode(self, source, operations):
+        # The pixels would be decoded by the first operation anyway, doing it
+        # here separates the time it takes from the operation's. Sizes that
+        # pass the source through don't need them.
+        if all(op.size is None for (_, _, op) in operations):
+            return
+        start = trace.tracers and trace.start()
+        source.load()
+        if start:
+            trace.emit('decode', start, size=source.size, format=source.ext)
+
+    def _execute_operation(self, source, header, regions, operation,
+                           name=None, owned=False):
+        start = trace.tracers and trace.start()
+        image = self._render(source, header, regions, operation, name, owned)
+        if start:
+            trace.emit('render', start, name=name, size=image.size)
+        return image
+
+    def _render(self, source, header, regions, operation, name, owned):
+        if operation.size is None:
+            image = source._share(owned)
+            image.ext = operation.format
+            image.options = operation.options
+            return image
+
+        # Images produced from the same region of the source can be used as
+        # intermediates for each other, the first one being the region itself.
+        intermediates = regions.get(operation.region)
+        if intermediates is None:
+            region = self._get_region(source, header, operation, name)
+            intermediates = regions[operation.region] = [region]
+
+        if self.cascade:
+            base = self._get_cascade_base(intermediates, operation.size)
+        else:
+            base = intermediates[0]
+
+        if base.size == operation.size:
+            image = Image(base)
+        else:
+            start = trace.tracers and trace.start()
+            # Don't copy because resize already creates a copy.
+            image = Image(self._resample(base, operation.size), copy=False)
+            if start:
+                trace.emit('resize', start, name=name, source_size=base.size,
+                           size=operation.size)
+
+        image.ext = operation.format
+        image.options = operation.options
+        if self.cascade:
+            intermediates.append(image)
+        return image
+
+    def _resample(self, image, size):
+        if self.reduce:
+            # Averaging blocks of pixels is much cheaper than the resampling
+            # filters, and down to this gap it hardly affects the result.
+            factor = int(min(
+                float(image.width) / size.width,
+                float(image.height) / size.height
+            ) / self.reduce_gap)
+            if factor > 1:
+                image = image.resize((
+                    int(math.ceil(float(image.width) / factor)),
+                    int(math.ceil(float(image.height) / factor))
+                ), pil_image.BOX)
+        return image.resize(size, self.resize_mode)
+
+    def _get_region(self, source, header, operation, name=None):
+        region = source
+
+        if operation.intermediate is not None:
+            start = trace.tracers and trace.start()
+            # Resizing creates a copy already.
+            region = Image(
+                region.resize(operation.intermediate, self.resize_mode),
+                copy=False
+            )
+            if start:
+                trace.emit('resize', start, name=name, source_size=source.size,
+                           size=operation.intermediate)
+
+        if operation.crop is not None:
+            box = operation.crop
+            if header is not None:
+                box = self._scale_box(box, header, source.size)
+            start = trace.tracers and trace.start()
+            # Cropping creates a copy already.
+            cropped = Image(region.crop(box), copy=False)
+            if start:
+                trace.emit('crop', start, name=name, source_size=region.size,
+                           box=box)
+            region = cropped
+
+        return region
+
+    def _prune_intermediates(self, intermediates, sizes):
+        # Later images are preferred as bases, so an image that no remaining
+        # size would use now will never be used.
+        needed = set(
+            id(self._get_cascade_base(intermediates, size)) for size in sizes
+        )
+        intermediates[1:] = [
+            image for image in intermediates[1:] if id(image) in needed
+        ]
+
+    def _get_cascade_base(self, intermediates, size):
+        # The intermediates are in descending order of size, so the first one
+        # that is large enough (searching from the end) is the smallest one.
+        width = size.width * self.cascade_tolerance
+        height = size.height * self.cascade_tolerance
+        for image in reversed(intermediates[1:]):
+            if image.width >= width and image.height >= height:
+                return image
+        return intermediates[0]
+
+    def _scale_box(self, box, old_size, new_size):
+        width_ratio = float(new_size[0]) / old_size[0]
+        height_ratio = float(new_size[1]) / old_size[1]
+        return (
+            int(round(box[0] * width_ratio)),
+            int(round(box[1] * height_ratio)),
+            int(round(box[2] * width_ratio)),
+            int(round(box[3] * height_ratio))
+        )
+
+    def _draft(self, source, operations):
+        # Sizes that aren't downscaled regions of the source need it at full
+        # resolution.
+        if not operations:
+            return
+        for operation in operations:
+            if operation.size is None or operation.intermediate is not None:
+                return
+
+        header = source.size
+        width = height = 0
+
+        for operation in operations:
+            box = operation.crop or (0, 0, header.width, header.height)
+            ratio = max(
+                float(operation.size.width) / (box[2] - box[0]),
+                float(operation.size.height) / (box[3] - box[1])
+            )
+            width = max(width, int(math.ceil(header.width * ratio)))
+            height = max(height, int(math.ceil(header.height * ratio)))
+
+        # Makes JPEG images decode at the smallest scale (1/2, 1/4 or 1/8)
+        # that is still at least this large, does nothing for other formats.
+        source.draft(source.mode, (width, height))
+
+        # The operations were planned for the size in the header, so the crop
+        # boxes need to be scaled if the source is decoded at a smaller scale.
+        if source.size != header:
+            return header
+
+    def _get_operations(self, plan):
+        # Render the largest sizes first so that the smaller ones can be
+        # derived from them instead of the full resolution source when
+        # cascading.
+        operations = [
+            (self._get_operation_area(operation), name, operation)
+            for (name, operation) in plan.iteritems()
+            if operation.outcome != 'ignored'
+        ]
+        operations.sort(reverse=True)
+        return operations
+
+    def _get_operation_area(self, operation):
+        if operation.size is None:
+            return None
+        return operation.size.width * operation.size.height
+
+    def _split_options(self, attrs):
+        # The encoder options may be given as an additional last item.
+        if attrs and isinstance(attrs[-1], dict):
+            return attrs[:-1], attrs[-1]
+        return attrs, None
+
+    def _parse_attrs(self, attrs):
+        # Returns the size and the format like SizeSpec, since the source's
+        # and the default format are only known when planning.
         if attrs is None or len(attrs) == 0:
-            return None, source.ext or self.default_format
+            return None, None
         elif len(attrs) == 1:
-            return None, attrs[0] or self.default_format
+            return None, attrs[0] or ''
         elif len(attrs) == 2:
-            return Size(*attrs), source.ext or self.default_format
+            return self._parse_size(attrs), None
         elif len(attrs) == 3:
-            return Size(*attrs[:2]), attrs[2] or self.default_format
+            return self._parse_size(attrs[:2]), attrs[2] or ''
         else:
             raise ValueError('Invalid size')
 
-    def _handle_size(self, source, size, ext):
+    def _parse_size(self, attrs):
+        for value in attrs:
+            if (not isinstance(value, numbers.Integral) or
+                    isinstance(value, bool) or value <= 0):
+                raise ValueError('Width and height must be positive integers.')
+        return Size(*attrs)
+
+    def _plan_size(self, source, size, ext):
         if size is None:
-            image = Image(source)
-            image.ext = ext
-            return image
+            return Operation(format=ext)
 
         if self._is_smaller(source, size):
-            return self._handle_adaption(source, size, ext)
+            return self._plan_adaption(source, size, ext)
 
         if self.precise:
-            return self._handle_precise(source, size, ext)
+            return self._plan_precise(source, size, ext)
 
-        return self._handle_common(source, size, ext)
+        return self._plan_common(source, size, ext)
 
-    def _handle_common(self, source, size, ext):
+    def _plan_common(self, source, size, ext):
         # We know the image isn't smaller than this size and that the width and
         # height of this size should be treated as "max width" and "max
         # height".
-        size = self._get_projected_size(source, size)
-        # Don't copy because resize already creates a copy.
-        image = Image(source.resize(size, self.resize_mode), copy=False)
-        image.ext = ext
-        return image
+        return Operation(
+            size=self._get_projected_size(source, size), format=ext
+        )
 
-    def _handle_precise(self, source, size, ext):
-        # Check the aspect ratio by resizing the image and checking if the
-        # resulting size is the same as the required one because it's the most
-        # accurate way.
-        image = self._handle_common(source, size, ext)
+    def _plan_precise(self, source, size, ext):
+        # The projected size is exactly what resizing would produce, so it
+        # tells whether the aspect ratio is right without touching the pixels.
+        operation = self._plan_common(source, size, ext)
 
-        if image.width == size.width and image.height == size.height:
-            return image
+        if operation.size == size:
+            return operation
 
         if self.crop:
-            return self._handle_crop(source, size, ext)
+            return self._plan_crop(source, size, ext)
 
         raise ValueError('Image does not have the required aspect ratio.')
 
-    def _handle_crop(self, source, size, ext):
+    def _plan_crop(self, source, size, ext):
         width, height = self._get_projected_size(size, source)
-        return self._handle_common(
-            # Cropping creates a copy already.
-            Image(source.crop((0, 0, width, height)), copy=False), size, ext
-        )
+        operation = self._plan_common(Size(width, height), size, ext)
+        operation.crop = (0, 0, width, height)
+        return operation
 
-    def _handle_adaption(self, *args):
+    def _plan_adaption(self, *args):
         if self.adaption_mode == 'ignore':
-            return
+            return self._plan_ignore_adaption(*args)
         elif self.adaption_mode == 'throw':
             raise ValueError(
                 'Image must be at least as large as the largest size.'
             )
         elif self.adaption_mode == 'downsize':
-            return self._handle_downsize_adaption(*args)
+            return self._plan_downsize_adaption(*args)
         elif self.adaption_mode == 'resize':
-            return self._handle_resize_adaption(*args)
+            return self._plan_resize_adaption(*args)
         else:
             raise ValueError('Unknown adaption mode.')
 
-    def _handle_downsize_adaption(self, *args):
-        return self._handle_common(*args)
+    def _plan_ignore_adaption(self, source, size, ext):
+        return Operation(format=ext, outcome='ignored')
+
+    def _plan_downsize_adaption(self, *args):
+        operation = self._plan_common(*args)
+        operation.outcome = 'downsized'
+        return operation
 
-    def _handle_resize_adaption(self, source, size, ext):
-        width, height = self._get_projected_size(source, size, smallest=False)
-        # Resizing creates a copy already.
-        image = Image(source.resize((width, height), self.resize_mode), False)
-        return self._handle_size(image, size, ext)
+    def _plan_resize_adaption(self, source, size, ext):
+        intermediate = self._get_projected_size(source, size, smallest=False)
+        operation = self._plan_size(intermediate, size, ext)
+        operation.intermediate = intermediate
+        operation.outcome = 'resized'
+        return operation
 
     def _get_projected_size(self, small, large, smallest=True):
         width_ratio = float(large.width) / small.width
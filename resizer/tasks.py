@@ -0,0 +1,115 @@
+from __future__ import with_statement
+import multiprocessing
+import sys
+import threading
+from .image import Image
+from .pool import get_thread_pool
+
+# Downloading mostly waits for the network, so it's done in a larger pool
+# than the decoding and resizing.
+FETCH_THREADS = 16
+
+
+class Task(object):
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def ready(self):
+        return self._event.isSet()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError('Task is not ready.')
+        return self._error is None
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise multiprocessing.TimeoutError()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+    def _run(self, function, *args):
+        try:
+            result = function(*args)
+        except Exception:
+            self._finish(None, sys.exc_info())
+        else:
+            self._finish(result, None)
+
+    def _finish(self, result, error):
+        self._result = result
+        self._error = error
+        self._event.set()
+        if self._callback is not None:
+            self._callback(self)
+
+
+def open_async(source, callback=None, **kwargs):
+    task = Task(callback)
+    _submit(_get_fetch_pool(), task._run, _open, source, kwargs)
+    return task
+
+
+def resize_image_async(resizer, image, callback=None):
+    if resizer.sizes is None:
+        raise ValueError('Sizes may not be None.')
+
+    task = Task(callback)
+
+    # Cached resizing reads the whole source itself.
+    if (not _is_url(image) or resizer.cache is not None or
+            resizer.source_cache is not None):
+        _submit(_get_resize_pool(resizer), task._run, resizer.resize_image,
+                image)
+        return task
+
+    def execute(image):
+        # The image was opened here, so it may be drafted and shared.
+        return resizer._execute(image, resizer._plan(image), True)
+
+    def resize(fetched):
+        try:
+            image = fetched.get()
+        except Exception:
+            task._finish(None, sys.exc_info())
+        else:
+            _submit(_get_resize_pool(resizer), task._run, execute, image)
+
+    fetched = Task(resize)
+    _submit(_get_fetch_pool(), fetched._run, resizer._open_image, image)
+    return task
+
+
+def _open(source, kwargs):
+    # Only reads the header (downloading the whole image for URLs), the pixels
+    # are decoded when they're first needed.
+    return Image(source, **kwargs)
+
+
+def _submit(pool, function, *args):
+    pool.apply_async(function, args)
+
+
+def _is_url(source):
+    return (
+        isinstance(source, basestring) and
+        (source.startswith('https://') or source.startswith('http://'))
+    )
+
+
+def _get_fetch_pool():
+    return get_thread_pool(FETCH_THREADS, 'fetch')
+
+
+def _get_resize_pool(resizer):
+    return get_thread_pool(
+        resizer.concurrency or multiprocessing.cpu_count(), 'resize'
+    )
@@ -0,0 +1,44 @@
+import time
+
+# Replaced instead of modified, so that it can be iterated without a lock.
+tracers = ()
+
+
+class Span(object):
+    def __init__(self, stage, start, duration, attrs):
+        self.stage = stage
+        self.start = start
+        self.duration = duration
+        self.attrs = attrs
+
+    def __repr__(self):
+        return 'Span(stage=%r, start=%r, duration=%r, attrs=%r)' % (
+            self.stage, self.start, self.duration, self.attrs
+        )
+
+
+def add_tracer(tracer):
+    global tracers
+    tracers = tracers + (tracer,)
+
+
+def remove_tracer(tracer):
+    global tracers
+    tracers = tuple(t for t in tracers if t is not tracer)
+
+
+def start():
+    # Returns a false value when nothing is traced, so that the callers can
+    # skip building the attributes:
+    #
+    #     start = trace.tracers and trace.start()
+    #     ...
+    #     if start:
+    #         trace.emit('stage', start, ...)
+    return time.time()
+
+
+def emit(stage, start, **attrs):
+    span = Span(stage, start, time.time() - start, attrs)
+    for tracer in tracers:
+        tracer(span)
@@ -26,13 +26,14 @@ setup(
     long_description=open('README.rst').read(),
     packages=['resizer'],
     platforms='any',
-    install_requires=['Pillow>=1.7.7'],
+    python_requires='>=2.7, <3',
+    install_requires=['Pillow>=3.4.0'],
+    extras_require={'numpy': ['numpy']},
+    entry_points={'console_scripts': ['resizer = resizer.cli:main']},
     cmdclass={'test': PyTest},
     classifiers=[
         'Programming Language :: Python',
         'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.5',
-        'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
         'Operating System :: OS Independent',
         'Intended Audience :: Developers',
@@ -0,0 +1,78 @@
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.server.clients.add(self.client_address)
+        route = self.server.routes.get(self.path)
+        if route is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        status, headers, body = route
+        if callable(body):
+            body = body()
+        if isinstance(body, tuple):
+            status, body = body
+        self.send_response(status)
+        for (name, value) in headers.iteritems():
+            self.send_header(name, value)
+        if 'Content-Length' not in headers:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.routes = {}
+        self.requests = []
+        self.clients = set()
+        self.thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.01}
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+    def route(self, path, body='', status=200, headers=None):
+        self.routes[path] = (status, headers or {}, body)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def failing(body, failures, status=503):
+    # Responds with the status the given number of times before succeeding.
+    remaining = [failures]
+
+    def respond():
+        if remaining[0] > 0:
+            remaining[0] -= 1
+            return status, ''
+        return body
+    return respond
+
+
+def slow(body, delay):
+    def respond():
+        time.sleep(delay)
+        return body
+    return respond
@@ -0,0 +1,118 @@
+from __future__ import with_statement
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from StringIO import StringIO
+from PIL import Image as pil_image
+from resizer import Resizer, Image, BatchError
+from .server import Server
+
+
+class TestResizeMany(object):
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for i in xrange(6):
+            path = os.path.join(self.directory, '%d.png' % i)
+            pil_image.new('RGB', (100 + i * 10, 100)).save(path)
+            self.paths.append(path)
+        self.resizer = Resizer(sizes={'small': (50, 50)})
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def test_resize_many_yields_results_in_order(self):
+        results = list(self.resizer.resize_many(self.paths, workers=2))
+        assert [source for (source, _) in results] == self.paths
+        for (i, (_, images)) in enumerate(results):
+            height = int(round(5000.0 / (100 + i * 10)))
+            assert images['small'].size == (50, height)
+            assert images['small'].ext == 'png'
+
+    def test_resize_many_yields_all_results_when_unordered(self):
+        results = list(self.resizer.resize_many(
+            self.paths, workers=2, ordered=False
+        ))
+        assert sorted(source for (source, _) in results) == sorted(self.paths)
+
+    def test_resize_many_yields_errors_instead_of_raising(self):
+        paths = self.paths[:2] + [os.path.join(self.directory, 'missing')]
+        for ordered in (True, False):
+            results = dict(self.resizer.resize_many(
+                paths, workers=2, ordered=ordered
+            ))
+            assert isinstance(results[paths[2]], BatchError)
+            assert results[paths[2]].type == 'IOError'
+            assert 'Traceback' in results[paths[2]].traceback
+            assert results[paths[0]]['small'].size == (50, 50)
+
+    def test_resize_many_yields_errors_that_cannot_be_pickled(self):
+        # HTTPError can't be unpickled, which used to hang the pool.
+        server = Server()
+        try:
+            url = server.url('/missing.png')
+            for ordered in (True, False):
+                results = dict(self.resizer.resize_many(
+                    [url] + self.paths[:2], workers=2, ordered=ordered
+                ))
+                assert results[url].type == 'HTTPError'
+                assert '404' in str(results[url])
+                assert results[self.paths[1]]['small'].size == (50, 45)
+        finally:
+            server.stop()
+
+    def test_resize_many_yields_errors_for_unpicklable_sources(self):
+        lock = threading.Lock()
+        for ordered in (True, False):
+            results = list(self.resizer.resize_many(
+                [self.paths[0], lock, self.paths[1]], workers=2,
+                ordered=ordered
+            ))
+            assert len(results) == 3
+            errors = [images for (source, images) in results
+                      if source is lock]
+            assert isinstance(errors[0], BatchError)
+            assert errors[0].type == 'TypeError'
+
+    def test_resize_many_yields_exceeded_limits(self):
+        self.resizer.max_pixels = 10
+        for ordered in (True, False):
+            results = list(self.resizer.resize_many(
+                self.paths[:2], workers=2, ordered=ordered
+            ))
+            assert [images.type for (_, images) in results] == [
+                'LimitExceeded', 'LimitExceeded'
+            ]
+
+    def test_batch_error_can_be_pickled(self):
+        error = BatchError('IOError', 'missing', 'Traceback')
+        error = pickle.loads(pickle.dumps(error))
+        assert (error.type, error.message, error.traceback) == (
+            'IOError', 'missing', 'Traceback'
+        )
+        assert str(error) == 'IOError: missing'
+
+    def test_resize_many_yields_encoded_images(self):
+        results = list(self.resizer.resize_many(
+            self.paths[:1], workers=1, encode=True
+        ))
+        data = results[0][1]['small']
+        assert isinstance(data, str)
+        assert Image(StringIO(data)).size == (50, 50)
+
+    def test_resize_many_limits_pending_work(self):
+        consumed = []
+
+        def sources():
+            for path in self.paths:
+                consumed.append(path)
+                yield path
+
+        results = self.resizer.resize_many(
+            sources(), workers=1, max_pending=2
+        )
+        results.next()
+        assert len(consumed) == 2
+        results.close()
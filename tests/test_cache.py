@@ -0,0 +1,340 @@
+from __future__ import with_statement
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import pytest
+from StringIO import StringIO
+from flexmock import flexmock
+from PIL import Image as pil_image
+import resizer.cache
+import resizer.image
+from resizer import fetch
+from resizer import (
+    Resizer, Image, OutputCache, SourceCache, LimitExceeded
+)
+
+
+class TestOutputCache(object):
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.cache = OutputCache(os.path.join(self.directory, 'cache'))
+        self.path = os.path.join(self.directory, 'image.png')
+        pil_image.new('RGB', (300, 200), (255, 0, 0)).save(self.path)
+        self.resizer = Resizer(cache=self.cache, sizes={
+            'small': (30, 30),
+            'thumbnail': (20, 20, 'jpg'),
+            'original': [],
+        })
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def _assert_images(self, images):
+        assert sorted(images.keys()) == ['original', 'small', 'thumbnail']
+        assert images['small'].size == (30, 20)
+        assert images['small'].ext == 'png'
+        assert images['thumbnail'].size == (20, 13)
+        assert images['thumbnail'].ext == 'jpg'
+        assert images['original'].size == (300, 200)
+        assert images['small'].getpixel((0, 0)) == (255, 0, 0)
+
+    def test_cache_misses_first(self):
+        self._assert_images(self.resizer.resize_image(self.path))
+        assert self.cache.hits == 0
+        assert self.cache.misses == 1
+
+    def test_cache_checks_bytes_before_reading_everything(self):
+        self.resizer.max_bytes = 10
+        try:
+            self.resizer.resize_image(self.path)
+        except LimitExceeded:
+            assert self.cache.misses == 0
+            return
+        assert False, 'Expected LimitExceeded'
+
+    def test_cache_hits_keep_the_names_of_the_sizes(self):
+        self.resizer.sizes = {'small': (30, 30), u'unicode': (20, 20)}
+        for _ in xrange(2):
+            images = self.resizer.resize_image(self.path)
+            assert sorted(
+                (type(name), name) for name in images
+            ) == [(str, 'small'), (unicode, u'unicode')]
+        assert self.cache.hits == 1
+
+    def test_cache_checks_limits_of_cached_sources(self):
+        self.resizer.resize_image(self.path)
+        for limits in ({'max_pixels': 1000}, {'max_frames': 0}):
+            resizer = Resizer(cache=self.cache, sizes=self.resizer.sizes,
+                              **limits)
+            with pytest.raises(LimitExceeded):
+                resizer.resize_image(self.path)
+        assert self.cache.hits == 0
+
+    def test_cache_hits_for_same_data(self):
+        self.resizer.resize_image(self.path)
+        with open(self.path, 'rb') as f:
+            images = self.resizer.resize_image(StringIO(f.read()))
+        self._assert_images(images)
+        assert self.cache.hits == 1
+        assert self.cache.misses == 1
+
+    def test_cache_hits_for_same_buffer(self):
+        self.resizer.resize_image(self.path)
+        with open(self.path, 'rb') as f:
+            images = self.resizer.resize_image(bytearray(f.read()))
+        self._assert_images(images)
+        assert self.cache.hits == 1
+
+    def test_cache_hits_do_not_decode_source(self):
+        self.resizer.resize_image(self.path)
+        (flexmock(self.resizer)
+            .should_receive('_resize_image')
+            .and_raise(AssertionError('Not supposed to be called')))
+        images = self.resizer.resize_image(self.path)
+        assert images['small']._pil_image.im is None
+
+    def test_cache_misses_for_different_configuration(self):
+        self.resizer.resize_image(self.path)
+        self.resizer.precise = True
+        images = self.resizer.resize_image(self.path)
+        assert images['small'].size == (30, 30)
+        assert self.cache.misses == 2
+
+    @pytest.mark.parametrize('attr,value', [
+        ('cascade', True), ('cascade_tolerance', 3.0), ('draft', True),
+        ('reduce', True), ('reduce_gap', 3.0),
+    ])
+    def test_cache_misses_for_different_pixels(self, attr, value):
+        self.resizer.resize_image(self.path)
+        setattr(self.resizer, attr, value)
+        self.resizer.resize_image(self.path)
+        assert self.cache.misses == 2
+
+    def test_cache_is_shared_by_resizers(self):
+        self.resizer.resize_image(self.path)
+        other = Resizer(cache=OutputCache(self.cache.directory),
+                        sizes=self.resizer.sizes)
+        self._assert_images(other.resize_image(self.path))
+        assert other.cache.hits == 1
+
+    def test_cache_does_not_cache_loaded_images(self):
+        self.resizer.resize_image(Image(self.path))
+        assert self.cache.misses == 0
+
+    def _get_entry(self, path):
+        with open(path, 'rb') as f:
+            key = self.cache._get_key(self.resizer, f.read())
+        return self.cache._get_path(key)
+
+    def test_cache_evicts_least_recently_used_entries(self):
+        paths = []
+        for i in xrange(3):
+            path = os.path.join(self.directory, '%d.png' % i)
+            pil_image.new('RGB', (300, 200), (i, 0, 0)).save(path)
+            paths.append(path)
+
+        self.resizer.resize_image(paths[0])
+        self.cache.max_size = self.cache._get_size() * 2.5
+        self.resizer.resize_image(paths[1])
+        os.utime(self._get_entry(paths[0]), (1, 1))
+        os.utime(self._get_entry(paths[1]), (2, 2))
+        self.resizer.resize_image(paths[0])
+        self.resizer.resize_image(paths[2])
+
+        assert self.cache.evictions == 1
+        assert self.cache._get_size() <= self.cache.max_size
+        assert not os.path.exists(self._get_entry(paths[1]))
+        self.resizer.resize_image(paths[0])
+        self.resizer.resize_image(paths[2])
+        assert self.cache.hits == 3
+        assert self.cache.misses == 3
+
+    def test_cache_ignores_entries_being_written(self):
+        self.resizer.resize_image(self.path)
+        entry = self.cache._get_entries()[0]
+        os.remove(os.path.join(entry, 'manifest.json'))
+        self._assert_images(self.resizer.resize_image(self.path))
+        assert self.cache.misses == 2
+
+    def test_clear_removes_entries(self):
+        self.resizer.resize_image(self.path)
+        self.cache.clear()
+        assert self.cache._get_entries() == []
+
+    def test_cache_is_safe_across_processes(self):
+        results = list(self.resizer.resize_many([self.path] * 6, workers=3))
+        for (_, images) in results:
+            self._assert_images(images)
+        assert len(self.cache._get_entries()) == 1
+        assert os.listdir(os.path.dirname(self.cache._get_entries()[0])) == [
+            os.path.basename(self.cache._get_entries()[0])
+        ]
+
+
+class TestSourceCache(object):
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SourceCache()
+        self.path = self._save('image.png', (300, 200))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def _save(self, name, size, color=(255, 0, 0)):
+        path = os.path.join(self.directory, name)
+        pil_image.new('RGB', size, color).save(path)
+        return path
+
+    def test_get_decodes_image(self):
+        image = self.cache.get(self.path)
+        assert image.size == (300, 200)
+        assert image._pil_image.im is not None
+        assert self.cache.misses == 1
+        assert self.cache.size == 300 * 200 * 4
+
+    def test_get_returns_cached_image(self):
+        image = self.cache.get(self.path)
+        assert self.cache.get(self.path) is image
+        assert self.cache.hits == 1
+        assert self.cache.misses == 1
+
+    def test_get_invalidates_changed_file(self):
+        image = self.cache.get(self.path)
+        self._save('image.png', (100, 100), (0, 255, 0))
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        changed = self.cache.get(self.path)
+        assert changed is not image
+        assert changed.size == (100, 100)
+        assert self.cache.invalidations == 1
+        assert self.cache.size == 100 * 100 * 4
+
+    def test_get_expires_urls(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        (flexmock(fetch)
+            .should_receive('open_url')
+            .times(2)
+            .replace_with(lambda url, timeout: flexmock(
+                read=StringIO(data).read,
+                getheader=lambda name: None,
+                close=lambda: None
+            )))
+        now = time.time()
+        flexmock(time).should_receive('time').and_return(now)
+        image = self.cache.get('http://nonexistent/image.png')
+        assert self.cache.get('http://nonexistent/image.png') is image
+        flexmock(time).should_receive('time').and_return(now + 60)
+        assert self.cache.get('http://nonexistent/image.png') is not image
+        assert self.cache.hits == 1
+        assert self.cache.misses == 2
+        assert self.cache.invalidations == 1
+
+    def test_get_evicts_least_recently_used(self):
+        self.cache.max_bytes = 300 * 200 * 4 * 2
+        other = self._save('other.png', (300, 200))
+        third = self._save('third.png', (300, 200))
+        first = self.cache.get(self.path)
+        self.cache.get(other)
+        self.cache.get(self.path)
+        self.cache.get(third)
+        assert self.cache.evictions == 1
+        assert self.cache.size == 300 * 200 * 4 * 2
+        assert self.cache.get(self.path) is first
+        self.cache.get(other)
+        assert self.cache.misses == 4
+
+    def test_get_does_not_cache_too_large_images(self):
+        self.cache.max_bytes = 1000
+        image = self.cache.get(self.path)
+        assert image.size == (300, 200)
+        assert self.cache.size == 0
+        assert self.cache.get(self.path) is not image
+
+    def test_get_decoded_size(self):
+        assert resizer.cache._get_decoded_size(
+            Image(pil_image.new('L', (10, 20)))) == 200
+        assert resizer.cache._get_decoded_size(
+            Image(pil_image.new('RGB', (10, 20)))) == 800
+
+    def test_clear(self):
+        self.cache.get(self.path)
+        self.cache.clear()
+        assert self.cache.size == 0
+        self.cache.get(self.path)
+        assert self.cache.misses == 2
+
+    def test_pickle_creates_empty_cache(self):
+        self.cache.get(self.path)
+        cache = pickle.loads(pickle.dumps(self.cache))
+        assert cache.size == 0
+        assert cache.misses == 1
+        cache.get(self.path)
+        assert cache.misses == 2
+
+    def test_resizer_uses_cache(self):
+        r = Resizer(source_cache=self.cache, draft=True, sizes={
+            'small': (30, 30),
+        })
+        assert r.resize_image(self.path)['small'].size == (30, 20)
+        images = r.resize_image(self.path)
+        assert images['small'].size == (30, 20)
+        assert images['small'].getpixel((0, 0)) == (255, 0, 0)
+        assert self.cache.hits == 1
+        assert self.cache.get(self.path).size == (300, 200)
+
+    def _save_gif(self, frames):
+        path = os.path.join(self.directory, 'image.gif')
+        images = [pil_image.new('L', (10, 10), i * 10) for i in range(frames)]
+        images[0].save(path, save_all=True, append_images=images[1:])
+        return path
+
+    def test_get_counts_frames_when_decoding(self):
+        path = self._save_gif(10)
+        image = self.cache.get(path, max_frames=20)
+        flexmock(resizer.image).should_receive('_count_frames').never()
+        assert self.cache.get(path, max_frames=20) is image
+        with pytest.raises(LimitExceeded) as e:
+            self.cache.get(path, max_frames=5)
+        assert e.value.value == 10
+        assert self.cache.hits == 2
+
+    def test_get_decodes_again_to_count_frames(self):
+        path = self._save_gif(10)
+        image = self.cache.get(path)
+        assert self.cache.get(path, max_frames=20) is not image
+        assert self.cache.misses == 2
+        assert self.cache.get(path, max_frames=20) is not image
+        assert self.cache.hits == 1
+
+    def test_resizer_checks_frames_of_cached_images_in_threads(self):
+        path = self._save_gif(10)
+        r = Resizer(source_cache=self.cache, max_frames=20, sizes={
+            'small': (5, 5),
+        })
+        errors = []
+
+        def resize():
+            try:
+                for _ in xrange(20):
+                    r.resize_image(path)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=resize) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+    def test_get_checks_limits_of_cached_images(self):
+        self.cache.get(self.path)
+        try:
+            self.cache.get(self.path, max_pixels=100)
+        except LimitExceeded:
+            assert self.cache.hits == 1
+            return
+        assert False, 'Expected LimitExceeded'
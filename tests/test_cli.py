@@ -0,0 +1,192 @@
+from __future__ import with_statement
+import json
+import os
+import shutil
+import tempfile
+import pytest
+from PIL import Image as pil_image
+from resizer import Resizer, cli
+
+
+class TestCli(object):
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.sources = os.path.join(self.directory, 'sources')
+        os.makedirs(os.path.join(self.sources, 'nested'))
+        for i in xrange(3):
+            pil_image.new('RGB', (200 + i * 10, 100)).save(
+                os.path.join(self.sources, '%d.jpg' % i)
+            )
+        pil_image.new('RGB', (100, 100)).save(
+            os.path.join(self.sources, 'nested', 'square.png')
+        )
+        with open(os.path.join(self.sources, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+
+        self.sizes = os.path.join(self.directory, 'sizes.json')
+        with open(self.sizes, 'w') as f:
+            json.dump({
+                'small': [50, 50],
+                'thumbnail': [20, 20, 'png', {'compress_level': 1}],
+            }, f)
+        self.template = os.path.join(
+            self.directory, 'out', '{source}-{name}.{ext}'
+        )
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def _main(self, *args):
+        return cli.main(['-s', self.sizes, '-o', self.template] + list(args))
+
+    def _output(self, name):
+        return os.path.join(self.directory, 'out', name)
+
+    def test_find_sources_walks_directories_for_images(self):
+        assert cli.find_sources([self.sources]) == [
+            os.path.join(self.sources, '0.jpg'),
+            os.path.join(self.sources, '1.jpg'),
+            os.path.join(self.sources, '2.jpg'),
+            os.path.join(self.sources, 'nested', 'square.png'),
+        ]
+
+    def test_find_sources_expands_globs_and_keeps_paths(self):
+        pattern = os.path.join(self.sources, '[12].jpg')
+        text = os.path.join(self.sources, 'notes.txt')
+        assert cli.find_sources([pattern, text, pattern]) == [
+            os.path.join(self.sources, '1.jpg'),
+            os.path.join(self.sources, '2.jpg'),
+            text,
+        ]
+
+    def test_main_resizes_and_saves_sources(self, capsys):
+        assert self._main('-j', '1', self.sources) == 0
+        small = pil_image.open(self._output('1-small.jpeg'))
+        assert small.size == (50, 24)
+        assert small.format == 'JPEG'
+        square = pil_image.open(self._output('square-thumbnail.png'))
+        assert square.size == (20, 20)
+        out = capsys.readouterr()[0]
+        assert '[4/4] resized %s' % os.path.join(
+            self.sources, 'nested', 'square.png'
+        ) in out
+        assert '4 sources: 4 resized, 0 skipped, 0 failed' in out
+        assert '8 images written' in out
+
+    def test_main_resizes_in_worker_processes(self, capsys):
+        assert self._main('-j', '2', '-q', self.sources) == 0
+        assert len(os.listdir(self._output(''))) == 8
+        out = capsys.readouterr()[0]
+        assert '] resized' not in out
+        assert '4 sources: 4 resized' in out
+
+    def test_main_fills_in_the_directory_of_sources(self, monkeypatch):
+        monkeypatch.chdir(self.sources)
+        self.template = os.path.join(self.directory, 'out', '{dir}', '{name}')
+        assert self._main('-j', '1', 'nested', '0.jpg') == 0
+        assert sorted(os.listdir(self._output('nested'))) == [
+            'small', 'thumbnail'
+        ]
+        assert os.path.exists(self._output(os.path.join(os.curdir, 'small')))
+
+    def test_main_fills_in_the_file_name_of_sources(self):
+        pil_image.new('RGB', (100, 100)).save(
+            os.path.join(self.sources, '0.png')
+        )
+        self.template = os.path.join(
+            self.directory, 'out', '{filename}-{name}.{ext}'
+        )
+        assert self._main('-j', '1', self.sources) == 0
+        assert os.path.exists(self._output('0.jpg-small.jpeg'))
+        assert os.path.exists(self._output('0.png-small.png'))
+
+    def test_main_rejects_sources_with_the_same_targets(self, capsys):
+        pil_image.new('RGB', (100, 100)).save(
+            os.path.join(self.sources, '0.png')
+        )
+        with pytest.raises(SystemExit) as e:
+            self._main(self.sources)
+        assert e.value.code == 2
+        assert '0.jpg (small) and %s (small) would be written to the same' % (
+            os.path.join(self.sources, '0.png')
+        ) in capsys.readouterr()[1]
+        assert not os.path.exists(self._output(''))
+
+    def test_main_rejects_sizes_with_the_same_targets(self, capsys):
+        self.template = os.path.join(self.directory, 'out', '{source}.{ext}')
+        with pytest.raises(SystemExit) as e:
+            self._main(self.sources)
+        assert e.value.code == 2
+        assert '0.jpg (small) and %s (thumbnail) would be written' % (
+            os.path.join(self.sources, '0.jpg')
+        ) in capsys.readouterr()[1]
+
+    def test_job_fails_sources_with_sizes_with_the_same_targets(self):
+        resizer = Resizer(sizes={'a': (50, 50), 'b': (20, 20)})
+        job = cli.Job(resizer, os.path.join(self.directory, 'out', 'x'))
+        result = job(os.path.join(self.sources, '0.jpg'))
+        assert result.outcome == 'failed'
+        assert "Sizes 'a' and 'b' would be written" in result.error
+        assert not os.path.exists(self._output('x'))
+
+    def test_main_rejects_invalid_templates(self, capsys):
+        self.template = '{unknown}'
+        with pytest.raises(SystemExit) as e:
+            self._main(self.sources)
+        assert e.value.code == 2
+        assert 'invalid output template' in capsys.readouterr()[1]
+
+    def test_main_skips_sources_older_than_their_images(self, capsys):
+        self._main('-j', '1', self.sources)
+        capsys.readouterr()
+
+        source = os.path.join(self.sources, '0.jpg')
+        modified = os.path.getmtime(self._output('0-small.jpeg')) + 10
+        os.utime(source, (modified, modified))
+        os.remove(self._output('1-thumbnail.png'))
+
+        assert self._main('-j', '1', self.sources) == 0
+        out = capsys.readouterr()[0]
+        assert '4 sources: 2 resized, 2 skipped, 0 failed' in out
+        assert 'resized %s' % source in out
+        assert os.path.exists(self._output('1-thumbnail.png'))
+
+        self._main('-j', '1', '--force', self.sources)
+        assert '4 resized, 0 skipped' in capsys.readouterr()[0]
+
+    def test_main_reports_failed_sources(self, capsys):
+        text = os.path.join(self.sources, 'notes.txt')
+        assert self._main('-j', '1', text, self.sources) == 1
+        out, err = capsys.readouterr()
+        assert '[1/5] failed %s: IOError' % text in err
+        assert '5 sources: 4 resized, 0 skipped, 1 failed' in out
+
+    def test_main_prints_profile(self, capsys):
+        self._main('-j', '2', '-q', '--profile', self.sources)
+        out = capsys.readouterr()[0]
+        assert 'Ordered by: cumulative time' in out
+        assert 'cli.py' in out and '(_process)' in out
+
+    def test_main_passes_options_to_resizer(self):
+        with open(self.sizes, 'w') as f:
+            json.dump({'small': [90, 90], 'large': [150, 150]}, f)
+        self._main('-j', '1', '--precise', '--adaption-mode', 'ignore',
+                   self.sources)
+        assert pil_image.open(self._output('0-small.jpeg')).size == (90, 90)
+        assert not os.path.exists(self._output('0-large.jpeg'))
+
+    def test_main_requires_sizes_template_and_sources(self, capsys):
+        for args in (['-o', 'x', 'y'], ['-s', self.sizes, 'y'],
+                     ['-s', self.sizes, '-o', 'x'],
+                     ['-s', self.sizes, '-o', 'x', '-j', '0', 'y']):
+            with pytest.raises(SystemExit) as e:
+                cli.main(args)
+            assert e.value.code == 2
+
+    def test_main_rejects_invalid_sizes(self, capsys):
+        with open(self.sizes, 'w') as f:
+            json.dump({'small': [0, 50]}, f)
+        with pytest.raises(SystemExit) as e:
+            self._main(self.sources)
+        assert e.value.code == 2
+        assert "Invalid size u'small'" in capsys.readouterr()[1]
@@ -0,0 +1,86 @@
+from __future__ import with_statement
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from PIL import Image as pil_image
+from resizer import Resizer
+
+
+class TestEncode(object):
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.source = pil_image.linear_gradient('L').convert('RGB').resize(
+            (300, 200)
+        )
+        self.resizer = Resizer(threads=2, sizes={
+            'small': (30, 30, 'jpg', {'quality': 10}),
+            'large': (200, 200, 'jpg', {'quality': 95, 'progressive': True}),
+            'original': ['png', {'compress_level': 1}],
+        })
+        self.images = self.resizer.resize_image(self.source)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def test_encode_all_encodes_every_image(self):
+        encoded = self.resizer.encode_all(self.images)
+        assert sorted(encoded.keys()) == ['large', 'original', 'small']
+        small = pil_image.open(StringIO(encoded['small']))
+        assert small.format == 'JPEG'
+        assert small.size == (30, 20)
+        assert pil_image.open(StringIO(encoded['original'])).format == 'PNG'
+
+    def test_encode_all_uses_options_of_sizes(self):
+        encoded = self.resizer.encode_all(self.images)
+        assert encoded['small'] == self.images['small'].encode(quality=10)
+        assert encoded['small'] != self.images['small'].encode(quality=95)
+        large = pil_image.open(StringIO(encoded['large']))
+        assert large.info.get('progressive')
+        assert encoded['original'] == (
+            self.images['original'].encode(compress_level=1)
+        )
+
+    def test_encode_all_without_threads(self):
+        assert (
+            self.resizer.encode_all(self.images, threads=1) ==
+            self.resizer.encode_all(self.images)
+        )
+
+    def test_encode_all_renders_lazy_images(self):
+        self.resizer.lazy = True
+        images = self.resizer.resize_image(self.source)
+        assert (
+            self.resizer.encode_all(images) ==
+            self.resizer.encode_all(self.images)
+        )
+
+    def test_save_all_saves_to_template(self):
+        template = os.path.join(self.directory, 'image-{name}.{ext}')
+        sizes = self.resizer.save_all(self.images, template)
+        encoded = self.resizer.encode_all(self.images)
+        for (name, image) in self.images.iteritems():
+            path = os.path.join(
+                self.directory, 'image-%s.%s' % (name, image.ext)
+            )
+            with open(path, 'rb') as f:
+                assert f.read() == encoded[name]
+            assert sizes[name] == len(encoded[name])
+
+    def test_save_all_saves_to_paths_and_file_objects(self):
+        files = {
+            'small': StringIO(),
+            'large': StringIO(),
+            'original': os.path.join(self.directory, 'original.png'),
+        }
+        sizes = self.resizer.save_all(self.images, files)
+        encoded = self.resizer.encode_all(self.images)
+        assert files['small'].getvalue() == encoded['small']
+        assert files['large'].getvalue() == encoded['large']
+        assert os.path.getsize(files['original']) == sizes['original']
+        assert sizes['small'] == len(encoded['small'])
+
+    def test_encode_overrides_options_of_size(self):
+        small = self.images['small']
+        assert small.options == {'quality': 10}
+        assert small.encode(quality=95) != small.encode()
@@ -0,0 +1,239 @@
+from __future__ import with_statement
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import urllib2
+from StringIO import StringIO
+from PIL import Image as pil_image
+import pytest
+from flexmock import flexmock
+from resizer import Image, Resizer, OutputCache, LimitExceeded
+from resizer import image as resizer_image
+from resizer.fetch import Fetcher, open_url
+from .server import Server, failing, slow
+
+
+class TestOpenUrl(object):
+    def setup_method(self, method):
+        self.server = Server()
+        data = StringIO()
+        pil_image.new('RGB', (40, 30)).save(data, 'PNG')
+        self.data = data.getvalue()
+        self.server.route('/image.png', self.data)
+
+    def teardown_method(self, method):
+        self.server.stop()
+
+    def test_open_url_returns_response(self):
+        response = open_url(self.server.url('/image.png'))
+        assert response.read() == self.data
+        response.close()
+
+    def test_open_url_follows_redirects(self):
+        self.server.route('/redirect', status=302,
+                          headers={'Location': '/image.png'})
+        response = open_url(self.server.url('/redirect'))
+        assert response.read() == self.data
+        assert self.server.requests == ['/redirect', '/image.png']
+
+    def test_open_url_raises_http_error_for_errors(self):
+        try:
+            open_url(self.server.url('/nonexistent'))
+        except urllib2.HTTPError, e:
+            assert e.code == 404
+            return
+        assert False
+
+    def test_open_url_raises_timeout_for_slow_responses(self):
+        self.server.route('/slow', slow(self.data, 0.5))
+        try:
+            open_url(self.server.url('/slow'), timeout=(5, 0.1)).read()
+        except socket.timeout:
+            return
+        assert False
+
+    def test_open_url_uses_proxy_from_environment(self, monkeypatch):
+        monkeypatch.setenv('http_proxy', self.server.url(''))
+        monkeypatch.delenv('no_proxy', raising=False)
+        self.server.route('http://images.invalid/image.png?a=1', self.data)
+        response = open_url('http://images.invalid/image.png?a=1')
+        assert response.read() == self.data
+        response.close()
+
+    def test_open_url_bypasses_proxy_for_no_proxy(self, monkeypatch):
+        monkeypatch.setenv('http_proxy', 'http://proxy.invalid:3128')
+        monkeypatch.setenv('no_proxy', '127.0.0.1')
+        response = open_url(self.server.url('/image.png'))
+        assert response.read() == self.data
+        response.close()
+
+    def test_image_loads_from_url(self):
+        image = Image(self.server.url('/image.png'), timeout=5)
+        assert image.size == (40, 30)
+        assert image.ext == 'png'
+
+    def test_image_rejects_too_many_pixels_from_url(self):
+        try:
+            Image(self.server.url('/image.png'), max_pixels=1000)
+        except ValueError:
+            return
+        assert False
+
+    def test_output_cache_rejects_too_many_pixels_from_url(self):
+        # Downloaded like Image does, which checks the header on arrival.
+        directory = tempfile.mkdtemp()
+        try:
+            resizer = Resizer(
+                sizes={'small': (10, 10)}, max_pixels=1000,
+                cache=OutputCache(directory)
+            )
+            flexmock(resizer_image).should_call('_read_stream').once()
+            with pytest.raises(LimitExceeded) as e:
+                resizer.resize_image(self.server.url('/image.png'))
+            assert e.value.limit == 'max_pixels'
+        finally:
+            shutil.rmtree(directory)
+
+    def test_image_rejects_too_many_bytes_from_url(self):
+        try:
+            Image(self.server.url('/image.png'), max_bytes=10)
+        except ValueError:
+            return
+        assert False
+
+    def test_image_stops_downloading_without_header(self, monkeypatch):
+        monkeypatch.setattr(resizer_image, 'HEADER_LIMIT', 100)
+        self.server.route('/text', 'x' * 10 * resizer_image.CHUNK_SIZE)
+        response = open_url(self.server.url('/text'))
+        with pytest.raises(IOError):
+            resizer_image._read_stream(response, None, None)
+        assert len(response.read()) > 8 * resizer_image.CHUNK_SIZE
+        response.close()
+
+
+class TestFetcher(object):
+    def setup_method(self, method):
+        self.server = Server()
+        data = StringIO()
+        pil_image.new('RGB', (40, 30)).save(data, 'PNG')
+        self.data = data.getvalue()
+        self.server.route('/image.png', self.data)
+        self.fetcher = Fetcher(backoff=0)
+
+    def teardown_method(self, method):
+        self.fetcher.close()
+        self.server.stop()
+
+    def _fetch(self, path):
+        response = self.fetcher.open_url(self.server.url(path))
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def test_fetcher_reuses_connections(self):
+        for _ in xrange(3):
+            assert self._fetch('/image.png') == self.data
+        assert len(self.server.requests) == 3
+        assert len(self.server.clients) == 1
+
+    def test_fetcher_reuses_connections_after_redirects(self):
+        self.server.route('/redirect', status=302,
+                          headers={'Location': '/image.png'})
+        assert self._fetch('/redirect') == self.data
+        assert self._fetch('/redirect') == self.data
+        assert len(self.server.clients) == 1
+
+    def test_fetcher_does_not_reuse_unfinished_responses(self):
+        self.fetcher.open_url(self.server.url('/image.png')).close()
+        self._fetch('/image.png')
+        assert len(self.server.clients) == 2
+
+    def test_fetcher_replaces_connections_closed_by_the_server(self):
+        self._fetch('/image.png')
+        self.server.routes['/image.png'] = (
+            200, {'Connection': 'close'}, self.data
+        )
+        self._fetch('/image.png')
+        assert self._fetch('/image.png') == self.data
+        assert len(self.server.clients) == 2
+
+    def test_fetcher_limits_connections_per_host(self):
+        self.fetcher.max_connections = 1
+        self.fetcher._hosts.clear()
+        first = self.fetcher.open_url(self.server.url('/image.png'))
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(self._fetch('/image.png'))
+        )
+        thread.start()
+        thread.join(0.2)
+        assert thread.isAlive()
+        first.read()
+        first.close()
+        thread.join(5)
+        assert results == [self.data]
+        assert len(self.server.clients) == 1
+
+    def test_fetcher_retries_failed_requests(self):
+        self.server.route('/flaky', failing(self.data, 2))
+        assert self._fetch('/flaky') == self.data
+        assert self.server.requests == ['/flaky'] * 3
+
+    def test_fetcher_gives_up_after_retries(self):
+        self.server.route('/flaky', failing(self.data, 3))
+        try:
+            self._fetch('/flaky')
+        except urllib2.HTTPError, e:
+            assert e.code == 503
+            assert len(self.server.requests) == 3
+            return
+        assert False
+
+    def test_fetcher_can_be_shared_by_threads(self):
+        results = []
+
+        def fetch():
+            for _ in xrange(5):
+                results.append(self._fetch('/image.png'))
+
+        threads = [threading.Thread(target=fetch) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert results == [self.data] * 40
+        assert len(self.server.clients) <= self.fetcher.max_connections
+
+    def test_fetcher_can_be_pickled(self):
+        self._fetch('/image.png')
+        fetcher = pickle.loads(pickle.dumps(self.fetcher))
+        assert fetcher.max_connections == self.fetcher.max_connections
+        response = fetcher.open_url(self.server.url('/image.png'))
+        assert response.read() == self.data
+        response.close()
+        fetcher.close()
+
+    def test_image_loads_with_fetcher(self):
+        image = Image(self.server.url('/image.png'), fetcher=self.fetcher)
+        Image(self.server.url('/image.png'), fetcher=self.fetcher)
+        assert image.size == (40, 30)
+        assert len(self.server.clients) == 1
+
+    def test_fetcher_uses_proxy_from_environment(self, monkeypatch):
+        monkeypatch.setenv('http_proxy', self.server.url(''))
+        monkeypatch.delenv('no_proxy', raising=False)
+        self.server.route('http://images.invalid/image.png', self.data)
+        for _ in xrange(2):
+            response = self.fetcher.open_url('http://images.invalid/image.png')
+            assert response.read() == self.data
+            response.close()
+        assert len(self.server.clients) == 1
+
+    def test_resizer_loads_with_fetcher(self):
+        resizer = Resizer(sizes={'small': (20, 20)}, fetcher=self.fetcher)
+        resizer.resize_image(self.server.url('/image.png'))
+        resizer.plan(self.server.url('/image.png'))
+        assert len(self.server.clients) == 1
@@ -0,0 +1,130 @@
+import pytest
+from resizer import Resizer, Operations, Image
+from resizer import geometry
+from resizer.image import Size
+
+numpy = pytest.importorskip('numpy')
+
+ADAPTION_MODES = ['ignore', 'throw', 'downsize', 'resize']
+
+
+class FakeImage(Image):
+    # Only the size and format are needed for planning.
+    def __init__(self, width, height, ext='jpeg'):
+        self._size = Size(width, height)
+        self.ext = ext
+
+    @property
+    def size(self):
+        return self._size
+
+
+class TestPlanMany(object):
+    def setup_method(self, method):
+        self.sizes = {
+            'large': (800, 600),
+            'square': (150, 150, 'png'),
+            'thin': (333, 7),
+            'options': (120, 90, 'jpeg', {'quality': 80}),
+            'original': [],
+        }
+        random = numpy.random.RandomState(0)
+        self.widths = numpy.concatenate((
+            random.randint(1, 3000, 500),
+            [1, 7, 150, 333, 800, 801, 1000, 999, 2999],
+        ))
+        self.heights = numpy.concatenate((
+            random.randint(1, 3000, 500),
+            [1, 7, 150, 21, 600, 601, 3, 1000, 1],
+        ))
+
+    def _assert_same_plans(self, **kwargs):
+        resizer = Resizer(sizes=self.sizes, **kwargs)
+        plan = resizer.plan_many(self.widths, self.heights, 'jpeg')
+        assert sorted(plan.keys()) == sorted(self.sizes.keys())
+
+        for (index, (width, height)) in enumerate(zip(self.widths,
+                                                      self.heights)):
+            image = FakeImage(int(width), int(height))
+            for (name, operations) in plan.iteritems():
+                assert isinstance(operations, Operations)
+                resizer.sizes = {name: self.sizes[name]}
+                try:
+                    expected = resizer.plan(image)[name]
+                except ValueError:
+                    with pytest.raises(ValueError):
+                        operations[index]
+                    assert operations.outcome[index] == geometry.THROWN
+                else:
+                    assert operations[index] == expected
+            resizer.sizes = self.sizes
+
+    @pytest.mark.parametrize('adaption_mode', ADAPTION_MODES)
+    def test_plan_many_matches_plan(self, adaption_mode):
+        self._assert_same_plans(adaption_mode=adaption_mode)
+
+    @pytest.mark.parametrize('adaption_mode', ADAPTION_MODES)
+    def test_plan_many_matches_plan_when_precise(self, adaption_mode):
+        self._assert_same_plans(precise=True, adaption_mode=adaption_mode)
+
+    @pytest.mark.parametrize('adaption_mode', ADAPTION_MODES)
+    def test_plan_many_matches_plan_when_precise_without_crop(self,
+                                                             adaption_mode):
+        self._assert_same_plans(
+            precise=True, crop=False, adaption_mode=adaption_mode
+        )
+
+    def test_plan_many_matches_plan_for_ratios_near_halves(self):
+        # Products that land right next to .5 tell round() and numpy.round
+        # apart.
+        self.sizes = {'size': (3, 2)}
+        self.widths = numpy.arange(1, 2000)
+        self.heights = numpy.arange(1, 2000)[::-1] * 2 + 1
+        self._assert_same_plans(adaption_mode='downsize')
+
+    def test_round_rounds_halves_away_from_zero(self):
+        values = numpy.array([0.5, 1.5, 2.5, 2.4999999999999996,
+                              0.49999999999999994])
+        assert geometry._round(values).tolist() == [
+            int(round(value)) for value in values
+        ]
+
+    def test_plan_many_uses_the_given_format(self):
+        resizer = Resizer(sizes={'a': (10, 10), 'b': (10, 10, 'png')})
+        plan = resizer.plan_many([20], [20], 'gif')
+        assert plan['a'].format == 'gif'
+        assert plan['b'].format == 'png'
+        assert resizer.plan_many([20], [20])['a'].format == 'png'
+
+    def test_plan_many_returns_arrays(self):
+        resizer = Resizer(sizes={'a': (10, 10)}, precise=True)
+        operations = resizer.plan_many([20, 40], [40, 20])['a']
+        assert len(operations) == 2
+        assert operations.size.tolist() == [[10, 10], [10, 10]]
+        assert operations.crop.tolist() == [[0, 0, 20, 20], [0, 0, 20, 20]]
+
+    def test_plan_many_requires_sizes(self):
+        with pytest.raises(ValueError):
+            Resizer().plan_many([1], [1])
+
+    @pytest.mark.parametrize('widths,heights', [
+        ([1, 2], [1]),
+        ([[1]], [[1]]),
+        ([0], [1]),
+        ([1], [-1]),
+    ])
+    def test_plan_many_validates_dimensions(self, widths, heights):
+        resizer = Resizer(sizes={'a': (10, 10)})
+        with pytest.raises(ValueError):
+            resizer.plan_many(widths, heights)
+
+    def test_plan_many_raises_for_unknown_adaption_mode(self):
+        resizer = Resizer(sizes={'a': (10, 10)})
+        resizer.adaption_mode = 'unknown'
+        with pytest.raises(ValueError):
+            resizer.plan_many([5], [5])
+
+    def test_plan_many_requires_numpy(self, monkeypatch):
+        monkeypatch.setattr(geometry, 'numpy', None)
+        with pytest.raises(ValueError):
+            Resizer(sizes={'a': (10, 10)}).plan_many([1], [1])
@@ -1,9 +1,14 @@
 from __future__ import with_statement
 from flexmock import flexmock
-from PIL import Image as pil_image
+from PIL import Image as pil_image, GifImagePlugin
 from PIL.Image import Image as PILImage
-from resizer import Image
-import urllib2
+from resizer import Image, LimitExceeded
+from StringIO import StringIO
+import mmap
+import pickle
+import pytest
+import tempfile
+from resizer import fetch
 
 
 class TestImage(object):
@@ -25,28 +30,79 @@ class TestImage(object):
     def test_height_returns_correct_height(self):
         assert self.image.height == self.pil_image.size[1]
 
+    def _mock_response(self, data, length=None):
+        return flexmock(
+            read=StringIO(data).read,
+            getheader=lambda name: length,
+            close=lambda: None
+        )
+
     def test_loading_from_url_loads_from_url(self):
         url = 'http://nonexistent/image.jpeg'
+        timeout = object()
         loaded_url = (
-            flexmock(urllib2)
-            .should_receive('urlopen')
+            flexmock(fetch)
+            .should_receive('open_url')
             .once()
-            .with_args(url)
-            .and_return(flexmock(read=lambda: self.test_image_data))
+            .with_args(url, timeout)
+            .and_return(self._mock_response(self.test_image_data))
         )
-        Image(url)
+        Image(url, timeout=timeout)
         loaded_url.verify()
 
     def test_loading_from_url_loads_correct_data(self):
         url = 'http://nonexistent/image.jpeg'
-        (flexmock(urllib2)
-            .should_receive('urlopen')
-            .and_return(flexmock(read=lambda: self.test_image_data))
+        (flexmock(fetch)
+            .should_receive('open_url')
+            .and_return(self._mock_response(self.test_image_data))
         )
         image = Image(url)
         assert image.size == (1, 1)
         assert image.ext == 'jpeg'
 
+    def test_loading_from_url_raises_value_error_for_too_many_bytes(self):
+        (flexmock(fetch)
+            .should_receive('open_url')
+            .and_return(self._mock_response(self.test_image_data))
+        )
+        try:
+            Image('http://nonexistent/image.jpeg', max_bytes=10)
+        except ValueError:
+            return
+        assert False
+
+    def test_loading_from_url_checks_content_length_before_reading(self):
+        response = self._mock_response(self.test_image_data, '100000')
+        (response
+            .should_receive('read')
+            .and_raise(AssertionError('Not supposed to be called')))
+        flexmock(fetch).should_receive('open_url').and_return(response)
+        try:
+            Image('http://nonexistent/image.jpeg', max_bytes=1000)
+        except ValueError:
+            return
+        assert False
+
+    def test_loading_from_url_stops_reading_after_too_large_header(self):
+        data = StringIO()
+        pil_image.new('L', (2000, 2000)).save(data, 'PNG')
+        data = data.getvalue()
+        read = []
+
+        def read_chunk(size):
+            read.append(size)
+            return data[(len(read) - 1) * size:len(read) * size]
+
+        response = self._mock_response(data)
+        response.read = read_chunk
+        flexmock(fetch).should_receive('open_url').and_return(response)
+        try:
+            Image('http://nonexistent/image.png', max_pixels=1000)
+        except ValueError:
+            assert len(read) == 1
+            return
+        assert False
+
     def test_loading_from_file_path_calls_pil_open(self):
         path = 'tests/nonexistent.png'
         opened = (
@@ -106,3 +162,220 @@ class TestImage(object):
         image = Image(self.image)
         assert image.size == self.image.size
         assert image.ext == self.image.ext
+
+    def test_image_can_be_pickled(self):
+        image = Image(pil_image.new('RGB', (30, 20)))
+        image.ext = 'png'
+        unpickled = pickle.loads(pickle.dumps(image, 2))
+        assert unpickled.size == (30, 20)
+        assert unpickled.ext == 'png'
+
+    def test_encode_encodes_in_ext_format(self):
+        image = Image(pil_image.new('RGB', (30, 20)))
+        image.ext = 'jpg'
+        data = image.encode(quality=50)
+        decoded = Image(StringIO(data))
+        assert decoded.size == (30, 20)
+        assert decoded.ext == 'jpeg'
+
+    def test_encode_raises_value_error_without_ext(self):
+        image = Image(pil_image.new('RGB', (30, 20)))
+        try:
+            image.encode()
+        except ValueError:
+            return
+        assert False
+
+
+class TestSlimImage(object):
+    def setup_method(self, method):
+        self.image = Image(pil_image.new('RGB', (40, 30)), copy=False)
+
+    def test_attributes_cannot_be_added(self):
+        with pytest.raises(AttributeError):
+            self.image.anything = 1
+        self.image.ext = 'png'
+        self.image.options = {'optimize': True}
+
+    def test_size_is_cached(self):
+        assert self.image.size is self.image.size
+        assert self.image.size == (40, 30)
+
+    def test_size_follows_the_pil_image(self):
+        self.image.size
+        self.image.thumbnail((20, 20))
+        assert self.image.size == (20, 15)
+        assert self.image.width == 20
+        assert self.image.height == 15
+
+    def test_size_follows_drafting(self):
+        data = StringIO()
+        pil_image.new('RGB', (400, 300)).save(data, 'JPEG')
+        data.seek(0)
+        image = Image(data)
+        assert image.size == (400, 300)
+        image.draft('RGB', (100, 75))
+        assert image.size == (100, 75)
+
+    def test_frequent_methods_are_those_of_the_pil_image(self):
+        pil = self.image._pil_image
+        assert self.image.resize == pil.resize
+        assert self.image.crop == pil.crop
+        assert self.image.crop((0, 0, 10, 10)).size == (10, 10)
+
+    def test_other_attributes_are_those_of_the_pil_image(self):
+        assert self.image.mode == 'RGB'
+        assert self.image.getpixel((0, 0)) == (0, 0, 0)
+
+    def test_pickling_keeps_format_and_options(self):
+        self.image.ext = 'png'
+        self.image.options = {'optimize': True}
+        image = pickle.loads(pickle.dumps(self.image, 2))
+        assert image.ext == 'png'
+        assert image.options == {'optimize': True}
+        assert image.size == (40, 30)
+
+
+class TestBufferImage(object):
+    def setup_method(self, method):
+        self.pil_image = pil_image.linear_gradient('L').resize((40, 30))
+
+    def _encode(self, format, mode='L'):
+        data = StringIO()
+        self.pil_image.convert(mode).save(data, format)
+        return data.getvalue()
+
+    @pytest.mark.parametrize('wrap', [bytearray, buffer, memoryview])
+    def test_loading_from_buffer_loads_correct_data(self, wrap):
+        image = Image(wrap(self._encode('PNG')))
+        assert image.ext == 'png'
+        assert image.tobytes() == self.pil_image.tobytes()
+
+    def test_loading_from_mmap_loads_correct_data(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(self._encode('BMP'))
+            f.flush()
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        image = Image(source)
+        assert image.ext == 'bmp'
+        assert image.tobytes() == self.pil_image.tobytes()
+
+    def test_loading_from_buffer_does_not_copy_it(self, monkeypatch):
+        def str_io(self, data):
+            raise AssertionError('Not supposed to be called')
+        data = bytearray(self._encode('PNG'))
+        monkeypatch.setattr('StringIO.StringIO.__init__', str_io)
+        assert Image(data).size == (40, 30)
+
+    @pytest.mark.parametrize('format,mode', [
+        ('BMP', 'L'), ('PPM', 'L'), ('TIFF', 'RGBA'), ('BMP', 'P'),
+    ])
+    def test_uncompressed_pixels_are_used_in_place(self, format, mode):
+        data = bytearray(self._encode(format, mode))
+        image = Image(data, copy=False)
+        assert image._pil_image.readonly
+        assert image.tobytes() == self.pil_image.convert(mode).tobytes()
+        if mode == 'P':
+            assert image.convert('L').tobytes() == self.pil_image.tobytes()
+
+    def test_pixels_stored_differently_are_decoded(self):
+        image = Image(bytearray(self._encode('BMP', 'RGB')))
+        assert image._pil_image.im is None
+        assert image.convert('L').tobytes() == self.pil_image.tobytes()
+
+    def test_truncated_buffers_raise_when_loaded(self):
+        data = bytearray(self._encode('BMP'))[:-100]
+        image = Image(data)
+        with pytest.raises(IOError):
+            image.load()
+
+    def test_max_bytes_is_checked_for_buffers(self):
+        data = memoryview(bytearray(self._encode('PNG')))
+        with pytest.raises(LimitExceeded) as info:
+            Image(data, max_bytes=10)
+        assert info.value.value == len(data)
+
+
+class TestImageLimits(object):
+    def setup_method(self, method):
+        self.path = 'tests/image.jpg'
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+
+    def _assert_limit_exceeded(self, limit, source, **kwargs):
+        try:
+            Image(source, **kwargs)
+        except LimitExceeded, e:
+            assert isinstance(e, ValueError)
+            assert e.limit == limit
+            return e
+        assert False, 'Expected LimitExceeded'
+
+    def _make_gif(self, frames):
+        data = StringIO()
+        images = [pil_image.new('L', (10, 10), i * 10) for i in range(frames)]
+        images[0].save(data, 'GIF', save_all=True,
+                       append_images=images[1:])
+        data.seek(0)
+        return data
+
+    def test_max_pixels_is_checked_before_decoding(self, monkeypatch):
+        def load(self):
+            raise AssertionError('Not supposed to be called')
+        monkeypatch.setattr(PILImage, 'load', load)
+        e = self._assert_limit_exceeded('max_pixels', self.path, max_pixels=0)
+        assert e.value == 1
+
+    def test_max_pixels_allows_smaller_images(self):
+        assert Image(self.path, max_pixels=1).size == (1, 1)
+
+    def test_max_bytes_is_checked_for_paths(self):
+        e = self._assert_limit_exceeded('max_bytes', self.path, max_bytes=10)
+        assert e.value == len(self.data)
+
+    def test_max_bytes_is_checked_for_files(self):
+        source = StringIO(self.data)
+        source.read(10)
+        e = self._assert_limit_exceeded('max_bytes', source, max_bytes=10)
+        assert e.value == len(self.data) - 10
+        assert source.tell() == 10
+
+    def test_max_bytes_is_ignored_for_files_that_cannot_seek(self):
+        source = flexmock(read=StringIO(self.data).read)
+        assert Image(source, max_bytes=10).size == (1, 1)
+
+    def test_max_frames_is_checked(self):
+        e = self._assert_limit_exceeded(
+            'max_frames', self._make_gif(3), max_frames=2
+        )
+        assert e.value == 3
+        assert Image(self._make_gif(2), max_frames=2).size == (10, 10)
+
+    def test_max_frames_stops_decoding_gifs_at_the_limit(self, monkeypatch):
+        seeks = []
+        seek = GifImagePlugin.GifImageFile._seek
+
+        def record(self, frame):
+            seeks.append(frame)
+            return seek(self, frame)
+        gif = self._make_gif(20)
+        monkeypatch.setattr(GifImagePlugin.GifImageFile, '_seek', record)
+        e = self._assert_limit_exceeded('max_frames', gif, max_frames=2)
+        assert e.value == 3
+        assert max(seeks) == 2
+
+    def test_max_frames_keeps_first_frame_of_gifs(self):
+        image = Image(self._make_gif(3), max_frames=5)
+        assert image.getpixel((0, 0)) == 0
+
+    def test_limit_exceeded_can_be_pickled(self):
+        e = pickle.loads(pickle.dumps(
+            LimitExceeded('Too large.', 'max_pixels', 100)
+        ))
+        assert isinstance(e, LimitExceeded)
+        assert (str(e), e.limit, e.value) == ('Too large.', 'max_pixels', 100)
+
+    def test_limits_are_checked_for_pil_images(self):
+        self._assert_limit_exceeded(
+            'max_pixels', pil_image.new('L', (10, 10)), max_pixels=99
+        )
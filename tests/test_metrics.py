@@ -0,0 +1,121 @@
+from PIL import Image as pil_image
+from resizer import Resizer, Metrics, add_tracer, remove_tracer
+from resizer.trace import Span
+
+
+class TestMetrics(object):
+    def setup_method(self, method):
+        self.metrics = Metrics(buckets=(0.1, 1.0))
+        add_tracer(self.metrics)
+        self.source = pil_image.new('RGB', (300, 200))
+        self.source.format = 'JPEG'
+
+    def teardown_method(self, method):
+        remove_tracer(self.metrics)
+
+    def _get_samples(self):
+        samples = {}
+        for line in self.metrics.render().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_render_renders_histograms(self):
+        self.metrics(Span('resize', 0, 0.05, {'name': 'small'}))
+        self.metrics(Span('resize', 0, 0.5, {'name': 'small'}))
+        self.metrics(Span('resize', 0, 5, {'name': 'small'}))
+        assert self.metrics.render() == (
+            '# HELP resizer_resize_seconds Time spent resampling images.\n'
+            '# TYPE resizer_resize_seconds histogram\n'
+            'resizer_resize_seconds_bucket{size="small",le="0.1"} 1.0\n'
+            'resizer_resize_seconds_bucket{size="small",le="1.0"} 2.0\n'
+            'resizer_resize_seconds_bucket{size="small",le="+Inf"} 3.0\n'
+            'resizer_resize_seconds_sum{size="small"} 5.55\n'
+            'resizer_resize_seconds_count{size="small"} 3.0\n'
+        )
+
+    def test_render_renders_counters(self):
+        self.metrics(Span('fetch', 0, 0.05, {'url': 'x', 'bytes': 100}))
+        self.metrics(Span('fetch', 0, 0.05, {'url': 'x', 'bytes': 50}))
+        output = self.metrics.render()
+        assert '# TYPE resizer_fetch_bytes_total counter\n' in output
+        assert 'resizer_fetch_bytes_total 150.0\n' in output
+        assert 'resizer_fetch_seconds_count 2.0\n' in output
+
+    def test_render_escapes_labels(self):
+        self.metrics(Span('resize', 0, 0.05, {'name': 'a"b\\c\nd'}))
+        assert (
+            'resizer_resize_seconds_count{size="a\\"b\\\\c\\nd"} 1.0\n' in
+            self.metrics.render()
+        )
+
+    def test_resize_image_updates_metrics(self):
+        resizer = Resizer(sizes={
+            'small': (30, 30),
+            'square': (50, 50, 'png'),
+            'huge': (1000, 1000),
+        }, precise=True, adaption_mode='ignore')
+        images = resizer.resize_image(self.source)
+        resizer.encode_all(images)
+        samples = self._get_samples()
+        assert samples['resizer_decode_seconds_count{format="jpeg"}'] == 1
+        assert samples['resizer_resize_seconds_count{size="small"}'] == 1
+        assert samples['resizer_crop_seconds_count{size="square"}'] == 1
+        assert samples[
+            'resizer_adaptions_total{size="huge",outcome="ignored"}'
+        ] == 1
+        assert samples[
+            'resizer_precise_total{size="small",result="crop"}'
+        ] == 1
+        assert samples[
+            'resizer_precise_total{size="square",result="crop"}'
+        ] == 1
+        assert samples['resizer_encode_seconds_count{format="png"}'] == 1
+        assert samples['resizer_encode_bytes_total{format="jpeg"}'] > 0
+
+    def test_plan_counts_direct_hits_and_throws(self):
+        resizer = Resizer(sizes={'wide': (30, 20)}, precise=True)
+        resizer.resize_image(self.source)
+        resizer.sizes = {'huge': (1000, 1000)}
+        resizer.adaption_mode = 'throw'
+        try:
+            resizer.resize_image(self.source)
+        except ValueError:
+            pass
+        samples = self._get_samples()
+        assert samples[
+            'resizer_precise_total{size="wide",result="direct"}'
+        ] == 1
+        assert samples[
+            'resizer_adaptions_total{size="huge",outcome="thrown"}'
+        ] == 1
+        assert 'resizer_precise_total{size="huge",result="direct"}' \
+            not in samples
+
+    def test_aspect_ratio_errors_are_not_adaptions(self):
+        resizer = Resizer(sizes={'square': (10, 10)}, precise=True,
+                          crop=False)
+        try:
+            resizer.resize_image(pil_image.new('RGB', (40, 20)))
+        except ValueError:
+            pass
+        assert 'adaptions_total' not in self.metrics.render()
+
+    def test_plan_does_not_update_metrics(self):
+        Resizer(sizes={'small': (30, 30)}, precise=True).plan(self.source)
+        assert self.metrics.render() == ''
+
+    def test_images_are_counted_for_each_size(self):
+        resizer = Resizer(sizes={'small': (30, 30), 'original': []})
+        resizer.resize_image(self.source)
+        resizer.resize_image(self.source)
+        samples = self._get_samples()
+        assert samples['resizer_images_total{size="small"}'] == 2
+        assert samples['resizer_images_total{size="original"}'] == 2
+
+    def test_metrics_pickle(self):
+        import pickle
+        self.metrics(Span('resize', 0, 0.05, {'name': 'small'}))
+        metrics = pickle.loads(pickle.dumps(self.metrics))
+        assert metrics.render() == self.metrics.render()
@@ -1,14 +1,37 @@
 from __future__ import with_statement
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 from contextlib import contextmanager
+from StringIO import StringIO
+import pytest
 from flexmock import flexmock
+from PIL import Image as pil_image, ImageChops, ImageStat
 from PIL.Image import ANTIALIAS, Image as PILImage
-from resizer import Resizer, Image
+from resizer import Resizer, Image, Operation, LazyImages, LimitExceeded
+
+
+@pytest.fixture
+def resizes(monkeypatch):
+    # Records the source size, size and mode of every PIL resize.
+    calls = []
+    original_resize = PILImage.resize
+
+    def resize(im, size, mode):
+        calls.append((im.size, size, mode))
+        return original_resize(im, size, mode)
+
+    monkeypatch.setattr(PILImage, 'resize', resize)
+    return calls
 
 
 class FakeImage(Image):
     stack = []
 
-    def __init__(self, source, copy=True):
+    def __init__(self, source, copy=True, **kwargs):
         self.ext = None
         self.source = source
         FakeImage.stack.append(self)
@@ -95,3 +118,537 @@ class TestResizer(object):
         except ValueError:
             return
         assert False
+
+
+class TestCascadedResizer(object):
+    def setup_method(self, method):
+        self.sizes = {
+            'large': (800, 800),
+            'medium': (300, 200),
+            'small': (100, 100),
+            'tiny': (33, 17, 'png'),
+            'original': [],
+        }
+        self.source = pil_image.new('RGB', (1000, 700), (10, 200, 30))
+        self.source.format = 'JPEG'
+
+    def _resize(self, **kwargs):
+        resizer = Resizer(sizes=self.sizes, **kwargs)
+        return resizer.resize_image(self.source)
+
+    def _assert_same_geometry(self, **kwargs):
+        expected = self._resize(**kwargs)
+        images = self._resize(cascade=True, **kwargs)
+        assert sorted(images.keys()) == sorted(expected.keys())
+        for (name, im) in images.iteritems():
+            assert im.size == expected[name].size
+            assert im.ext == expected[name].ext
+
+    def test_cascade_matches_plain_geometry(self):
+        self._assert_same_geometry()
+
+    def test_cascade_matches_plain_geometry_when_precise(self):
+        self._assert_same_geometry(precise=True)
+
+    def test_cascade_matches_plain_geometry_when_downsizing(self):
+        self.sizes['huge'] = (2000, 1000)
+        self._assert_same_geometry(adaption_mode='downsize')
+
+    def test_cascade_matches_plain_geometry_when_resizing(self):
+        self.sizes['huge'] = (2000, 1000)
+        self._assert_same_geometry(adaption_mode='resize', precise=True)
+
+    def test_cascade_ignores_too_large_sizes(self):
+        self.sizes['huge'] = (2000, 1000)
+        images = self._resize(cascade=True, adaption_mode='ignore')
+        assert 'huge' not in images
+
+    def test_cascade_resizes_from_intermediates(self, resizes):
+        self.sizes.pop('original')
+        self._resize(cascade=True)
+        assert [source for (source, _, _) in resizes] == [
+            (1000, 700), (800, 560), (286, 200), (100, 70)
+        ]
+
+
+class TestDraftingResizer(object):
+    def setup_method(self, method):
+        self.sizes = {
+            'small': (100, 100),
+            'cropped': (60, 30),
+        }
+        data = StringIO()
+        pil_image.new('RGB', (1000, 700), (10, 200, 30)).save(data, 'JPEG')
+        self.data = data.getvalue()
+
+    def _resize(self, **kwargs):
+        resizer = Resizer(sizes=self.sizes, **kwargs)
+        return resizer.resize_image(StringIO(self.data))
+
+    def _assert_same_geometry(self, **kwargs):
+        expected = self._resize(**kwargs)
+        images = self._resize(draft=True, **kwargs)
+        assert sorted(images.keys()) == sorted(expected.keys())
+        for (name, im) in images.iteritems():
+            assert im.size == expected[name].size
+
+    def test_draft_matches_plain_geometry(self):
+        self._assert_same_geometry()
+
+    def test_draft_matches_plain_geometry_when_precise(self):
+        self._assert_same_geometry(precise=True)
+
+    def test_draft_matches_plain_geometry_when_cascading(self):
+        self._assert_same_geometry(precise=True, cascade=True)
+
+    def test_draft_decodes_at_reduced_scale(self, resizes):
+        self._resize(draft=True)
+        assert [source for (source, _, _) in resizes] == [
+            (125, 88), (125, 88)
+        ]
+
+    def test_draft_decodes_at_full_scale_for_pass_through_sizes(self):
+        self.sizes['original'] = []
+        images = self._resize(draft=True)
+        assert images['original'].size == (1000, 700)
+
+    def test_draft_does_not_touch_images_owned_by_the_caller(self):
+        image = Image(StringIO(self.data))
+        Resizer(sizes=self.sizes, draft=True).resize_image(image)
+        assert image.size == (1000, 700)
+
+
+class TestReducingResizer(object):
+    def setup_method(self, method):
+        self.sizes = {
+            'thumbnail': (100, 100),
+            'medium': (500, 500),
+            'large': (1200, 1200),
+        }
+        # Noise in one of the bands gives the filters some detail to lose.
+        size = (3000, 2000)
+        gradient = pil_image.linear_gradient('L').resize(size)
+        noise = pil_image.effect_noise(size, 40)
+        self.source = pil_image.merge('RGB', (gradient, noise, gradient))
+        self.source.format = 'JPEG'
+
+    def _resize(self, **kwargs):
+        resizer = Resizer(sizes=self.sizes, **kwargs)
+        return resizer.resize_image(self.source)
+
+    def _get_psnr(self, a, b):
+        diff = ImageChops.difference(a._pil_image, b._pil_image)
+        mse = sum(rms ** 2 for rms in ImageStat.Stat(diff).rms) / 3
+        if not mse:
+            return float('inf')
+        return 10 * math.log10(255 ** 2 / mse)
+
+    def test_reduce_keeps_geometry(self):
+        expected = self._resize()
+        images = self._resize(reduce=True)
+        for (name, im) in images.iteritems():
+            assert im.size == expected[name].size
+
+    def test_reduce_is_close_to_single_pass(self):
+        for resize_mode in (ANTIALIAS, pil_image.BICUBIC, pil_image.BILINEAR):
+            expected = self._resize(resize_mode=resize_mode)
+            images = self._resize(resize_mode=resize_mode, reduce=True)
+            for (name, im) in images.iteritems():
+                assert self._get_psnr(im, expected[name]) > 40
+
+    def test_reduce_reduces_by_integer_factor_first(self, resizes):
+        self.sizes = {'thumbnail': (100, 100)}
+        self._resize(reduce=True)
+        assert resizes == [
+            ((3000, 2000), (215, 143), pil_image.BOX),
+            ((215, 143), (100, 67), ANTIALIAS),
+        ]
+
+    def test_reduce_skips_small_factors(self, resizes):
+        self.sizes = {'large': (1200, 1200)}
+        self._resize(reduce=True)
+        assert [size for (_, size, _) in resizes] == [(1200, 800)]
+
+
+class TestResizerPlan(object):
+    def setup_method(self, method):
+        data = StringIO()
+        pil_image.new('RGB', (300, 200)).save(data, 'JPEG')
+        self.data = data.getvalue()
+        self.resizer = Resizer(precise=True, sizes={
+            'thumbnail': (50, 50),
+            'wide': (150, 100, 'png'),
+            'original': [],
+        })
+
+    def test_plan_returns_operations(self):
+        plan = self.resizer.plan(StringIO(self.data))
+        assert plan == {
+            'thumbnail': Operation(size=(50, 50), format='jpeg',
+                                   crop=(0, 0, 200, 200)),
+            'wide': Operation(size=(150, 100), format='png'),
+            'original': Operation(format='jpeg'),
+        }
+
+    def test_plan_does_not_decode_pixels(self):
+        image = Image(StringIO(self.data))
+        self.resizer.plan(image)
+        assert image._pil_image.im is None
+
+    def test_resize_image_resizes_once_per_size_when_precise(self, resizes):
+        images = self.resizer.resize_image(StringIO(self.data))
+        assert sorted(size for (_, size, _) in resizes) == [
+            (50, 50), (150, 100)
+        ]
+        assert images['thumbnail'].size == (50, 50)
+
+
+class TestThreadedResizer(object):
+    def setup_method(self, method):
+        self.sizes = {
+            'large': (800, 800),
+            'medium': (300, 200, 'png'),
+            'small': (100, 100),
+            'square': (90, 90),
+            'original': [],
+        }
+        self.source = pil_image.linear_gradient('L').resize((1000, 700))
+        self.source.format = 'JPEG'
+
+    def _resize(self, **kwargs):
+        resizer = Resizer(sizes=self.sizes, **kwargs)
+        return resizer.resize_image(self.source)
+
+    def _assert_same_images(self, **kwargs):
+        expected = self._resize(**kwargs)
+        images = self._resize(threads=3, **kwargs)
+        assert sorted(images.keys()) == sorted(expected.keys())
+        for (name, im) in images.iteritems():
+            assert im.size == expected[name].size
+            assert im.ext == expected[name].ext
+            assert im.tobytes() == expected[name].tobytes()
+
+    def test_threads_produce_same_images(self):
+        self._assert_same_images()
+
+    def test_threads_produce_same_images_when_precise(self):
+        self._assert_same_images(precise=True)
+
+    def test_threads_produce_same_images_when_cascading(self):
+        self._assert_same_images(precise=True, cascade=True)
+
+    def test_threads_produce_same_images_when_resizing(self):
+        self.sizes['huge'] = (2000, 2000)
+        self._assert_same_images(precise=True, adaption_mode='resize')
+
+    def test_threads_share_thread_pool(self):
+        from resizer.pool import get_thread_pool
+        assert get_thread_pool(3) is get_thread_pool(3)
+        assert get_thread_pool(3) is not get_thread_pool(2)
+
+
+class TestLazyResizer(object):
+    def setup_method(self, method):
+        self.sizes = {
+            'large': (800, 500),
+            'small': (100, 100, 'png'),
+            'original': [],
+        }
+        self.source = pil_image.linear_gradient('L').resize((1000, 700))
+        self.source.format = 'JPEG'
+        self.resizer = Resizer(sizes=self.sizes, lazy=True)
+
+    def test_lazy_images_are_not_rendered_up_front(self):
+        images = self.resizer.resize_image(self.source)
+        assert isinstance(images, LazyImages)
+        assert len(images) == 3
+        assert 'small' in images
+        assert sorted(images.keys()) == ['large', 'original', 'small']
+        assert images.rendered() == []
+
+    def test_lazy_images_render_on_access(self):
+        images = self.resizer.resize_image(self.source)
+        small = images['small']
+        assert small.size == (100, 70)
+        assert small.ext == 'png'
+        assert images.rendered() == ['small']
+        assert images['small'] is small
+
+    def test_lazy_images_produce_same_images(self):
+        expected = Resizer(sizes=self.sizes).resize_image(self.source)
+        images = self.resizer.resize_image(self.source)
+        assert len(list(images.iteritems())) == len(expected)
+        for (name, im) in images.iteritems():
+            assert im.size == expected[name].size
+            assert im.ext == expected[name].ext
+            assert im.tobytes() == expected[name].tobytes()
+
+    def test_lazy_images_omit_ignored_sizes(self):
+        self.sizes['huge'] = (2000, 2000)
+        self.resizer.adaption_mode = 'ignore'
+        images = self.resizer.resize_image(self.source)
+        assert 'huge' not in images
+        assert len(images) == 3
+        assert images.rendered() == []
+
+    def test_lazy_images_raise_key_error_for_unknown_sizes(self):
+        images = self.resizer.resize_image(self.source)
+        try:
+            images['medium']
+        except KeyError:
+            return
+        assert False, 'Expected a KeyError'
+
+    def test_lazy_images_pickle_to_dict(self):
+        import pickle
+        images = pickle.loads(
+            pickle.dumps(self.resizer.resize_image(self.source))
+        )
+        assert type(images) is dict
+        assert images['small'].size == (100, 70)
+
+
+class TestIterResize(object):
+    def setup_method(self, method):
+        self.sizes = {
+            'large': (800, 500),
+            'medium': (300, 200, 'png'),
+            'small': (100, 100),
+            'original': [],
+        }
+        self.source = pil_image.linear_gradient('L').resize((1000, 700))
+        self.source.format = 'JPEG'
+
+    def _assert_same_images(self, **kwargs):
+        resizer = Resizer(sizes=self.sizes, **kwargs)
+        expected = resizer.resize_image(self.source)
+        names = []
+        for (name, im) in resizer.iter_resize(self.source):
+            names.append(name)
+            assert im.size == expected[name].size
+            assert im.ext == expected[name].ext
+            assert im.tobytes() == expected[name].tobytes()
+        assert sorted(names) == sorted(expected.keys())
+
+    def test_iter_resize_produces_same_images(self):
+        self._assert_same_images()
+
+    def test_iter_resize_produces_same_images_when_cascading(self):
+        self.sizes['tiny'] = (30, 30)
+        self._assert_same_images(precise=True, cascade=True)
+
+    def test_iter_resize_produces_same_images_when_resizing(self):
+        self.sizes['huge'] = (2000, 2000)
+        self._assert_same_images(precise=True, adaption_mode='resize')
+
+    def test_iter_resize_yields_largest_sizes_first(self):
+        resizer = Resizer(sizes=self.sizes)
+        names = [name for (name, _) in resizer.iter_resize(self.source)]
+        assert names == ['large', 'medium', 'small', 'original']
+
+    def test_iter_resize_raises_before_iterating(self):
+        resizer = Resizer(sizes={'huge': (2000, 2000)}, adaption_mode='throw')
+        try:
+            resizer.iter_resize(self.source)
+        except ValueError:
+            return
+        assert False, 'Expected a ValueError'
+
+    @pytest.mark.skipif(not os.path.exists('/proc/self/status'),
+                        reason='Needs /proc')
+    def test_iter_resize_has_lower_peak_memory(self):
+        # Measured in fresh processes, because the peak never goes down.
+        def get_peak_memory(method):
+            output = subprocess.check_output(
+                [sys.executable, '-c', PEAK_MEMORY_SCRIPT, method]
+            )
+            return int(output)
+
+        # Four sizes of ~45MB each, keeping them all takes over 80MB more.
+        assert (
+            get_peak_memory('iter_resize') + 80 * 1024 <
+            get_peak_memory('resize_image')
+        )
+
+
+PEAK_MEMORY_SCRIPT = """
+import sys
+import tempfile
+from PIL import Image
+from resizer import Resizer
+
+source = Image.new('RGB', (4000, 3000), (255, 0, 0))
+sizes = dict(('s%d' % i, (3900 - i * 100, 3900)) for i in range(4))
+resizer = Resizer(sizes=sizes, resize_mode=Image.NEAREST)
+if sys.argv[1] == 'iter_resize':
+    for (name, image) in resizer.iter_resize(source):
+        image.size
+        del image
+else:
+    for (name, image) in resizer.resize_image(source).items():
+        image.size
+# Unlike ru_maxrss, the high water mark isn't inherited from the parent.
+for line in open('/proc/self/status'):
+    if line.startswith('VmHWM:'):
+        print line.split()[1]
+"""
+
+
+class TestResizerLimits(object):
+    def setup_method(self, method):
+        self.resizer = Resizer(sizes={'small': (10, 10)}, max_pixels=100)
+        self.source = StringIO()
+        pil_image.new('RGB', (20, 20)).save(self.source, 'PNG')
+        self.source.seek(0)
+
+    def _assert_limit_exceeded(self, function, *args):
+        try:
+            function(*args)
+        except LimitExceeded:
+            return
+        assert False, 'Expected LimitExceeded'
+
+    def test_resize_image_checks_limits(self):
+        self._assert_limit_exceeded(self.resizer.resize_image, self.source)
+
+    def test_resize_image_checks_limits_of_images(self):
+        self._assert_limit_exceeded(
+            self.resizer.resize_image, Image(self.source)
+        )
+
+    def test_plan_checks_limits(self):
+        self._assert_limit_exceeded(self.resizer.plan, self.source)
+
+    def test_resize_image_allows_images_within_limits(self):
+        self.resizer.max_pixels = 400
+        self.resizer.max_bytes = 1000
+        images = self.resizer.resize_image(self.source)
+        assert images['small'].size == (10, 10)
+
+    def test_resize_image_checks_bytes(self):
+        self.resizer.max_pixels = None
+        self.resizer.max_bytes = 10
+        self._assert_limit_exceeded(self.resizer.resize_image, self.source)
+
+
+class TestPassThroughResizer(object):
+    def setup_method(self, method):
+        self.resizer = Resizer(sizes={
+            'original': [],
+            'copy': ['jpeg'],
+            'png': ['png'],
+            'small': (10, 10),
+        })
+        self.path = 'tests/image.jpg'
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        self.source = StringIO()
+        pil_image.linear_gradient('L').resize((40, 30)).save(
+            self.source, 'JPEG'
+        )
+        self.source.seek(0)
+
+    def test_originals_share_the_pixels_of_the_source(self):
+        images = self.resizer.resize_image(self.source)
+        ids = [images[name]._pil_image.im.id for name in ('original', 'png')]
+        assert ids[0] == ids[1]
+
+    def test_sources_of_the_caller_stay_writable(self):
+        source = pil_image.open(self.source)
+        source.load()
+        images = self.resizer.resize_image(source)
+        assert not source.readonly
+        source.load()[0, 0] = 255
+        assert images['original'].getpixel((0, 0)) != 255
+
+        image = Image(self.path)
+        image.load()
+        images = self.resizer.resize_image(image)
+        image.load()[0, 0] = (255, 0, 0)
+        assert images['original'].getpixel((0, 0)) != (255, 0, 0)
+
+    def test_loaded_images_stay_writable(self):
+        image = Image(self.path)
+        image.load()[0, 0] = (255, 0, 0)
+        assert image.getpixel((0, 0)) == (255, 0, 0)
+        assert image.encode() != self.data
+
+    def test_modifying_an_original_copies_its_pixels(self):
+        images = self.resizer.resize_image(self.source)
+        expected = images['png'].tobytes()
+        images['original'].paste(255, (0, 0, 40, 30))
+        assert images['original'].getpixel((0, 0)) == 255
+        assert images['png'].tobytes() == expected
+
+    def test_originals_can_be_modified_through_pixel_access(self):
+        images = self.resizer.resize_image(self.source)
+        expected = images['png'].tobytes()
+        images['original'].load()[0, 0] = 255
+        assert images['original'].getpixel((0, 0)) == 255
+        assert images['png'].tobytes() == expected
+        assert images['original'].encode() != self.source.getvalue()
+
+    def test_originals_in_the_same_format_are_streamed(self):
+        images = self.resizer.resize_image(self.path)
+        assert images['original'].encode() == self.data
+        assert images['copy'].encode() == self.data
+
+    def test_originals_in_the_same_format_are_saved_unchanged(self):
+        images = self.resizer.resize_image(self.path)
+        output = StringIO()
+        images['original'].save(output, 'jpeg')
+        assert output.getvalue() == self.data
+
+        path = os.path.join(tempfile.mkdtemp(), 'original.jpg')
+        try:
+            images['copy'].save(path)
+            with open(path, 'rb') as f:
+                assert f.read() == self.data
+            images['original'].save(path, quality=10)
+            with open(path, 'rb') as f:
+                assert f.read() != self.data
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_originals_in_other_formats_are_saved_by_pil(self):
+        images = self.resizer.resize_image(self.path)
+        output = StringIO()
+        images['original'].save(output, 'png')
+        assert output.getvalue().startswith('\x89PNG')
+
+    def test_originals_in_other_formats_are_encoded(self):
+        images = self.resizer.resize_image(self.path)
+        data = images['png'].encode()
+        assert data.startswith('\x89PNG')
+
+    def test_originals_with_options_are_encoded(self):
+        images = self.resizer.resize_image(self.path)
+        assert images['original'].encode(quality=10) != self.data
+
+    def test_modified_originals_are_encoded(self):
+        data = self.source.getvalue()
+        images = self.resizer.resize_image(bytearray(data))
+        assert images['original'].encode() == data
+        images['original'].putpixel((0, 0), 255)
+        assert images['original'].encode() != data
+        assert images['copy'].encode() == data
+
+    def test_originals_are_not_decoded_without_other_sizes(self, monkeypatch):
+        def load(self):
+            raise AssertionError('Not supposed to be called')
+        monkeypatch.setattr(PILImage, 'load', load)
+        self.resizer.sizes = {'original': [], 'copy': ['jpeg']}
+        images = self.resizer.resize_image(self.path)
+        assert images['original'].encode() == self.data
+        assert images['copy'].encode() == self.data
+
+    def test_originals_of_buffers_are_streamed(self):
+        images = self.resizer.resize_image(bytearray(self.data))
+        assert images['original'].encode() == self.data
+
+    def test_originals_are_not_streamed_after_pickling(self):
+        import pickle
+        images = self.resizer.resize_image(self.path)
+        original = pickle.loads(pickle.dumps(images['original']))
+        assert original.size == (1, 1)
+        assert not original._can_stream()
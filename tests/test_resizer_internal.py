@@ -1,6 +1,7 @@
 from __future__ import with_statement
 from flexmock import flexmock
-from resizer import Resizer
+from PIL import Image as pil_image
+from resizer import Resizer, Operation, Image
 from resizer.image import Size
 from .test_resizer import FakeImage
 
@@ -10,50 +11,43 @@ class TestResizerInternalMethods(object):
         self.resizer = Resizer()
 
     def test_parse_attrs_parses_three_tuples(self):
-        width, height, ext = object(), object(), object()
-        attrs = self.resizer._parse_attrs(None, (width, height, ext))
-        assert attrs[0].width is width
-        assert attrs[0].height is height
-        assert attrs[1] is ext
+        ext = object()
+        size, format = self.resizer._parse_attrs((30, 20, ext))
+        assert size == Size(30, 20)
+        assert format is ext
 
-    def test_parse_attrs_parses_two_tuples_and_gets_ext_from_source(self):
-        width, height, ext = object(), object(), object()
-        self.resizer.default_format = object()
-        attrs = self.resizer._parse_attrs(
-            flexmock(ext=ext), (width, height)
-        )
-        assert attrs[0].width is width
-        assert attrs[0].height is height
-        assert attrs[1] is ext
+    def test_parse_attrs_parses_two_tuples_without_format(self):
+        assert self.resizer._parse_attrs((30, 20)) == (Size(30, 20), None)
 
-    def test_parse_attrs_gets_ext_from_default_format(self):
-        width, height, ext = 0, 0, object()
-        self.resizer.default_format = ext
-        attrs = self.resizer._parse_attrs(
-            flexmock(ext=None), (width, height)
-        )
-        assert attrs[1] is ext
+    def test_parse_attrs_parses_empty_formats_as_default_format(self):
+        assert self.resizer._parse_attrs((30, 20, None)) == (Size(30, 20), '')
+        assert self.resizer._parse_attrs([None]) == (None, '')
 
     def test_parse_attrs_parses_one_tuples(self):
         ext = object()
-        attrs = self.resizer._parse_attrs(None, [ext])
+        attrs = self.resizer._parse_attrs([ext])
         assert attrs[0] is None
         assert attrs[1] is ext
 
     def test_parse_attrs_parses_zero_tuples(self):
-        ext = object()
-        im = flexmock(ext=ext)
-        attrs = self.resizer._parse_attrs(im, [])
-        assert attrs[0] is None
-        assert attrs[1] is ext
+        assert self.resizer._parse_attrs([]) == (None, None)
+        assert self.resizer._parse_attrs(None) == (None, None)
 
     def test_parse_attrs_raises_value_error_for_four_tuples(self):
         try:
-            self.resizer._parse_attrs(None, (0, 1, 2, 3))
+            self.resizer._parse_attrs((0, 1, 2, 3))
         except ValueError:
             return
         assert False
 
+    def test_parse_attrs_raises_value_error_for_invalid_dimensions(self):
+        for attrs in [(0, 10), (10, -1), (10.0, 10), (True, 10), ('a', 1)]:
+            try:
+                self.resizer._parse_attrs(attrs)
+            except ValueError:
+                continue
+            assert False, attrs
+
     def test_is_smaller_returns_false_for_larger_size(self):
         assert self.resizer._is_smaller(Size(500, 500), Size(50, 50)) is False
 
@@ -97,245 +91,205 @@ class TestResizerInternalMethods(object):
     def test_get_largest_projected_size_50x100_to_100x100_is_100x200(self):
         self._test_projected_size((50, 100), (100, 100), (100, 200), False)
 
-    def test_handle_downsize_adaption_calls_handle_common(self):
+    def test_plan_downsize_adaption_calls_plan_common(self):
         source, size, ext = object(), object(), object()
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_common')
+            .should_receive('_plan_common')
             .once()
             .with_args(source, size, ext)
-            .and_return(None)
+            .and_return(Operation())
         )
-        self.resizer._handle_downsize_adaption(source, size, ext)
+        self.resizer._plan_downsize_adaption(source, size, ext)
         called.verify()
 
-    def test_handle_adaption_throws_value_error_when_mode_is_throw(self):
+    def test_plan_downsize_adaption_sets_outcome(self):
+        op = self.resizer._plan_downsize_adaption(
+            Size(50, 50), Size(100, 100), None
+        )
+        assert op.outcome == 'downsized'
+
+    def test_plan_adaption_throws_value_error_when_mode_is_throw(self):
         self.resizer.adaption_mode = 'throw'
         try:
-            self.resizer._handle_adaption()
+            self.resizer._plan_adaption()
         except ValueError:
             return
         assert False
 
-    def test_handle_adaption_throws_value_error_for_unknown_mode(self):
+    def test_plan_adaption_throws_value_error_for_unknown_mode(self):
         self.resizer.adaption_mode = 'uusipaavalniemi'
         try:
-            self.resizer._handle_adaption()
+            self.resizer._plan_adaption()
         except ValueError:
             return
         assert False
 
-    def test_handle_adaption_returns_none_when_mode_is_ignore(self):
+    def test_plan_adaption_returns_ignored_operation_for_ignore(self):
         self.resizer.adaption_mode = 'ignore'
-        assert self.resizer._handle_adaption() is None
+        ext = object()
+        op = self.resizer._plan_adaption(None, None, ext)
+        assert op == Operation(format=ext, outcome='ignored')
 
-    def test_handle_adaption_calls_handle_downsize_adaption_for_downsize(self):
+    def test_plan_adaption_calls_plan_downsize_adaption_for_downsize(self):
         self.resizer.adaption_mode = 'downsize'
         args = [object(), object(), object()]
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_downsize_adaption')
+            .should_receive('_plan_downsize_adaption')
             .once()
             .with_args(*args)
             .and_return()
         )
-        self.resizer._handle_adaption(*args)
+        self.resizer._plan_adaption(*args)
         called.verify()
 
-    def test_handle_adaption_calls_handle_resize_adaption_for_resize(self):
+    def test_plan_adaption_calls_plan_resize_adaption_for_resize(self):
         self.resizer.adaption_mode = 'resize'
         args = [object(), object(), object()]
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_resize_adaption')
+            .should_receive('_plan_resize_adaption')
             .once()
             .with_args(*args)
             .and_return()
         )
-        self.resizer._handle_adaption(*args)
+        self.resizer._plan_adaption(*args)
         called.verify()
 
-    def _mock_handle_resize_adaption(self, get_projected_size=True,
-                                     resize=True, handle_size=True, width=0,
-                                     height=0):
-        if get_projected_size:
-            (flexmock(self.resizer)
-                .should_receive('_get_projected_size')
-                .and_return((width, height)))
-        if handle_size:
-            (flexmock(self.resizer)
-                .should_receive('_handle_size')
-                .and_return())
-
-        return flexmock(resize=lambda a, b: None)
-
-    def test_handle_resize_adaption_gets_projected_size(self):
-        size = object()
-        source = self._mock_handle_resize_adaption(get_projected_size=False)
+    def test_plan_resize_adaption_gets_projected_size(self):
+        source, size = object(), object()
+        (flexmock(self.resizer)
+            .should_receive('_plan_size')
+            .and_return(Operation()))
         called = (
             flexmock(self.resizer)
             .should_receive('_get_projected_size')
             .once()
-            .with_args(source, size, False)
-            .and_return((0, 0))
-        )
-
-        with FakeImage.context(full_cleanup=True):
-            self.resizer._handle_resize_adaption(source, size, None)
-        called.verify()
-
-    def test_handle_resize_adaption_resizes_image(self):
-        width, height, resize_mode = object(), object(), object()
-        source = self._mock_handle_resize_adaption(
-            resize=False, width=width, height=height
+            .with_args(source, size, smallest=False)
+            .and_return(Size(0, 0))
         )
-        self.resizer.resize_mode = resize_mode
-        called = (
-            flexmock(source)
-            .should_receive('resize')
-            .once()
-            .with_args((width, height), resize_mode)
-            .and_return()
-        )
-
-        with FakeImage.context(full_cleanup=True):
-            self.resizer._handle_resize_adaption(source, None, None)
+        self.resizer._plan_resize_adaption(source, size, None)
         called.verify()
 
-    def test_handle_resize_adaption_creates_an_image(self):
-        resized_source = object()
-        source = flexmock(resize=lambda a, b: resized_source)
-        self._mock_handle_resize_adaption()
-
-        with FakeImage.context():
-            self.resizer._handle_resize_adaption(source, None, None)
-
-        assert FakeImage.stack.pop().source is resized_source
-        assert len(FakeImage.stack) == 0
-
-    def test_handle_resize_adaption_calls_handle_size(self):
-        image, size, ext = object(), object(), object()
-        source = self._mock_handle_resize_adaption(handle_size=False)
-        flexmock(FakeImage).new_instances(image)
-
+    def test_plan_resize_adaption_plans_intermediate_size(self):
+        intermediate, size, ext = Size(10, 10), object(), object()
+        (flexmock(self.resizer)
+            .should_receive('_get_projected_size')
+            .and_return(intermediate))
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_size')
+            .should_receive('_plan_size')
             .once()
-            .with_args(image, size, ext)
+            .with_args(intermediate, size, ext)
+            .and_return(Operation())
         )
-        with FakeImage.context():
-            self.resizer._handle_resize_adaption(source, size, ext)
+        self.resizer._plan_resize_adaption(None, size, ext)
         called.verify()
 
-    def _mock_handle_crop(self, get_projected_size=True, handle_common=True,
-                          crop=True, width=0, height=0):
-        if get_projected_size:
-            (flexmock(self.resizer)
-                .should_receive('_get_projected_size')
-                .and_return((width, height)))
-        if handle_common:
-            (flexmock(self.resizer)
-                .should_receive('_handle_common')
-                .and_return())
-        return flexmock(crop=lambda a: None)
+    def test_plan_resize_adaption_returns_resized_operation(self):
+        self.resizer.precise = True
+        op = self.resizer._plan_resize_adaption(
+            Size(50, 100), Size(200, 200), 'png'
+        )
+        assert op == Operation(
+            size=Size(200, 200), format='png', crop=(0, 0, 200, 200),
+            intermediate=Size(200, 400), outcome='resized'
+        )
 
-    def test_handle_crop_gets_projected_size(self):
-        source = self._mock_handle_crop(get_projected_size=False)
-        size = object()
+    def test_plan_crop_gets_projected_size(self):
+        source, size = object(), Size(50, 50)
         called = (
             flexmock(self.resizer)
             .should_receive('_get_projected_size')
-            .once()
             .with_args(size, source)
-            .and_return((0, 0))
+            .once()
+            .and_return(Size(100, 100))
         )
-
-        with FakeImage.context(full_cleanup=True):
-            self.resizer._handle_crop(source, size, None)
+        (flexmock(self.resizer)
+            .should_receive('_plan_common')
+            .and_return(Operation()))
+        self.resizer._plan_crop(source, size, None)
         called.verify()
 
-    def test_handle_crop_crops_image(self):
-        width, height = object(), object()
-        source = self._mock_handle_crop(crop=False, width=width, height=height)
+    def test_plan_crop_plans_cropped_size(self):
+        size, ext = Size(50, 50), object()
+        (flexmock(self.resizer)
+            .should_receive('_get_projected_size')
+            .and_return(Size(100, 100)))
         called = (
-            source
-            .should_receive('crop')
+            flexmock(self.resizer)
+            .should_receive('_plan_common')
             .once()
-            .with_args((0, 0, width, height))
-            .and_return()
+            .with_args(Size(100, 100), size, ext)
+            .and_return(Operation())
         )
-
-        with FakeImage.context(full_cleanup=True):
-            self.resizer._handle_crop(source, None, None)
+        self.resizer._plan_crop(None, size, ext)
         called.verify()
 
-    def _mock_handle_precise(self, handle_common=True, handle_crop=True,
-                             image=None):
-        if handle_common:
+    def test_plan_crop_sets_crop_box(self):
+        op = self.resizer._plan_crop(Size(300, 200), Size(50, 50), None)
+        assert op.crop == (0, 0, 200, 200)
+        assert op.size == (50, 50)
+
+    def _mock_plan_precise(self, plan_common=True, plan_crop=True,
+                           size=None):
+        if plan_common:
             (flexmock(self.resizer)
-                .should_receive('_handle_common')
-                .and_return(image or Size(100, 150)))
-        if handle_crop:
+                .should_receive('_plan_common')
+                .and_return(Operation(size=size or Size(100, 150))))
+        if plan_crop:
             (flexmock(self.resizer)
-                .should_receive('_handle_crop')
+                .should_receive('_plan_crop')
                 .and_return())
 
-    def test_handle_precise_calls_handle_common(self):
+    def test_plan_precise_calls_plan_common(self):
         source, size, ext = object(), Size(100, 150), object()
-        self._mock_handle_precise(handle_common=False)
+        self._mock_plan_precise(plan_common=False)
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_common')
+            .should_receive('_plan_common')
             .once()
             .with_args(source, size, ext)
-            .and_return(Size(100, 150))
+            .and_return(Operation(size=Size(100, 150)))
         )
-        self.resizer._handle_precise(source, size, ext)
+        self.resizer._plan_precise(source, size, ext)
         called.verify()
 
-    def test_handle_precise_returns_handle_common_if_ratio_is_correct(self):
-        image = Size(100, 150)
-        self._mock_handle_precise(image=image)
-        im = self.resizer._handle_precise(None, Size(100, 150), None)
-        assert im is image
+    def test_plan_precise_returns_plan_common_if_ratio_is_correct(self):
+        op = Operation(size=Size(100, 150))
+        self._mock_plan_precise(plan_common=False)
+        (flexmock(self.resizer)
+            .should_receive('_plan_common')
+            .and_return(op))
+        assert self.resizer._plan_precise(None, Size(100, 150), None) is op
 
-    def test_handle_precise_returns_handle_crop_if_ratio_is_incorrect(self):
+    def test_plan_precise_returns_plan_crop_if_ratio_is_incorrect(self):
         self.resizer.crop = True
         source, size, ext, res = object(), Size(0, 0), object(), object()
-        self._mock_handle_precise(handle_crop=False)
+        self._mock_plan_precise(plan_crop=False)
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_crop')
+            .should_receive('_plan_crop')
             .once()
             .with_args(source, size, ext)
             .and_return(res)
         )
-        assert self.resizer._handle_precise(source, size, ext) is res
+        assert self.resizer._plan_precise(source, size, ext) is res
         called.verify()
 
-    def test_handle_precise_raises_value_error_if_crop_is_false(self):
+    def test_plan_precise_raises_value_error_if_crop_is_false(self):
         self.resizer.crop = False
-        self._mock_handle_precise()
+        self._mock_plan_precise()
 
         try:
-            self.resizer._handle_precise(None, Size(0, 0), None)
+            self.resizer._plan_precise(None, Size(0, 0), None)
         except ValueError:
             return
         assert False
 
-    def _mock_handle_common(self, get_projected_size=True, resize=True,
-                            size=None):
-        if get_projected_size:
-            (flexmock(self.resizer)
-                .should_receive('_get_projected_size')
-                .and_return(size))
-
-        return flexmock(resize=lambda a, b: None)
-
-    def test_handle_common_gets_projected_size(self):
-        source = self._mock_handle_common(get_projected_size=False)
-        size = object()
+    def test_plan_common_gets_projected_size(self):
+        source, size = object(), object()
         called = (
             flexmock(self.resizer)
             .should_receive('_get_projected_size')
@@ -343,73 +297,45 @@ class TestResizerInternalMethods(object):
             .with_args(source, size)
             .and_return()
         )
-        with FakeImage.context(full_cleanup=True):
-            self.resizer._handle_common(source, size, None)
+        self.resizer._plan_common(source, size, None)
         called.verify()
 
-    def test_handle_common_resizes_image(self):
-        size = object()
-        source = self._mock_handle_common(resize=False, size=size)
-        called = (
-            flexmock(source)
-            .should_receive('resize')
-            .once()
-            .with_args(size, self.resizer.resize_mode)
-            .and_return()
-        )
-        with FakeImage.context(full_cleanup=True):
-            self.resizer._handle_common(source, size, None)
-        called.verify()
+    def test_plan_common_returns_operation(self):
+        size, ext = object(), object()
+        (flexmock(self.resizer)
+            .should_receive('_get_projected_size')
+            .and_return(size))
+        op = self.resizer._plan_common(None, None, ext)
+        assert op == Operation(size=size, format=ext)
 
-    def test_handle_common_creates_image(self):
-        self._mock_handle_common()
-        resized_source = object()
-        source = flexmock(resize=lambda a, b: resized_source)
-        with FakeImage.context():
-            self.resizer._handle_common(source, None, None)
-        assert FakeImage.stack.pop().source is resized_source
-        assert len(FakeImage.stack) == 0
-
-    def test_handle_common_returns_image(self):
-        source = self._mock_handle_common()
-        fake_image = flexmock()
-        flexmock(FakeImage).new_instances(fake_image)
-        with FakeImage.context():
-            im = self.resizer._handle_common(source, None, None)
-        assert im is fake_image
-
-    def test_handle_common_sets_ext_on_image(self):
-        source = self._mock_handle_common()
+    def test_plan_size_returns_pass_through_operation_for_no_size(self):
         ext = object()
-        fake_image = flexmock()
-        flexmock(FakeImage).new_instances(fake_image)
-        with FakeImage.context():
-            self.resizer._handle_common(source, None, ext)
-        assert fake_image.ext is ext
-
-    def _mock_handle_size(self, is_smaller_val=False, handle_adaption=True,
-                          handle_precise=True, handle_common=True,
-                          is_smaller=True):
+        op = self.resizer._plan_size(None, None, ext)
+        assert op == Operation(format=ext)
+
+    def _mock_plan_size(self, is_smaller_val=False, plan_adaption=True,
+                        plan_precise=True, plan_common=True,
+                        is_smaller=True):
         if is_smaller:
             (flexmock(self.resizer)
                 .should_receive('_is_smaller')
                 .and_return(is_smaller_val))
-        if handle_adaption:
+        if plan_adaption:
             (flexmock(self.resizer)
-                .should_receive('_handle_adaption')
+                .should_receive('_plan_adaption')
                 .and_return())
-        if handle_precise:
+        if plan_precise:
             (flexmock(self.resizer)
-                .should_receive('_handle_precise')
+                .should_receive('_plan_precise')
                 .and_return())
-        if handle_common:
+        if plan_common:
             (flexmock(self.resizer)
-                .should_receive('_handle_common')
+                .should_receive('_plan_common')
                 .and_return())
         return object(), object(), object()
 
-    def test_handle_size_calls_is_smaller(self):
-        source, size, _ = self._mock_handle_size(is_smaller=False)
+    def test_plan_size_calls_is_smaller(self):
+        source, size, _ = self._mock_plan_size(is_smaller=False)
         called = (
             flexmock(self.resizer)
             .should_receive('_is_smaller')
@@ -417,119 +343,304 @@ class TestResizerInternalMethods(object):
             .with_args(source, size)
             .and_return()
         )
-        self.resizer._handle_size(source, size, None)
+        self.resizer._plan_size(source, size, None)
         called.verify()
 
-    def test_handle_size_calls_handle_adaption_if_is_smaller(self):
-        source, size, ext = self._mock_handle_size(True, handle_adaption=False)
+    def test_plan_size_calls_plan_adaption_if_is_smaller(self):
+        source, size, ext = self._mock_plan_size(True, plan_adaption=False)
         res = object()
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_adaption')
+            .should_receive('_plan_adaption')
             .once()
             .with_args(source, size, ext)
             .and_return(res)
         )
-        return_val = self.resizer._handle_size(source, size, ext)
+        return_val = self.resizer._plan_size(source, size, ext)
         called.verify()
         assert return_val is res
 
-    def test_handle_size_doesnt_call_handle_adaption_if_isnt_smaller(self):
-        source, size, ext = self._mock_handle_size(
-            False, handle_adaption=False
-        )
+    def test_plan_size_doesnt_call_plan_adaption_if_isnt_smaller(self):
+        source, size, ext = self._mock_plan_size(False, plan_adaption=False)
         (flexmock(self.resizer)
-            .should_receive('_handle_adaption')
+            .should_receive('_plan_adaption')
             .and_raise(AssertionError('Not supposed to be called')))
-        self.resizer._handle_size(source, size, ext)
+        self.resizer._plan_size(source, size, ext)
 
-    def test_handle_size_calls_handle_precise_if_precise_is_true(self):
+    def test_plan_size_calls_plan_precise_if_precise_is_true(self):
         self.resizer.precise = True
-        source, size, ext = self._mock_handle_size(False, handle_precise=False)
+        source, size, ext = self._mock_plan_size(False, plan_precise=False)
         res = object()
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_precise')
+            .should_receive('_plan_precise')
             .once()
             .with_args(source, size, ext)
             .and_return(res)
         )
-        return_val = self.resizer._handle_size(source, size, ext)
+        return_val = self.resizer._plan_size(source, size, ext)
         called.verify()
         assert return_val is res
 
-    def test_handle_size_doesnt_call_precise_if_precise_is_false(self):
-        self._mock_handle_size(False, handle_precise=False)
+    def test_plan_size_doesnt_call_precise_if_precise_is_false(self):
+        self._mock_plan_size(False, plan_precise=False)
         (flexmock(self.resizer)
-            .should_receive('_handle_precise')
+            .should_receive('_plan_precise')
             .and_raise(AssertionError('Not supposed to be called')))
-        self.resizer._handle_size(None, object(), None)
+        self.resizer._plan_size(None, object(), None)
 
-    def test_handle_size_doesnt_call_precise_if_is_smaller(self):
+    def test_plan_size_doesnt_call_precise_if_is_smaller(self):
         self.resizer.precise = True
-        self._mock_handle_size(True, handle_precise=False)
+        self._mock_plan_size(True, plan_precise=False)
         (flexmock(self.resizer)
-            .should_receive('_handle_precise')
+            .should_receive('_plan_precise')
             .and_raise(AssertionError('Not supposed to be called')))
-        self.resizer._handle_size(None, object(), None)
+        self.resizer._plan_size(None, object(), None)
 
-    def test_handle_size_calls_common_if_isnt_smaller_and_isnt_precise(self):
-        source, size, ext = self._mock_handle_size(False, handle_common=False)
+    def test_plan_size_calls_common_if_isnt_smaller_and_isnt_precise(self):
+        source, size, ext = self._mock_plan_size(False, plan_common=False)
         res = object()
         called = (
             flexmock(self.resizer)
-            .should_receive('_handle_common')
+            .should_receive('_plan_common')
             .once()
             .with_args(source, size, ext)
             .and_return(res)
         )
-        return_val = self.resizer._handle_size(source, size, ext)
+        return_val = self.resizer._plan_size(source, size, ext)
         called.verify()
         assert return_val is res
 
-    def test_handle_size_doesnt_call_common_if_is_smaller(self):
-        self._mock_handle_size(True, handle_common=False)
+    def test_plan_size_doesnt_call_common_if_is_smaller(self):
+        self._mock_plan_size(True, plan_common=False)
         (flexmock(self.resizer)
-            .should_receive('_handle_common')
+            .should_receive('_plan_common')
             .and_raise(AssertionError('Not supposed to be called')))
-        self.resizer._handle_size(None, object(), None)
+        self.resizer._plan_size(None, object(), None)
 
-    def test_handle_size_doesnt_call_common_if_is_precise(self):
+    def test_plan_size_doesnt_call_common_if_is_precise(self):
         self.resizer.precise = True
-        self._mock_handle_size(handle_common=False)
+        self._mock_plan_size(plan_common=False)
         (flexmock(self.resizer)
-            .should_receive('_handle_common')
+            .should_receive('_plan_common')
             .and_raise(AssertionError('Not supposed to be called')))
-        self.resizer._handle_size(None, object(), None)
+        self.resizer._plan_size(None, object(), None)
 
-    def test_resize_image_calls_handle_size_for_all_sizes(self):
-        pa_stack = []
-        hs_stack = []
+    def test_plan_calls_plan_size_for_all_sizes(self):
+        ps_stack = []
 
-        def parse_attrs(image, attrs):
-            pa_stack.append([image, attrs])
-            return attrs
+        def plan_size(*args):
+            ps_stack.append(args)
+            return Operation()
 
-        def handle_size(*args):
-            hs_stack.append(args)
-
-        flexmock(
-            self.resizer,
-            _parse_attrs=parse_attrs,
-            _handle_size=handle_size
-        )
+        flexmock(self.resizer, _plan_size=plan_size)
 
         self.resizer.sizes = {
             'small': (50, 50),
             'medium': (150, 200, 'png')
         }
 
+        class SizedImage(FakeImage):
+            size = Size(500, 500)
+
+        image = SizedImage(None)
+        image.ext = 'jpeg'
         with FakeImage.context(full_cleanup=True):
-            self.resizer.resize_image('none')
-
-        sizes = self.resizer.sizes.values()
-        assert len(pa_stack) == len(hs_stack) == 2
-        assert pa_stack[0][1] in sizes
-        assert pa_stack[1][1] in sizes
-        assert hs_stack[0][1:] in sizes
-        assert hs_stack[1][1:] in sizes
+            plan = self.resizer.plan(image)
+
+        assert sorted(plan.keys()) == ['medium', 'small']
+        assert sorted(ps_stack) == [
+            ((500, 500), (50, 50), 'jpeg'),
+            ((500, 500), (150, 200), 'png'),
+        ]
+
+    def test_plan_uses_default_format(self):
+        self.resizer.sizes = {'a': (10, 10), 'b': [None], 'c': ['gif']}
+        self.resizer.default_format = 'jpeg'
+        plan = self.resizer.plan(Image(pil_image.new('RGB', (20, 20))))
+        assert plan['a'].format == 'jpeg'
+        assert plan['b'].format == 'jpeg'
+        assert plan['c'].format == 'gif'
+
+    def test_sizes_are_compiled_largest_first(self):
+        self.resizer.sizes = {
+            'small': (10, 10), 'original': [], 'large': (100, 50, 'png'),
+            'medium': (30, 30, {'quality': 50}),
+        }
+        assert [spec.name for spec in self.resizer._specs] == [
+            'large', 'medium', 'small', 'original'
+        ]
+        assert self.resizer._specs[0] == (
+            'large', Size(100, 50), 'png', None
+        )
+        assert self.resizer._specs[1].options == {'quality': 50}
+
+    def test_invalid_sizes_raise_when_assigned(self):
+        sizes = {'a': (10, 10)}
+        self.resizer.sizes = sizes
+        for invalid in [{'b': (0, 10)}, {'b': (1, 2, 3, 4)}, {'b': 'png'}]:
+            try:
+                self.resizer.sizes = invalid
+            except ValueError, e:
+                assert "'b'" in str(e)
+            else:
+                assert False, invalid
+            assert self.resizer.sizes is sizes
+
+    def test_invalid_sizes_raise_when_constructed(self):
+        try:
+            Resizer(sizes={'a': (10, 0)})
+        except ValueError:
+            return
+        assert False
+
+    def test_sizes_changed_in_place_are_compiled_again(self):
+        sizes = {'a': [10, 10]}
+        self.resizer.sizes = sizes
+        sizes['b'] = (5, 5)
+        sizes['a'][:] = [20, 20]
+        plan = self.resizer.plan(Image(pil_image.new('RGB', (40, 40))))
+        assert plan['a'].size == (20, 20)
+        assert plan['b'].size == (5, 5)
+
+    def test_plan_attaches_options(self):
+        self.resizer.sizes = {
+            'small': (50, 50, 'jpg', {'quality': 50}),
+            'original': [{'optimize': True}],
+            'medium': (100, 100),
+        }
+        plan = self.resizer.plan(Image(pil_image.new('RGB', (200, 200))))
+        assert plan['small'] == Operation(
+            size=Size(50, 50), format='jpg', options={'quality': 50}
+        )
+        assert plan['original'] == Operation(
+            format='png', options={'optimize': True}
+        )
+        assert plan['medium'].options is None
+
+    def test_plan_raises_value_error_if_sizes_is_none(self):
+        try:
+            self.resizer.plan(None)
+        except ValueError:
+            return
+        assert False
+
+    def test_resize_image_executes_plan(self):
+        image, plan, res = FakeImage(None), object(), object()
+        self.resizer.sizes = {}
+        (flexmock(self.resizer)
+            .should_receive('_plan')
+            .with_args(image)
+            .and_return(plan))
+        called = (
+            flexmock(self.resizer)
+            .should_receive('_execute')
+            .once()
+            .with_args(image, plan, False)
+            .and_return(res)
+        )
+        with FakeImage.context(full_cleanup=True):
+            assert self.resizer.resize_image(image) is res
+        called.verify()
+
+    def test_execute_skips_ignored_operations(self):
+        plan = {'small': Operation(outcome='ignored')}
+        assert self.resizer._execute(None, plan, False) == {}
+
+    def test_execute_executes_largest_operations_first(self):
+        executed = []
+
+        def execute_operation(source, header, regions, operation, name,
+                              owned):
+            executed.append(operation)
+
+        flexmock(self.resizer, _execute_operation=execute_operation)
+        plan = {
+            'small': Operation(size=Size(10, 10)),
+            'original': Operation(),
+            'large': Operation(size=Size(100, 10)),
+        }
+        self.resizer._execute(flexmock(load=lambda: None), plan, False)
+        assert executed == [plan['large'], plan['small'], plan['original']]
+
+    def test_execute_operation_does_not_resize_to_same_size(self):
+        source = flexmock(size=Size(10, 10))
+        (source
+            .should_receive('resize')
+            .and_raise(AssertionError('Not supposed to be called')))
+        with FakeImage.context(full_cleanup=True):
+            image = self.resizer._execute_operation(
+                source, None, {}, Operation(size=Size(10, 10), format='png')
+            )
+        assert image.source is source
+        assert image.ext == 'png'
+
+    def test_get_cascade_base_returns_smallest_large_enough_image(self):
+        images = [Size(1000, 1000), Size(500, 500), Size(200, 200),
+                  Size(99, 99)]
+        base = self.resizer._get_cascade_base(images, Size(100, 100))
+        assert base is images[2]
+
+    def test_get_cascade_base_returns_region_if_nothing_is_large_enough(self):
+        self.resizer.cascade_tolerance = 3
+        images = [Size(1000, 1000), Size(200, 200)]
+        base = self.resizer._get_cascade_base(images, Size(100, 100))
+        assert base is images[0]
+
+    def test_prune_intermediates_keeps_bases_of_remaining_sizes(self):
+        images = [Size(1000, 1000), Size(500, 500), Size(300, 300),
+                  Size(150, 150)]
+        region, medium = images[0], images[2]
+        self.resizer._prune_intermediates(images, [Size(120, 120)])
+        assert images == [region, medium]
+        assert images[1] is medium
+
+    def test_prune_intermediates_keeps_only_region_without_bases(self):
+        images = [Size(1000, 1000), Size(500, 500)]
+        self.resizer._prune_intermediates(images, [Size(400, 400)])
+        assert len(images) == 1
+
+    def test_scale_box_scales_box(self):
+        box = self.resizer._scale_box((0, 0, 50, 30), (100, 60), (25, 15))
+        assert box == (0, 0, 13, 8)
+
+    def test_draft_drafts_to_cover_all_sizes(self):
+        source = flexmock(size=Size(1000, 500), mode='RGB')
+        called = (
+            source
+            .should_receive('draft')
+            .once()
+            .with_args('RGB', (200, 100))
+        )
+        self.resizer._draft(source, [
+            Operation(size=Size(100, 50)),
+            Operation(size=Size(100, 100), crop=(0, 0, 500, 500)),
+        ])
+        called.verify()
+
+    def test_draft_returns_header_if_size_changed(self):
+        source = flexmock(size=Size(1000, 500), mode='RGB')
+
+        def draft(mode, size):
+            source.size = Size(500, 250)
+
+        source.draft = draft
+        header = self.resizer._draft(source, [Operation(size=Size(100, 50))])
+        assert header == (1000, 500)
+
+    def test_draft_does_not_draft_for_pass_through_sizes(self):
+        source = flexmock(size=Size(1000, 500))
+        (source
+            .should_receive('draft')
+            .and_raise(AssertionError('Not supposed to be called')))
+        self.resizer._draft(source, [Operation(size=Size(100, 50)),
+                                     Operation()])
+
+    def test_draft_does_not_draft_for_enlarged_sizes(self):
+        source = flexmock(size=Size(1000, 500))
+        (source
+            .should_receive('draft')
+            .and_raise(AssertionError('Not supposed to be called')))
+        self.resizer._draft(source, [
+            Operation(size=Size(100, 50), intermediate=Size(2000, 1000))
+        ])
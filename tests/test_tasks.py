@@ -0,0 +1,107 @@
+from __future__ import with_statement
+import threading
+import time
+from StringIO import StringIO
+from PIL import Image as pil_image
+from resizer import Image, Resizer
+from .server import Server
+
+
+class TestTasks(object):
+    def setup_method(self, method):
+        self.server = Server()
+        data = StringIO()
+        pil_image.new('RGB', (400, 300)).save(data, 'JPEG')
+        self.data = data.getvalue()
+        self.server.route('/image.jpg', self.data)
+        self.resizer = Resizer(sizes={'small': (40, 40), 'original': []})
+
+    def teardown_method(self, method):
+        self.server.stop()
+
+    def test_resize_image_async_resizes_urls(self):
+        task = self.resizer.resize_image_async(self.server.url('/image.jpg'))
+        images = task.get(5)
+        assert task.successful()
+        assert images['small'].size == (40, 30)
+        assert images['original'].size == (400, 300)
+
+    def test_resize_image_async_resizes_other_sources(self):
+        images = self.resizer.resize_image_async(StringIO(self.data)).get(5)
+        assert images['small'].size == (40, 30)
+
+    def test_resize_image_async_drafts_urls(self):
+        self.resizer.draft = True
+        self.resizer.sizes.pop('original')
+        images = self.resizer.resize_image_async(
+            self.server.url('/image.jpg')
+        ).get(5)
+        assert images['small'].size == (40, 30)
+
+    def test_resize_image_async_calls_callback(self):
+        done = []
+        event = threading.Event()
+
+        def callback(task):
+            done.append(task)
+            event.set()
+
+        task = self.resizer.resize_image_async(
+            self.server.url('/image.jpg'), callback
+        )
+        event.wait(5)
+        assert done == [task]
+        assert task.ready()
+
+    def test_resize_image_async_raises_errors_from_get(self):
+        task = self.resizer.resize_image_async(
+            self.server.url('/nonexistent')
+        )
+        task.wait(5)
+        assert not task.successful()
+        try:
+            task.get()
+        except IOError:
+            return
+        assert False
+
+    def test_resize_image_async_raises_errors_from_resizing(self):
+        self.resizer.adaption_mode = 'throw'
+        self.resizer.sizes['huge'] = (1000, 1000)
+        task = self.resizer.resize_image_async(self.server.url('/image.jpg'))
+        try:
+            task.get(5)
+        except ValueError:
+            return
+        assert False
+
+    def test_resize_image_async_limits_concurrency(self):
+        self.resizer.concurrency = 2
+        running = [0]
+        peak = [0]
+        lock = threading.Lock()
+        resize_image = self.resizer.resize_image
+
+        def slow_resize_image(image):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return resize_image(image)
+
+        self.resizer.resize_image = slow_resize_image
+        tasks = [
+            self.resizer.resize_image_async(StringIO(self.data))
+            for _ in xrange(8)
+        ]
+        for task in tasks:
+            task.get(5)
+        assert peak[0] == 2
+
+    def test_open_async_opens_image(self):
+        task = Image.open_async(self.server.url('/image.jpg'), timeout=5)
+        image = task.get(5)
+        assert image.size == (400, 300)
+        assert image.ext == 'jpeg'
@@ -0,0 +1,132 @@
+from StringIO import StringIO
+from flexmock import flexmock
+from PIL import Image as pil_image
+from resizer import Resizer, Image, add_tracer, remove_tracer, fetch, trace
+
+
+class TestTrace(object):
+    def setup_method(self, method):
+        self.spans = []
+        self.tracer = self.spans.append
+        add_tracer(self.tracer)
+        self.source = pil_image.new('RGB', (300, 200))
+        self.source.format = 'JPEG'
+
+    def teardown_method(self, method):
+        remove_tracer(self.tracer)
+
+    def _get_spans(self, stage):
+        return [span for span in self.spans if span.stage == stage]
+
+    def test_resize_image_traces_stages(self):
+        resizer = Resizer(sizes={'small': (30, 30), 'original': []})
+        resizer.resize_image(self.source)
+        assert [span.stage for span in self.spans] == [
+            'plan', 'plan', 'decode', 'resize', 'render', 'render'
+        ]
+        decode, resize = self.spans[2:4]
+        assert decode.attrs == {'size': (300, 200), 'format': 'jpeg'}
+        assert resize.attrs == {
+            'name': 'small',
+            'source_size': (300, 200),
+            'size': (30, 20),
+        }
+        assert resize.duration >= 0
+        assert resize.start >= decode.start
+        assert sorted(
+            (span.attrs['name'], span.attrs['size'])
+            for span in self._get_spans('render')
+        ) == [('original', (300, 200)), ('small', (30, 20))]
+
+    def test_plan_traces_outcomes(self):
+        resizer = Resizer(sizes={'huge': (1000, 1000)}, adaption_mode='ignore')
+        resizer.resize_image(self.source)
+        assert self._get_spans('plan')[0].attrs == {
+            'name': 'huge',
+            'outcome': 'ignored',
+            'precise': False,
+            'crop': False,
+            'raised': False,
+        }
+
+    def test_plan_traces_aspect_ratio_errors_as_no_adaption(self):
+        resizer = Resizer(sizes={'square': (10, 10)}, precise=True,
+                          crop=False)
+        try:
+            resizer.resize_image(self.source)
+        except ValueError:
+            pass
+        assert self._get_spans('plan')[0].attrs == {
+            'name': 'square',
+            'outcome': None,
+            'precise': True,
+            'crop': False,
+            'raised': True,
+        }
+
+    def test_plan_is_not_traced(self):
+        resizer = Resizer(sizes={'small': (30, 30)})
+        resizer.plan(self.source)
+        assert self.spans == []
+
+    def test_resize_image_traces_crops(self):
+        resizer = Resizer(precise=True, crop=True, sizes={'square': (50, 50)})
+        resizer.resize_image(self.source)
+        crop = self._get_spans('crop')[0]
+        assert crop.attrs == {
+            'name': 'square',
+            'source_size': (300, 200),
+            'box': (0, 0, 200, 200),
+        }
+        assert self._get_spans('resize')[0].attrs['source_size'] == (200, 200)
+
+    def test_resize_image_traces_threaded_resizing(self):
+        resizer = Resizer(threads=2, sizes={'a': (30, 30), 'b': (60, 60)})
+        resizer.resize_image(self.source)
+        names = [span.attrs['name'] for span in self._get_spans('resize')]
+        assert sorted(names) == ['a', 'b']
+
+    def test_encode_all_traces_encoding(self):
+        resizer = Resizer(sizes={'small': (30, 30, 'png')})
+        images = resizer.resize_image(self.source)
+        data = resizer.encode_all(images)['small']
+        encode = self._get_spans('encode')[0]
+        assert encode.attrs == {
+            'name': 'small',
+            'format': 'png',
+            'size': (30, 20),
+            'bytes': len(data),
+        }
+
+    def test_encode_traces_encoding(self):
+        data = Image(self.source, copy=False).encode()
+        assert self._get_spans('encode')[0].attrs['bytes'] == len(data)
+
+    def test_loading_from_url_traces_fetching(self):
+        data = StringIO()
+        self.source.save(data, 'JPEG')
+        (flexmock(fetch)
+            .should_receive('open_url')
+            .and_return(flexmock(
+                read=StringIO(data.getvalue()).read,
+                getheader=lambda name: None,
+                close=lambda: None
+            )))
+        Image('http://nonexistent/image.jpeg')
+        assert self._get_spans('fetch')[0].attrs == {
+            'url': 'http://nonexistent/image.jpeg',
+            'bytes': len(data.getvalue()),
+        }
+
+    def test_removed_tracers_are_not_called(self):
+        remove_tracer(self.tracer)
+        Resizer(sizes={'small': (30, 30)}).resize_image(self.source)
+        assert self.spans == []
+        assert trace.tracers == ()
+
+    def test_nothing_is_timed_without_tracers(self):
+        remove_tracer(self.tracer)
+        (flexmock(trace)
+            .should_receive('start')
+            .never())
+        Resizer(sizes={'small': (30, 30)}).resize_image(self.source)